@@ -1,55 +1,38 @@
-import os
-import zipfile
 from pathlib import Path
 
-from loguru import logger
-
-
-def load_file(filepath):
-    content = None
-    try:
-        if zipfile.is_zipfile(f"{filepath}.zip"):
-            with zipfile.ZipFile(f"{filepath}.zip", 'r') as z:
-                with z.open(os.path.basename(filepath)) as file:
-                    content = file.read().decode('utf-8')
-        else:
-            with open(filepath, 'r') as file:
-                content = file.read()
-    except FileNotFoundError:
-        logger.error(f"{filepath} not found.")
-    except zipfile.BadZipFile:
-        logger.error(f"{filepath}.zip is not a valid zip file.")
-    except IOError:
-        logger.error(f"Could not read {filepath}.")
-    except Exception as e:
-        logger.exception("An unexpected error occurred")
-
-    return content
-
-
-def save_file(filepath, content, zip_mode=False):
-    try:
-        if zip_mode:
-            with zipfile.ZipFile(f"{filepath}.zip", 'w') as z:
-                z.writestr(os.path.basename(filepath), content)
-        else:
-            with open(filepath, 'w') as file:
-                file.write(content)
-
-        logger.info(f"File saved at {filepath}")
-    except IOError:
-        logger.error(f"Could not write to {filepath}.")
-    except Exception as e:
-        logger.exception("An unexpected error occurred")
-
-
-def file_exists(filepath):
-    file = Path(filepath)
-    zip_file = Path(f"{filepath}.zip")
-    return file.exists() or zip_file.exists()
+import utils
 
 
 class FileHandler:
-    def __init__(self):
-        pass
+    """Files under one directory, {PYSCALPIE_PATH} by default, read and written through the utils I/O layer.
 
+    Names are relative to the directory. Reads find the plain, zipped or zstd version of a file by
+    themselves, writes use the handler's codec (None, 'zip' or 'zstd') and replace files atomically.
+    """
+
+    def __init__(self, directory=None, codec=None):
+        self.directory = Path(directory or utils.PYSCALPIE_PATH)
+        self.codec = codec
+
+    def path(self, name) -> Path:
+        return self.directory / name
+
+    def exists(self, name) -> bool:
+        return utils.file_exists(self.path(name))
+
+    def load(self, name):
+        """The whole file as a str, None when it can't be read. Use lines() or chunks() for large files."""
+        return utils.load_file(self.path(name))
+
+    def lines(self, name, encoding='utf-8'):
+        return utils.iter_lines(self.path(name), encoding)
+
+    def chunks(self, name, chunk_size: int = utils.CHUNK_BYTES):
+        return utils.iter_bytes(self.path(name), chunk_size)
+
+    def map(self, name):
+        return utils.map_file(self.path(name))
+
+    def save(self, name, content):
+        self.path(name).parent.mkdir(parents=True, exist_ok=True)
+        utils.save_file(self.path(name), content, codec=self.codec)
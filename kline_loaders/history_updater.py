@@ -1,21 +1,68 @@
-import importlib
+import argparse
 import json
 import os
+import threading
+import time
+from pathlib import Path
 
 from loguru import logger
 
 from kline_loaders.file_handler import FileHandler
+from kline_loaders.intervals import check_derived_interval, interval_seconds
+from kline_loaders.loader_registry import LoaderRegistry, loader_spec
+from kline_loaders.rate_limiter import WeightRateLimiter
+from kline_loaders.run_metrics import RunMetrics
 import utils
 
+# pandas, requests and asyncio are imported by the methods that need them, a run without jobs never loads them
+
+CHECKPOINT_ROWS = 10_000
+FETCH_WORKERS = 1
+METRICS_FILENAME = "run-metrics.json"
+
+
+def derivable_intervals(connection_name: str, intervals: list) -> list:
+    """The intervals that can be derived from the finest of them, the others are logged and left out up front so
+    they never fail a download job."""
+    valid = []
+    for interval in intervals:
+        try:
+            interval_seconds(interval)
+            valid.append(interval)
+        except ValueError as e:
+            logger.error(f"Skipping {interval} of {connection_name}: {e}")
+    if not valid:
+        return []
+
+    base_interval = min(valid, key=interval_seconds)
+    derivable = [base_interval]
+    for interval in valid:
+        if interval == base_interval:
+            continue
+        try:
+            check_derived_interval(base_interval, interval)
+            derivable.append(interval)
+        except ValueError as e:
+            logger.error(f"Skipping {interval} of {connection_name}, it can't be derived from {base_interval}: {e}")
+    return derivable
+
 
 class HistoryUpdater:
-    def __init__(self):
-        self.connections = self.load_connections() or []
+    def __init__(self, metrics_json=None, prometheus_textfile=None):
+        """metrics_json ({PYSCALPIE_PATH}/run-metrics.json by default) and prometheus_textfile, when given, get the
+        run's metrics once main() or main_async() finishes."""
         self.file_handler = FileHandler()
+        self.metrics = RunMetrics()
+        self.metrics_json = metrics_json or self.file_handler.path(METRICS_FILENAME)
+        self.prometheus_textfile = prometheus_textfile
+        self.connections = self.load_connections() or {}
+        self.loaders = LoaderRegistry()
+        self.rate_limiters = {}
+        self.rate_limiters_lock = threading.Lock()
 
     def load_connections(self):
-        filepath = utils.PYSCALPIE_PATH / "connections.json"
-        content = utils.load_file(filepath)
+        filepath = self.file_handler.path("connections.json")
+        content = self.file_handler.load("connections.json")
 
         connections_map = {}
         if content:
@@ -24,7 +71,10 @@ class HistoryUpdater:
                 for connection in connections_list:
                     name = connection.get('name')
                     if name:
-                        connections_map[name] = connection.get('details', {})
+                        details = connection.get('details', {})
+                        if details.get('deriveIntervals', False) and 'historyIntervals' in details:
+                            details['historyIntervals'] = derivable_intervals(name, details['historyIntervals'])
+                        connections_map[name] = details
                     else:
                         logger.warning("Connection without a name found!")
             except json.JSONDecodeError:
@@ -32,7 +82,7 @@ class HistoryUpdater:
 
         return connections_map if connections_map else None
 
-    def main(self):
+    def jobs(self):
         for connection_name, connection_details in self.connections.items():
             if not connection_details.get('enabled', True):
                 continue
@@ -40,47 +90,157 @@ class HistoryUpdater:
             history_symbols = connection_details.get('historySymbols', [])  # might not want history for symbol
             history_intervals = connection_details.get('historyIntervals',
                                                        ["5m"])  # defaulting to 5 mins if not provided
+            if connection_details.get('deriveIntervals', False):
+                # Only download the finest interval, update() builds the others from it
+                history_intervals = [min(history_intervals, key=interval_seconds)] if history_intervals else []
 
             for symbol in history_symbols:
                 for interval in history_intervals:
-                    try:
-                        class_name = connection_name.capitalize() + 'KlineHistoryLoader'
-                        module_name = connection_name + '_kline_history_loader'
-                        module = importlib.import_module(module_name)
-                        class_ = getattr(module, class_name)
-
-                        latest_date_file = utils.PYSCALPIE_PATH / connection_name / f"{symbol}-{interval}-latest-date"
-                        kline_filename = utils.PYSCALPIE_PATH / connection_name / f"{symbol}-{interval}.csv"
-                        os.makedirs(utils.PYSCALPIE_PATH / connection_name, exist_ok=True)
-                        latest_date_content = utils.file_exists(latest_date_file) and utils.load_file(latest_date_file)
-
-                        start_date = None
-                        if latest_date_content:
-                            start_date = latest_date_content
-
-                        instance = class_(connection_details['host'], symbol, interval)
-                        logger.info(
-                            f"Successfully created an instance of {module_name}.{class_name}")
-
-                        if start_date is None:
-                            start_date = instance.find_earliest_candle().strftime('%Y-%m-%d %H:%M')
-                            logger.info(f"Initial date of {start_date} found")
-
-                        df = instance.fetch_data(start_date)
-                        write_header = not utils.file_exists(kline_filename)
-                        df.to_csv(kline_filename, mode='a', index=False, header=write_header)
-                        with open(latest_date_file, 'w') as file:
-                            file.write(instance.get_last_time)
-                    except ImportError:
-                        logger.error(f"Failed to import {module_name}")
-                    except AttributeError as e:
-                        logger.error(f"{module_name} does not have a class named {class_name}")
-                        raise e
-                    except Exception as e:
-                        logger.exception(
-                            f"An unexpected error occurred while creating an instance of {module_name}.{class_name}", e)
+                    yield connection_name, connection_details, symbol, interval
+
+    def get_rate_limiter(self, connection_name, connection_details, class_):
+        # One request budget per connection, shared by every symbol and interval job that uses it
+        with self.rate_limiters_lock:
+            if connection_name not in self.rate_limiters:
+                weight_limit = connection_details.get('requestWeightPerMinute', class_.weight_limit)
+                self.rate_limiters[connection_name] = WeightRateLimiter(
+                    weight_limit, used_weight_header=class_.used_weight_header)
+            return self.rate_limiters[connection_name]
+
+    def update(self, connection_name, connection_details, symbol, interval) -> bool:
+        """Download, store and derive one symbol/interval job, returns whether it succeeded. Failures are logged
+        and counted in failed_jobs, only a missing loader class raises."""
+        from kline_loaders.kline_resampler import update_derived_interval
+        from kline_loaders.kline_store import KlineStore
+
+        store = KlineStore(utils.PYSCALPIE_PATH / connection_name)
+        spec = loader_spec(connection_name, connection_details)
+        labels = (connection_name, symbol, interval)
+        start = time.perf_counter()
+        try:
+            class_ = self.loaders.get(connection_name, connection_details)
+
+            latest_date_name = Path(connection_name) / f"{symbol}-{interval}-latest-date"
+            latest_date_file = self.file_handler.path(latest_date_name)
+            kline_filename = utils.PYSCALPIE_PATH / connection_name / f"{symbol}-{interval}.csv"
+            os.makedirs(utils.PYSCALPIE_PATH / connection_name, exist_ok=True)
+            latest_date_content = self.file_handler.exists(latest_date_name) and self.file_handler.load(latest_date_name)
+
+            start_date = None
+            if latest_date_content:
+                start_date = latest_date_content
+
+            rate_limiter = self.get_rate_limiter(connection_name, connection_details, class_)
+            # 'float32' halves the memory and storage of prices and volumes, at about 7 significant digits
+            instance = class_(connection_details['host'], symbol, interval, rate_limiter=rate_limiter,
+                              float_dtype=connection_details.get('floatDtype', 'float64'), metrics=self.metrics)
+            instance.metric_labels = labels  # by connection, two connections may use the same loader
+            logger.info(f"Successfully created an instance of {spec}")
+
+            if kline_filename.exists():
+                store.migrate_csv(symbol, interval, kline_filename, instance.frame_dtypes)
+
+            if start_date is None:
+                start_date = instance.find_earliest_candle().strftime('%Y-%m-%d %H:%M')
+                logger.info(f"Initial date of {start_date} found")
+
+            # Checkpoint every batch: store it, then move the resume cursor past it. A crash in between
+            # only means the batch is fetched again and upserted over itself.
+            checkpoint_rows = connection_details.get('checkpointRows', CHECKPOINT_ROWS)
+            # Pages fetched at a time within the job, all of them drawing on the connection's rate limiter
+            fetch_workers = connection_details.get('fetchWorkers', FETCH_WORKERS)
+            for batch in instance.iter_batches(start_date, rows=checkpoint_rows, workers=fetch_workers):
+                with self.metrics.timer(labels, 'store_seconds'):
+                    store.write(symbol, interval, batch)
+                    utils.atomic_write(latest_date_file, instance.get_resume_time)
+
+            if connection_details.get('deriveIntervals', False):
+                with self.metrics.timer(labels, 'derive_seconds'):
+                    for derived_interval in connection_details.get('historyIntervals', []):
+                        if derived_interval != interval:
+                            update_derived_interval(store, symbol, interval, derived_interval)
+
+            indicators = connection_details.get('indicators')
+            if indicators:
+                from kline_loaders.indicators import update_indicators
+
+                with self.metrics.timer(labels, 'indicator_seconds'):
+                    intervals = connection_details.get('historyIntervals', []) \
+                        if connection_details.get('deriveIntervals', False) else [interval]
+                    for indicator_interval in intervals:
+                        update_indicators(store.root, symbol, indicator_interval, indicators)
+            return True
+        except ImportError:
+            self.metrics.add(labels, 'failed_jobs')
+            logger.error(f"Failed to import the loader {spec}")
+            return False
+        except AttributeError as e:
+            self.metrics.add(labels, 'failed_jobs')
+            logger.error(f"The loader {spec} does not exist")
+            raise e
+        except Exception as e:
+            self.metrics.add(labels, 'failed_jobs')
+            logger.exception(f"An unexpected error occurred while updating {symbol} {interval} with {spec}", e)
+            return False
+        finally:
+            self.metrics.add(labels, 'jobs')
+            self.metrics.add(labels, 'job_seconds', time.perf_counter() - start)
+
+    def update_panels(self):
+        """Extend the price panels of connections with 'panelFields' by the bars the run stored."""
+        for connection_name, connection_details in self.connections.items():
+            fields = connection_details.get('panelFields')
+            if not fields or not connection_details.get('enabled', True):
+                continue
+
+            # Only a run with panels pays for numpy and pandas
+            from kline_loaders.price_panel import update_panel
+
+            for interval in connection_details.get('historyIntervals', ["5m"]):
+                try:
+                    update_panel(utils.PYSCALPIE_PATH / connection_name, interval,
+                                 connection_details.get('historySymbols', []), fields,
+                                 connection_details.get('floatDtype', 'float64'))
+                except Exception as e:
+                    logger.exception(f"An unexpected error occurred while updating the {interval} panel of "
+                                     f"{connection_name}", e)
+
+    def write_metrics(self):
+        self.metrics.write_json(self.metrics_json)
+        logger.info(f"Run metrics written to {self.metrics_json}")
+        if self.prometheus_textfile:
+            self.metrics.write_prometheus(self.prometheus_textfile)
+
+    def main(self):
+        try:
+            for connection_name, connection_details, symbol, interval in self.jobs():
+                self.update(connection_name, connection_details, symbol, interval)
+            self.update_panels()
+        finally:
+            self.write_metrics()
+
+    def main_async(self):
+        import asyncio
+
+        from kline_loaders.update_scheduler import UpdateScheduler
+
+        try:
+            asyncio.run(UpdateScheduler(self).run())
+            self.update_panels()
+        finally:
+            self.write_metrics()
 
 
 if __name__ == "__main__":
-    updater = HistoryUpdater()
-    updater.main()
+    parser = argparse.ArgumentParser(description="Download kline history for every configured connection")
+    parser.add_argument('--concurrent', action='store_true', help="run symbol/interval jobs concurrently")
+    parser.add_argument('--metrics-json', help=f"run summary file (default: PYSCALPIE_DIR/{METRICS_FILENAME})")
+    parser.add_argument('--prometheus-textfile', help="also write the metrics here, e.g. into node exporter's "
+                                                      "textfile directory as pyscalpie.prom")
+    args = parser.parse_args()
+
+    updater = HistoryUpdater(args.metrics_json, args.prometheus_textfile)
+    if args.concurrent:
+        updater.main_async()
+    else:
+        updater.main()
@@ -0,0 +1,374 @@
+import argparse
+import json
+import os
+
+import numpy as np
+import pandas as pd
+from loguru import logger
+
+import utils
+from kline_loaders.kline_store import KlineStore
+
+ENGINE_VERSION = 2
+DAY_NS = 86_400 * 1_000_000_000
+
+
+def ewm(values: np.ndarray, alpha: float, seed) -> np.ndarray:
+    """y[i] = alpha * values[i] + (1 - alpha) * y[i - 1], y[-1] = seed, starting at values[0] without one."""
+    if seed is None:
+        return pd.Series(values).ewm(alpha=alpha, adjust=False).mean().to_numpy(copy=True)
+    return pd.Series(np.concatenate([[seed], values])).ewm(alpha=alpha, adjust=False).mean().to_numpy(copy=True)[1:]
+
+
+def warm(values: np.ndarray, count: int, period: int) -> np.ndarray:
+    """values with NaN for the bars before the period-th one, count bars having come before them."""
+    cold = max(min(period - 1 - count, len(values)), 0)
+    values[:cold] = np.nan
+    return values
+
+
+class EMA:
+    """Exponential moving average of close, alpha = 2 / (period + 1), seeded with the first close."""
+    columns = ['close']
+
+    def __init__(self, period: int):
+        self.period = period
+        self.name = f"ema_{period}"
+        self.alpha = 2 / (period + 1)
+
+    def batch(self, bars: dict, state: dict) -> tuple:
+        state = state or {'value': None, 'count': 0}
+        values = ewm(bars['close'], self.alpha, state['value'])
+        new_state = {'value': float(values[-1]), 'count': state['count'] + len(values)}
+        return warm(values, state['count'], self.period), new_state
+
+    def step(self, bar: dict, state: dict) -> tuple:
+        state = state or {'value': None, 'count': 0}
+        value = bar['close'] if state['value'] is None else \
+            (1 - self.alpha) * state['value'] + self.alpha * bar['close']
+        count = state['count'] + 1
+        return value if count >= self.period else np.nan, {'value': value, 'count': count}
+
+
+class RSI:
+    """Wilder's relative strength index of close, averages of gains and losses with alpha = 1 / period."""
+    columns = ['close']
+
+    def __init__(self, period: int):
+        self.period = period
+        self.name = f"rsi_{period}"
+        self.alpha = 1 / period
+
+    def batch(self, bars: dict, state: dict) -> tuple:
+        state = state or {'close': None, 'gain': None, 'loss': None, 'count': 0}
+        close = bars['close']
+        previous = np.concatenate([[np.nan if state['close'] is None else state['close']], close[:-1]])
+        change = close - previous
+        # The first bar ever has no change, its RSI stays NaN and the averages start at the second
+        first = 1 if state['close'] is None else 0
+        gain = np.full(len(close), np.nan)
+        loss = np.full(len(close), np.nan)
+        if len(close) > first:
+            gain[first:] = ewm(np.maximum(change[first:], 0.0), self.alpha, state['gain'])
+            loss[first:] = ewm(np.maximum(-change[first:], 0.0), self.alpha, state['loss'])
+        with np.errstate(divide='ignore', invalid='ignore'):
+            values = np.where(loss == 0, 100.0, 100 - 100 / (1 + gain / loss))
+        values[np.isnan(gain)] = np.nan
+
+        changes = len(close) - first
+        new_state = {'close': float(close[-1]), 'count': state['count'] + changes,
+                     'gain': float(gain[-1]) if changes else state['gain'],
+                     'loss': float(loss[-1]) if changes else state['loss']}
+        values[first:] = warm(values[first:], state['count'], self.period)
+        return values, new_state
+
+    def step(self, bar: dict, state: dict) -> tuple:
+        state = state or {'close': None, 'gain': None, 'loss': None, 'count': 0}
+        if state['close'] is None:
+            return np.nan, {**state, 'close': bar['close']}
+        change = bar['close'] - state['close']
+        gain, loss = max(change, 0.0), max(-change, 0.0)
+        if state['gain'] is not None:
+            gain = (1 - self.alpha) * state['gain'] + self.alpha * gain
+            loss = (1 - self.alpha) * state['loss'] + self.alpha * loss
+        count = state['count'] + 1
+        value = 100.0 if loss == 0 else 100 - 100 / (1 + gain / loss)
+        return value if count >= self.period else np.nan, {'close': bar['close'], 'gain': gain, 'loss': loss,
+                                                           'count': count}
+
+
+class ATR:
+    """Wilder's average true range, alpha = 1 / period. The first bar's true range is its high - low."""
+    columns = ['high', 'low', 'close']
+
+    def __init__(self, period: int):
+        self.period = period
+        self.name = f"atr_{period}"
+        self.alpha = 1 / period
+
+    def batch(self, bars: dict, state: dict) -> tuple:
+        state = state or {'close': None, 'value': None, 'count': 0}
+        high, low, close = bars['high'], bars['low'], bars['close']
+        previous = np.concatenate([[np.nan if state['close'] is None else state['close']], close[:-1]])
+        true_range = np.fmax(high - low, np.fmax(np.abs(high - previous), np.abs(low - previous)))
+        values = ewm(true_range, self.alpha, state['value'])
+        new_state = {'close': float(close[-1]), 'value': float(values[-1]), 'count': state['count'] + len(values)}
+        return warm(values, state['count'], self.period), new_state
+
+    def step(self, bar: dict, state: dict) -> tuple:
+        state = state or {'close': None, 'value': None, 'count': 0}
+        true_range = bar['high'] - bar['low']
+        if state['close'] is not None:
+            true_range = max(true_range, abs(bar['high'] - state['close']), abs(bar['low'] - state['close']))
+        value = true_range if state['value'] is None else (1 - self.alpha) * state['value'] + self.alpha * true_range
+        count = state['count'] + 1
+        return value if count >= self.period else np.nan, {'close': bar['close'], 'value': value, 'count': count}
+
+
+class VWAP:
+    """Volume weighted average of the typical price (high + low + close) / 3, from the start of each UTC day."""
+    columns = ['high', 'low', 'close', 'volume']
+
+    def __init__(self):
+        self.name = "vwap"
+
+    def batch(self, bars: dict, state: dict) -> tuple:
+        state = state or {'session': None, 'price_volume': 0.0, 'volume': 0.0}
+        session = bars['open_time'] // DAY_NS
+        price_volume = (bars['high'] + bars['low'] + bars['close']) / 3 * bars['volume']
+        cumulative_price_volume = pd.Series(price_volume).groupby(session).cumsum().to_numpy(copy=True)
+        cumulative_volume = pd.Series(bars['volume']).groupby(session).cumsum().to_numpy(copy=True)
+        continued = session == state['session']  # the saved state's day goes on in this batch
+        cumulative_price_volume[continued] += state['price_volume']
+        cumulative_volume[continued] += state['volume']
+        with np.errstate(divide='ignore', invalid='ignore'):
+            values = cumulative_price_volume / cumulative_volume
+        new_state = {'session': int(session[-1]), 'price_volume': float(cumulative_price_volume[-1]),
+                     'volume': float(cumulative_volume[-1])}
+        return values, new_state
+
+    def step(self, bar: dict, state: dict) -> tuple:
+        session = int(bar['open_time'] // DAY_NS)
+        if state is None or state['session'] != session:
+            state = {'session': session, 'price_volume': 0.0, 'volume': 0.0}
+        price_volume = state['price_volume'] + (bar['high'] + bar['low'] + bar['close']) / 3 * bar['volume']
+        volume = state['volume'] + bar['volume']
+        value = price_volume / volume if volume else np.nan
+        return value, {'session': session, 'price_volume': price_volume, 'volume': volume}
+
+
+INDICATORS = {'ema': EMA, 'rsi': RSI, 'atr': ATR, 'vwap': VWAP}
+
+
+def indicator(name: str):
+    """The indicator a column name describes: 'ema_20', 'rsi_14', 'atr_14' or 'vwap'."""
+    kind, _, period = name.partition('_')
+    if kind not in INDICATORS or (period and not period.isdigit()) or bool(period) == (kind == 'vwap'):
+        raise ValueError(f"Invalid indicator {name}. Use {', '.join(INDICATORS)} with a period, e.g. 'ema_20', "
+                         f"'rsi_14', 'atr_14', or 'vwap'")
+    return INDICATORS[kind](int(period)) if period else INDICATORS[kind]()
+
+
+class IndicatorEngine:
+    """Indicators of one symbol/interval, kept as sidecar columns next to its klines and extended incrementally.
+
+    Layout: {root}/{symbol}/{interval}/indicators/{name}.bin, one float64 value per stored kline in open_time
+    order, open_time.bin holding the rows' open times. meta.json records the rows per month and every
+    indicator's state as of the row before the last. The last stored kline may still be replaced by the
+    next update, so update() recomputes from it on, reading only the klines from there; a new day of bars
+    costs a few months' worth of reading at most and no recomputation of the history. Changing the
+    indicators, or klines inserted before the last row (backfilled gaps, an earlier start), recomputes
+    everything: earlier months are checked against their Parquet row counts, the last one by its rows up
+    to the last kline.
+
+    stream() continues from the last row a bar at a time, in O(1) per bar, for live data.
+    """
+
+    def __init__(self, root, symbol: str, interval: str, names: list):
+        self.store = KlineStore(root)
+        self.symbol = symbol
+        self.interval = interval
+        self.indicators = [indicator(name) for name in names]
+        self.names = [item.name for item in self.indicators]
+        self.columns = sorted({column for item in self.indicators for column in item.columns})
+        self.directory = self.store.partition_dir(symbol, interval) / "indicators"
+        self.meta_path = self.directory / "meta.json"
+        self.meta = self.read_meta()
+
+    def read_meta(self):
+        """The sidecar's meta data when it holds these indicators and every row it claims, None otherwise."""
+        try:
+            with open(self.meta_path, 'r') as file:
+                meta = json.load(file)
+        except FileNotFoundError:
+            return None
+        except json.JSONDecodeError:
+            logger.error(f"Error parsing JSON from {self.meta_path}, computing the indicators again")
+            return None
+
+        if meta.get('version') != ENGINE_VERSION or meta['names'] != self.names or not all(
+                (self.directory / f"{name}.bin").exists()
+                and (self.directory / f"{name}.bin").stat().st_size >= meta['rows'] * 8
+                for name in self.names + ['open_time']):
+            logger.info(f"Indicators of {self.symbol} {self.interval} have changed, computing them again")
+            return None
+        return meta
+
+    def update(self) -> int:
+        """Compute the indicators of the klines stored since the last update, returns the rows computed."""
+        empty = {'version': ENGINE_VERSION, 'names': self.names, 'rows': 0, 'month_rows': {}, 'last_bar': None,
+                 'states': {name: None for name in self.names}}
+        meta = self.meta or empty
+        start = None
+        if meta['rows']:
+            start = pd.Timestamp(meta['last_bar']['open_time'])
+            if not self.rows_unchanged(meta, start):
+                logger.info(f"Klines of {self.symbol} {self.interval} before the last indicator row changed, "
+                            f"computing the indicators again")
+                meta, start = empty, None
+
+        # The last row is dropped and computed again, the saved states come from before it
+        kept_rows = max(meta['rows'] - 1, 0)
+        month_rows = dict(meta['month_rows'])
+        if start is not None:
+            month_rows[start.strftime('%Y-%m')] -= 1
+        months = self.store.months(self.symbol, self.interval)
+        if start is not None:
+            months = [month for month in months if month >= start.strftime('%Y-%m')]
+        os.makedirs(self.directory, exist_ok=True)
+        files = {name: open(self.directory / f"{name}.bin", 'ab') for name in self.names + ['open_time']}
+        try:
+            for file in files.values():
+                file.truncate(kept_rows * 8)
+
+            states = meta['states']
+            rows, last_bar = kept_rows, meta['last_bar']
+            for month, bars, final in self.batches(months, start):
+                if not len(bars['open_time']):
+                    continue
+                results = {item.name: item.batch(bars, states[item.name]) for item in self.indicators}
+                for name, (values, _) in results.items():
+                    files[name].write(values.astype(np.float64).tobytes())
+                files['open_time'].write(bars['open_time'].tobytes())
+                if final:
+                    states = {name: state for name, (_, state) in results.items()}
+                rows += len(bars['open_time'])
+                month_rows[month] = month_rows.get(month, 0) + len(bars['open_time'])
+                last_bar = {column: bars[column][-1].item() for column in ['open_time'] + self.columns}
+            for file in files.values():
+                file.flush()
+                os.fsync(file.fileno())
+        finally:
+            for file in files.values():
+                file.close()
+
+        computed = rows - kept_rows
+        meta = {**meta, 'rows': rows, 'month_rows': month_rows, 'last_bar': last_bar, 'states': states}
+        utils.atomic_write(self.meta_path, json.dumps(meta, indent=2))
+        self.meta = meta
+        logger.info(f"Computed {', '.join(self.names)} for {computed} {self.symbol} {self.interval} klines")
+        return computed
+
+    def rows_unchanged(self, meta: dict, last_open_time: pd.Timestamp) -> bool:
+        """Whether the store holds exactly the rows the columns were computed from, up to the last kline."""
+        last_month = last_open_time.strftime('%Y-%m')
+        months = [month for month in self.store.months(self.symbol, self.interval) if month <= last_month]
+        if months != sorted(meta['month_rows']) or last_month not in meta['month_rows']:
+            return False
+        for month in months[:-1]:
+            if self.store.month_rows(self.symbol, self.interval, month) != meta['month_rows'][month]:
+                return False
+        # The last month goes on growing, only its rows up to the last kline have to match
+        open_times = pd.read_parquet(self.store.partition_path(self.symbol, self.interval, last_month),
+                                     columns=['open_time'])['open_time']
+        return int((open_times <= last_open_time).sum()) == meta['month_rows'][last_month] \
+            and bool((open_times == last_open_time).any())
+
+    def batches(self, months: list, start):
+        """(month, bars, whether the states after them are kept) a month at a time, the last kline in a batch of
+        its own."""
+        for number, month in enumerate(months):
+            bars = self.read_bars(month, start)
+            if number < len(months) - 1:
+                yield month, bars, True
+            else:
+                yield month, take(bars, slice(None, -1)), True
+                yield month, take(bars, slice(-1, None)), False
+
+    def read_bars(self, month: str, start) -> dict:
+        df = pd.read_parquet(self.store.partition_path(self.symbol, self.interval, month),
+                             columns=['open_time'] + self.columns)
+        bars = {'open_time': df['open_time'].to_numpy(dtype='datetime64[ns]').view(np.int64)}
+        keep = slice(None) if start is None else bars['open_time'] >= start.value
+        bars = {'open_time': bars['open_time'][keep]}
+        for column in self.columns:
+            bars[column] = df[column].to_numpy(dtype=np.float64)[keep]
+        return bars
+
+    def values(self, name: str) -> np.ndarray:
+        """Read-only memory mapped column of an indicator, row i belongs to the i-th stored kline."""
+        if name not in self.names:
+            raise ValueError(f"{name} is not computed here, the engine has {', '.join(self.names)}")
+        return self.read_column(name, np.float64)
+
+    def open_times(self) -> np.ndarray:
+        return self.read_column('open_time', np.int64).view('datetime64[ns]')
+
+    def read_column(self, name: str, dtype) -> np.ndarray:
+        rows = self.meta['rows'] if self.meta else 0
+        if rows == 0:
+            return np.empty(0, dtype=dtype)
+        return np.memmap(self.directory / f"{name}.bin", dtype=dtype, mode='r', shape=(rows,)).view(np.ndarray)
+
+    def frame(self, start=None, end=None) -> pd.DataFrame:
+        """open_time and every indicator of the rows with start <= open_time < end."""
+        open_times = self.open_times()
+        first = 0 if start is None else np.searchsorted(open_times, np.datetime64(pd.Timestamp(start).value, 'ns'))
+        last = len(open_times) if end is None else np.searchsorted(open_times,
+                                                                   np.datetime64(pd.Timestamp(end).value, 'ns'))
+        return pd.DataFrame({'open_time': open_times[first:last],
+                             **{name: self.values(name)[first:last] for name in self.names}})
+
+    def stream(self) -> 'IndicatorStream':
+        """An IndicatorStream carrying on after the last stored kline."""
+        stream = IndicatorStream(self.indicators, (self.meta or {}).get('states'))
+        if self.meta and self.meta['last_bar']:
+            stream.push(self.meta['last_bar'])
+        return stream
+
+
+class IndicatorStream:
+    """Indicator values bar by bar, each push() is O(1) whatever the history behind it."""
+
+    def __init__(self, indicators: list, states: dict = None):
+        self.indicators = indicators
+        self.states = dict(states or {item.name: None for item in indicators})
+
+    def push(self, bar: dict) -> dict:
+        """Values of the bar after the ones pushed so far. bar has open_time (ns since the epoch) and prices."""
+        values = {}
+        for item in self.indicators:
+            values[item.name], self.states[item.name] = item.step(bar, self.states[item.name])
+        return values
+
+
+def take(bars: dict, rows: slice) -> dict:
+    return {column: values[rows] for column, values in bars.items()}
+
+
+def update_indicators(root, symbol: str, interval: str, names: list) -> IndicatorEngine:
+    engine = IndicatorEngine(root, symbol, interval, names)
+    engine.update()
+    return engine
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Compute or extend the indicator columns of stored klines")
+    parser.add_argument('connection', help="connection name, the klines are in PYSCALPIE_DIR/{connection}")
+    parser.add_argument('symbol')
+    parser.add_argument('interval')
+    parser.add_argument('indicators', nargs='+', help="e.g. ema_20 rsi_14 atr_14 vwap")
+    args = parser.parse_args()
+
+    engine = update_indicators(utils.PYSCALPIE_PATH / args.connection, args.symbol, args.interval, args.indicators)
+    print(engine.frame().tail(10).to_string(index=False))
@@ -0,0 +1,17 @@
+INTERVAL_UNITS = {'m': 60, 'h': 3600, 'd': 86400}
+DAY_SECONDS = 86400
+
+
+def interval_seconds(interval: str) -> int:
+    unit = INTERVAL_UNITS.get(interval[-1:])
+    if unit is None or not interval[:-1].isdigit():
+        raise ValueError(f"Invalid interval {interval}. Use minutes, hours or days, e.g. '1m', '15m', '1h', '1d'")
+    return int(interval[:-1]) * unit
+
+
+def check_derived_interval(base_interval: str, interval: str):
+    """Raise ValueError unless interval bars can be built from base_interval klines one month partition at a time."""
+    if interval_seconds(interval) % interval_seconds(base_interval) != 0:
+        raise ValueError(f"{interval} is not a multiple of {base_interval}")
+    if DAY_SECONDS % interval_seconds(interval) != 0:
+        raise ValueError(f"{interval} does not divide a day, its bars would straddle months")
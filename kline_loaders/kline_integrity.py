@@ -0,0 +1,48 @@
+import numpy as np
+
+
+class GapReport:
+    def __init__(self, step: int, rows: int, missing: list, duplicates: np.ndarray, misaligned: np.ndarray):
+        self.step = step
+        self.rows = rows
+        self.missing = missing  # (first missing open_time, last missing open_time) pairs, inclusive
+        self.duplicates = duplicates
+        self.misaligned = misaligned
+
+    @property
+    def ok(self) -> bool:
+        return not self.missing and len(self.duplicates) == 0 and len(self.misaligned) == 0
+
+    @property
+    def missing_candles(self) -> int:
+        return sum((end - start) // self.step + 1 for start, end in self.missing)
+
+    def __str__(self):
+        return f"{self.rows} rows, {len(self.missing)} gaps ({self.missing_candles} candles missing), " \
+               f"{len(self.duplicates)} duplicates, {len(self.misaligned)} misaligned"
+
+
+def check_open_times(open_times, step: int, previous_open_time: int = None) -> GapReport:
+    """Check that open_times form one unbroken series of step-spaced candles.
+
+    Works on the whole series at once, open_times may be any integer sequence (millis or seconds, same
+    unit as step) in any order. previous_open_time is the last candle accepted before this series, so a
+    gap between it and the series is reported too.
+    """
+    open_times = np.asarray(open_times, dtype=np.int64)
+    rows = len(open_times)
+    if previous_open_time is not None:
+        open_times = np.concatenate(([previous_open_time], open_times))
+    open_times = np.sort(open_times)
+
+    aligned_mask = open_times % step == 0
+    misaligned = open_times[~aligned_mask]
+    aligned = open_times[aligned_mask]
+
+    diffs = np.diff(aligned)
+    duplicates = np.unique(aligned[1:][diffs == 0])
+    gap_positions = np.flatnonzero(diffs > step)
+    missing = list(zip((aligned[gap_positions] + step).tolist(), (aligned[gap_positions + 1] - step).tolist()))
+
+    return GapReport(step, rows, missing, duplicates, misaligned)
+
@@ -0,0 +1,417 @@
+import json
+import random
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+from itertools import islice
+
+import numpy as np
+import pandas as pd
+import requests
+from loguru import logger
+from requests.adapters import HTTPAdapter
+
+from kline_loaders.intervals import interval_seconds
+from kline_loaders.kline_integrity import check_open_times
+from kline_loaders.rate_limiter import WeightRateLimiter
+from kline_loaders.run_metrics import RunMetrics
+from kline_loaders.symbol_metadata import SymbolMetadataCache
+from utils import get_unix_time
+
+try:
+    import orjson
+except ImportError:
+    orjson = None  # optional, json is used when it isn't installed
+
+BATCH_ROWS = 100_000
+POOL_SIZE = 32
+
+_sessions = {}
+_sessions_lock = threading.Lock()
+
+
+def get_session(host: str) -> requests.Session:
+    """Keep-alive session shared by every loader talking to host, so pages reuse pooled connections."""
+    with _sessions_lock:
+        session = _sessions.get(host)
+        if session is None:
+            session = requests.Session()
+            adapter = HTTPAdapter(pool_connections=1, pool_maxsize=POOL_SIZE)
+            session.mount('https://', adapter)
+            session.mount('http://', adapter)
+            _sessions[host] = session
+        return session
+
+
+def loads(content: bytes):
+    return orjson.loads(content) if orjson is not None else json.loads(content)
+
+
+def page_rows(page: dict) -> int:
+    return len(page['open_time'])
+
+
+def concat_pages(pages: list) -> dict:
+    return {column: np.concatenate([page[column] for page in pages]) for column in pages[0]}
+
+
+def take(page: dict, index) -> dict:
+    return {column: values[index] for column, values in page.items()}
+
+
+def backoff_delay(attempt: int, base: float = 1.0, cap: float = 60.0) -> float:
+    # Exponential backoff with full jitter, retrying loaders spread out instead of hitting the exchange together
+    return random.uniform(0, min(cap, base * 2 ** attempt))
+
+
+class KlineLoaderBase:
+    """Paging, retry, validation and conversion shared by the exchange kline loaders.
+
+    Subclasses describe the exchange with the class attributes below and implement build_request()
+    and decode_rows(); everything else, connection reuse and rate limiting included, lives here.
+
+    Pages travel as dicts of typed numpy columns, decoded straight from the response: int64 times in the
+    exchange's unit, float64 (or float32) prices and volumes and int32 counts. Only a batch handed out by
+    iter_batches() becomes a DataFrame.
+    """
+
+    exchange = None
+    columns = []  # layout of the exchange's rows, by position for list rows and by key for dict rows
+    unused_columns = []  # columns of the layout that are never decoded
+    datetime_columns = ['open_time']
+    numeric_columns = []
+    integer_columns = []
+    time_unit = 'ms'  # unit of the exchange's open_time values, 'ms' or 's'
+    page_size = 500
+    page_weight = 1
+    weight_limit = 6000
+    used_weight_header = None
+    max_retries = 5
+    timeout = 30
+    earliest_search_start = datetime(2010, 1, 1)
+
+    def __init__(self, connection: str, symbol: str, interval: str, rate_limiter: WeightRateLimiter = None,
+                 float_dtype=np.float64, metrics: RunMetrics = None):
+        self.next_open_time = None
+        self.last_open_time = None
+        self.connection = connection
+        self.symbol = symbol
+        self.interval = interval
+        self.units_per_second = 1000 if self.time_unit == 'ms' else 1
+        self.time_delta = interval_seconds(interval) * self.units_per_second
+        self.session = get_session(connection)
+        self.rate_limiter = rate_limiter or WeightRateLimiter(self.weight_limit,
+                                                              used_weight_header=self.used_weight_header)
+        self.retries = 0
+        self.metrics = metrics or RunMetrics()
+        self.metric_labels = (self.exchange, symbol, interval)
+        self.dtypes = {column: np.int64 if column in self.datetime_columns else
+                       np.int32 if column in self.integer_columns else
+                       np.dtype(float_dtype) if column in self.numeric_columns else object
+                       for column in self.decoded_columns}
+
+        logger.info(f"Symbol: {self.symbol}, Interval: {self.interval}")
+
+    def build_request(self, start_time: int, end_time: int = None, limit: int = None) -> tuple:
+        """Return (url, params) for the page of candles opening from start_time."""
+        raise NotImplementedError
+
+    def decode_rows(self, payload) -> list:
+        """Return the candle rows of a decoded response, in the layout of self.columns."""
+        raise NotImplementedError
+
+    @property
+    def decoded_columns(self) -> list:
+        return [column for column in self.columns if column not in self.unused_columns]
+
+    @property
+    def frame_dtypes(self) -> dict:
+        """dtypes of the DataFrames convert() returns, the schema the klines are stored with."""
+        return {column: np.dtype(f'datetime64[{self.time_unit}]' if column in self.datetime_columns else dtype)
+                for column, dtype in self.dtypes.items()}
+
+    def decode_page(self, rows: list) -> dict:
+        """Typed columns of the rows, each filled into a buffer allocated for the page."""
+        page = {column: np.empty(len(rows), dtype=dtype) for column, dtype in self.dtypes.items()}
+        if not rows:
+            return page
+        if isinstance(rows[0], dict):
+            for column, values in page.items():
+                values[:] = [row[column] for row in rows]
+        else:
+            fields = list(zip(*rows))  # one tuple per column, numbers and number strings alike
+            for column, values in page.items():
+                values[:] = fields[self.columns.index(column)]
+        return page
+
+    def request(self, url: str, params: dict = None):
+        labels = self.metric_labels
+        for attempt in range(self.max_retries + 1):
+            self.metrics.add(labels, 'rate_limit_wait_seconds', self.rate_limiter.acquire(self.page_weight))
+            self.metrics.add(labels, 'request_weight', self.page_weight)
+            start = time.perf_counter()
+            try:
+                response = self.session.get(url, params=params, timeout=self.timeout)
+            except (requests.ConnectionError, requests.Timeout) as e:
+                delay = backoff_delay(attempt)
+                logger.warning(f"Request to {self.exchange} failed ({e}), retrying in {delay:.1f} seconds")
+                self.retries += 1
+                self.metrics.add(labels, 'retries')
+                self.metrics.add(labels, 'retry_sleep_seconds', delay)
+                time.sleep(delay)
+                continue
+
+            self.metrics.observe_latency(labels, time.perf_counter() - start)
+            self.metrics.add(labels, 'requests')
+            self.metrics.add(labels, 'bytes_received', len(response.content))
+            self.rate_limiter.update(response.headers)
+            self.metrics.maximum(labels, 'used_weight_max', self.rate_limiter.used_weight)
+
+            if response.status_code in (418, 429) or response.status_code >= 500:
+                retry_after = response.headers.get('Retry-After', '')
+                delay = float(retry_after) if retry_after.isdigit() else backoff_delay(attempt)
+                logger.warning(f"{self.exchange} responded with HTTP {response.status_code}, "
+                               f"retrying in {delay:.1f} seconds")
+                self.retries += 1
+                self.metrics.add(labels, 'retries')
+                if response.status_code in (418, 429):
+                    # Rate limits are per IP, hold back every loader sharing the limiter. The wait is counted
+                    # by the next acquire().
+                    self.metrics.add(labels, 'rate_limited')
+                    self.rate_limiter.back_off(delay)
+                else:
+                    self.metrics.add(labels, 'retry_sleep_seconds', delay)
+                    time.sleep(delay)
+                continue
+
+            if response.status_code != 200:
+                error = f"Failed to fetch data. Response code: {response.status_code}, content: {response.content}"
+                logger.error(error)
+                raise ConnectionError(error)
+
+            with self.metrics.timer(labels, 'decode_seconds'):
+                return loads(response.content)
+
+        error = f"Failed to fetch data from {self.exchange} after {self.max_retries + 1} attempts"
+        logger.error(error)
+        raise ConnectionError(error)
+
+    def request_page(self, start_time: int, end_time: int = None, limit: int = None) -> dict:
+        url, params = self.build_request(start_time, end_time, limit or self.page_size)
+        payload = self.request(url, params)
+        with self.metrics.timer(self.metric_labels, 'decode_seconds'):
+            page = self.decode_page(self.decode_rows(payload))
+        if end_time is not None and page_rows(page):
+            page = take(page, page['open_time'] <= end_time)
+        return page
+
+    def fetch_window(self, start_time: int, end_time: int) -> dict:
+        page = self.request_page(start_time, end_time)
+        logger.info(
+            f"Fetched {page_rows(page)} rows of data. "
+            f"From {datetime.fromtimestamp(start_time / self.units_per_second)} to "
+            f"{datetime.fromtimestamp(end_time / self.units_per_second)}")
+        return page
+
+    def fetch_data(self, str_start_date: str, workers: int = 1) -> pd.DataFrame:
+        batches = list(self.iter_batches(str_start_date, workers=workers))
+        return pd.concat(batches, ignore_index=True) if batches else pd.DataFrame()
+
+    def iter_batches(self, str_start_date: str, rows: int = BATCH_ROWS, workers: int = 1):
+        """Yield converted, gap checked DataFrames of about rows candles each, oldest first."""
+        previous_open_time = None
+        total_rows = 0
+        pages = self.iter_pages(str_start_date, workers)
+        while True:
+            pending = []
+            pending_rows = 0
+            for page in pages:
+                pending.append(page)
+                pending_rows += page_rows(page)
+                if pending_rows >= rows:
+                    break
+            if not pending:
+                break
+
+            batch = self.fill_gaps(concat_pages(pending), previous_open_time)
+            if page_rows(batch) == 0:
+                continue
+            previous_open_time = int(batch['open_time'][-1])
+            self.last_open_time = previous_open_time
+            self.next_open_time = previous_open_time + self.time_delta
+            total_rows += page_rows(batch)
+            self.metrics.add(self.metric_labels, 'rows', page_rows(batch))
+            with self.metrics.timer(self.metric_labels, 'conversion_seconds'):
+                df = self.convert(batch)
+            yield df
+
+        logger.info(f"Data fetching completed. Total rows fetched: {total_rows}")
+
+    def iter_pages(self, str_start_date: str, workers: int = 1):
+        """Yield raw pages in open_time order, up to 2 * workers pages are fetched ahead."""
+        start_time = int(get_unix_time(str_start_date) * self.units_per_second / 1000)
+        current_time = int(time.time() * self.units_per_second)
+
+        if workers > 1:
+            yield from self.iter_pages_concurrent(start_time, current_time, workers)
+            return
+
+        while start_time < current_time:
+            end_time = start_time + self.time_delta * self.page_size - 1
+            page = self.fetch_window(start_time, end_time)
+            if page_rows(page) == 0:
+                logger.info(f"Failed response from {self.exchange} kline, exiting fetch_data loop")
+                break
+
+            start_time = int(page['open_time'][-1]) + self.time_delta  # Get the next candle's start time
+            self.next_open_time = start_time
+            yield page
+
+    def windows(self, start_time: int, current_time: int):
+        # The same windows the sequential loop walks through: the first one starts at the requested
+        # time, later ones at the candle boundaries a full page moves the cursor to.
+        window = self.time_delta * self.page_size
+        yield start_time, start_time + window - 1
+        window_start = -(-start_time // self.time_delta) * self.time_delta + window
+        while window_start < current_time:
+            yield window_start, window_start + window - 1
+            window_start += window
+
+    def iter_pages_concurrent(self, start_time: int, current_time: int, workers: int):
+        windows = self.windows(start_time, current_time)
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            in_flight = deque()
+            while True:
+                for window in islice(windows, workers * 2 - len(in_flight)):
+                    in_flight.append(executor.submit(self.fetch_window, *window))
+                if not in_flight:
+                    break
+
+                page = in_flight.popleft().result()
+                if page_rows(page) == 0:
+                    logger.info(f"Failed response from {self.exchange} kline, exiting fetch_data loop")
+                    break
+
+                self.next_open_time = int(page['open_time'][-1]) + self.time_delta
+                yield page
+
+    def fill_gaps(self, batch: dict, previous_open_time: int = None) -> dict:
+        """Re-request only the candles missing from the batch, or between previous_open_time and the batch."""
+        if page_rows(batch) == 0:
+            return batch
+
+        labels = self.metric_labels
+        with self.metrics.timer(labels, 'validation_seconds'):
+            report = check_open_times(batch['open_time'], self.time_delta, previous_open_time)
+        if report.ok:
+            return batch
+
+        logger.info(f"Integrity check found {report}, re-fetching missing ranges")
+        self.metrics.add(labels, 'gaps', len(report.missing))
+        self.metrics.add(labels, 'missing_candles', report.missing_candles)
+        pages = [batch]
+        window = self.time_delta * self.page_size
+        for gap_start, gap_end in report.missing:
+            for page_start in range(gap_start, gap_end + 1, window):
+                page = self.request_page(page_start, min(page_start + window - 1, gap_end))
+                if page_rows(page):
+                    pages.append(page)
+
+        with self.metrics.timer(labels, 'validation_seconds'):
+            batch, report = self.merge_refetched(pages, previous_open_time)
+        self.metrics.add(labels, 'unfilled_gaps', len(report.missing))
+        for gap_start, gap_end in report.missing:
+            logger.info(
+                f"Data gap error here: {datetime.fromtimestamp(gap_start / self.units_per_second)} to "
+                f"{datetime.fromtimestamp(gap_end / self.units_per_second)}")
+
+        return batch
+
+    def merge_refetched(self, pages: list, previous_open_time: int = None) -> tuple:
+        """The batch and its re-fetched pages as one sorted, unique batch, with its integrity report."""
+        batch = concat_pages(pages)
+        open_times = batch['open_time']
+        keep = open_times % self.time_delta == 0
+        if previous_open_time is not None:
+            keep &= open_times > previous_open_time
+        batch = take(batch, keep)
+        # Sorted on open_time, of duplicates the one fetched last is kept
+        order = np.argsort(batch['open_time'], kind='stable')
+        open_times = batch['open_time'][order]
+        batch = take(batch, order[np.append(open_times[1:] != open_times[:-1], True)])
+
+        return batch, check_open_times(batch['open_time'], self.time_delta, previous_open_time)
+
+    def convert(self, batch: dict) -> pd.DataFrame:
+        # The columns are typed already, only the times still need to become datetimes
+        df = pd.DataFrame(batch, copy=False)
+        for column in self.datetime_columns:
+            df[column] = df[column].to_numpy().astype(f'datetime64[{self.time_unit}]')
+        return df
+
+    def validate(self, df: pd.DataFrame) -> bool:
+        return check_open_times(df['open_time'].to_numpy(), self.time_delta).ok
+
+    @property
+    def get_last_time(self) -> str:
+        dt = datetime.fromtimestamp(self.next_open_time / self.units_per_second, tz=timezone.utc)
+        return dt.strftime("%Y-%m-%d %H:%M")
+
+    @property
+    def get_resume_time(self) -> str:
+        # The last candle handed out may still have been open, a resumed fetch starts with it again.
+        # In UTC like the cursor files have always been, utils.get_unix_time reads it back as UTC.
+        dt = datetime.fromtimestamp(self.last_open_time / self.units_per_second, tz=timezone.utc)
+        return dt.strftime("%Y-%m-%d %H:%M")
+
+    def find_earliest_candle(self):
+        cache = SymbolMetadataCache(self.exchange)
+        earliest_seconds = cache.get(self.symbol, 'earliest_open_time', self.interval)
+        if earliest_seconds is None:
+            earliest_seconds = self.search_earliest_open_time() // self.units_per_second
+            cache.set(self.symbol, 'earliest_open_time', self.interval, earliest_seconds)
+
+        earliest_time = datetime.fromtimestamp(earliest_seconds, tz=timezone.utc)
+        logger.info(f"Found earliest available klines data for {self.symbol} is from {earliest_time}")
+        return earliest_time
+
+    def probe_open_time(self, start_time: int):
+        page = self.request_page(start_time, limit=1)
+        return None if page_rows(page) == 0 else int(page['open_time'][0])
+
+    def search_earliest_open_time(self) -> int:
+        """Find the first candle with O(log n) single candle requests.
+
+        A probe before the listing either returns the first candle straight away (Binance) or nothing
+        (Bybit). In the second case gallop back from now until a probe comes back empty, then binary
+        search between the last empty and the first non-empty probe.
+        """
+        empty_time = int(self.earliest_search_start.timestamp() * self.units_per_second)
+        first_open_time = self.probe_open_time(empty_time)
+        if first_open_time is not None:
+            return first_open_time
+
+        found_time = int(time.time() * self.units_per_second) // self.time_delta * self.time_delta
+        step = self.time_delta
+        while found_time - step > empty_time:
+            if self.probe_open_time(found_time - step) is None:
+                empty_time = found_time - step
+                break
+            found_time -= step
+            step *= 2
+
+        # Probes stay on candle boundaries, so the search ends with found_time on the first candle
+        empty_time = empty_time // self.time_delta * self.time_delta
+        while found_time - empty_time > self.time_delta:
+            middle = (empty_time + found_time) // 2 // self.time_delta * self.time_delta
+            if self.probe_open_time(middle) is None:
+                empty_time = middle
+            else:
+                found_time = middle
+
+        first_open_time = self.probe_open_time(found_time)
+        if first_open_time is None:
+            raise ValueError(f"No klines found for {self.symbol} {self.interval} on {self.exchange}")
+        return first_open_time
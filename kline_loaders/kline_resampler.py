@@ -0,0 +1,67 @@
+import pandas as pd
+from loguru import logger
+
+from kline_loaders.intervals import check_derived_interval, interval_seconds
+
+AGGREGATIONS = {
+    'open': 'first',
+    'high': 'max',
+    'low': 'min',
+    'close': 'last',
+    'volume': 'sum',
+    'quote_asset_volume': 'sum',
+    'number_of_trades': 'sum',
+    'taker_buy_base_asset_volume': 'sum',
+    'taker_buy_quote_asset_volume': 'sum',
+    'turnover': 'sum',
+}
+
+
+def resample_klines(df: pd.DataFrame, interval: str) -> pd.DataFrame:
+    """Aggregate finer klines into interval bars aligned to the epoch, e.g. 1m into 15m.
+
+    Bars with no underlying candles are dropped, the last bar may be partial and is completed by the
+    next update.
+    """
+    if df.empty:
+        return df
+
+    bar = pd.Timedelta(seconds=interval_seconds(interval))
+    aggregations = {column: how for column, how in AGGREGATIONS.items() if column in df.columns}
+    bars = df.resample(bar, on='open_time', closed='left', label='left', origin='epoch').agg(aggregations)
+    bars = bars[bars['open'].notna()].reset_index()
+
+    if 'close_time' in df.columns:
+        bars.insert(df.columns.get_loc('close_time'), 'close_time',
+                    bars['open_time'] + bar - pd.Timedelta(milliseconds=1))
+    if 'number_of_trades' in bars.columns:
+        # Sums come back as int64, the derived interval keeps the base klines' dtype
+        bars['number_of_trades'] = bars['number_of_trades'].astype(df['number_of_trades'].dtype)
+    if 'ignore' in df.columns:
+        bars['ignore'] = '0'
+
+    return bars[[column for column in df.columns if column in bars.columns]]
+
+
+def update_derived_interval(store, symbol: str, base_interval: str, interval: str):
+    """Rebuild interval bars of symbol from base_interval klines stored since the last derived bar."""
+    check_derived_interval(base_interval, interval)
+
+    # The last stored bar may have been partial, derive again from its start
+    start = store.last_open_time(symbol, interval)
+    start_month = start.strftime('%Y-%m') if start is not None else None
+    rows = 0
+    for month in store.months(symbol, base_interval):
+        if start_month is not None and month < start_month:
+            continue
+
+        # Epoch aligned bars of intervals that divide a day never straddle months, each partition resamples
+        # on its own
+        month_start = pd.Timestamp(f"{month}-01")
+        klines = store.read(symbol, base_interval, start=max(start, month_start) if start is not None else month_start,
+                            end=month_start + pd.offsets.MonthBegin(1))
+        bars = resample_klines(klines, interval)
+        store.write(symbol, interval, bars)
+        rows += len(bars)
+
+    logger.info(f"Derived {rows} {interval} bars for {symbol} from {base_interval} klines")
@@ -0,0 +1,103 @@
+import os
+from pathlib import Path
+
+import pandas as pd
+import pyarrow.parquet as pq
+from loguru import logger
+
+CSV_CHUNK_ROWS = 1_000_000
+
+
+class KlineStore:
+    """Klines of one exchange kept as one Parquet file per symbol/interval/month.
+
+    Layout: {root}/{symbol}/{interval}/{YYYY-MM}.parquet, rows sorted and unique on open_time.
+    """
+
+    def __init__(self, root):
+        self.root = Path(root)
+
+    def partition_dir(self, symbol: str, interval: str) -> Path:
+        return self.root / symbol / interval
+
+    def partition_path(self, symbol: str, interval: str, month: str) -> Path:
+        return self.partition_dir(symbol, interval) / f"{month}.parquet"
+
+    def months(self, symbol: str, interval: str) -> list:
+        partition_dir = self.partition_dir(symbol, interval)
+        if not partition_dir.exists():
+            return []
+        return sorted(path.stem for path in partition_dir.glob("*.parquet"))
+
+    def month_rows(self, symbol: str, interval: str, month: str) -> int:
+        """Rows of a month's partition, from the Parquet footer without reading the data."""
+        return pq.read_metadata(self.partition_path(symbol, interval, month)).num_rows
+
+    def write(self, symbol: str, interval: str, df: pd.DataFrame):
+        """Upsert klines on open_time, newer rows replace stored ones."""
+        if df.empty:
+            return
+
+        os.makedirs(self.partition_dir(symbol, interval), exist_ok=True)
+        for month, month_df in df.groupby(df['open_time'].dt.strftime('%Y-%m'), sort=True):
+            path = self.partition_path(symbol, interval, month)
+            if path.exists():
+                month_df = pd.concat([pd.read_parquet(path), month_df], ignore_index=True)
+
+            month_df = month_df.drop_duplicates(subset='open_time', keep='last') \
+                .sort_values('open_time', ignore_index=True)
+
+            # Write next to the partition and swap it in, a crash never leaves a half written month
+            temp_path = path.with_suffix('.parquet.tmp')
+            month_df.to_parquet(temp_path, index=False)
+            os.replace(temp_path, path)
+
+    def read(self, symbol: str, interval: str, start=None, end=None) -> pd.DataFrame:
+        """Klines with start <= open_time < end, opening only the months that overlap the range."""
+        start = pd.Timestamp(start) if start is not None else None
+        end = pd.Timestamp(end) if end is not None else None
+
+        months = self.months(symbol, interval)
+        if start is not None:
+            months = [month for month in months if month >= start.strftime('%Y-%m')]
+        if end is not None:
+            months = [month for month in months if month <= end.strftime('%Y-%m')]
+
+        frames = [pd.read_parquet(self.partition_path(symbol, interval, month)) for month in months]
+        if not frames:
+            return pd.DataFrame()
+
+        df = pd.concat(frames, ignore_index=True)
+        if start is not None:
+            df = df[df['open_time'] >= start]
+        if end is not None:
+            df = df[df['open_time'] < end]
+        return df.reset_index(drop=True)
+
+    def last_open_time(self, symbol: str, interval: str):
+        months = self.months(symbol, interval)
+        if not months:
+            return None
+        df = pd.read_parquet(self.partition_path(symbol, interval, months[-1]), columns=['open_time'])
+        return df['open_time'].max()
+
+    def migrate_csv(self, symbol: str, interval: str, csv_path, dtypes: dict):
+        """One-shot import of a legacy {symbol}-{interval}.csv, renamed to .migrated once stored.
+
+        dtypes is the schema the loader stores batches with (KlineLoaderBase.frame_dtypes): columns it doesn't
+        have, like Binance's 'ignore', are dropped and the rest cast to it, so the months mix with new batches.
+        """
+        csv_path = Path(csv_path)
+        header = pd.read_csv(csv_path, nrows=0).columns
+        columns = [column for column in dtypes if column in header]
+        date_columns = [column for column in columns if dtypes[column].kind == 'M']
+
+        rows = 0
+        for chunk in pd.read_csv(csv_path, chunksize=CSV_CHUNK_ROWS, usecols=columns, parse_dates=date_columns):
+            chunk = chunk[columns].astype({column: dtypes[column] for column in columns})
+            # Overlapping runs appended the same candles more than once, write() drops them
+            self.write(symbol, interval, chunk)
+            rows += len(chunk)
+
+        os.replace(csv_path, csv_path.with_name(csv_path.name + '.migrated'))
+        logger.info(f"Migrated {rows} rows from {csv_path} into {self.partition_dir(symbol, interval)}")
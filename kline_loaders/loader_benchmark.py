@@ -0,0 +1,151 @@
+import argparse
+import json
+import multiprocessing
+import os
+import resource
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta, timezone
+
+from loguru import logger
+
+from kline_loaders.mock_exchange import MockExchange
+
+UNLIMITED_WEIGHT = 10 ** 9  # The mock exchange has no budget, the benchmark measures the loaders
+
+
+def peak_rss_mb() -> float:
+    # ru_maxrss is in kilobytes on Linux and bytes on macOS
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / 1024 / 1024 if sys.platform == 'darwin' else peak / 1024
+
+
+def quiet_logging():
+    logger.remove()
+    logger.add(sys.stderr, level='WARNING')
+
+
+def run_fetch_data(exchange: str, host: str, symbol: str, interval: str, start_date: str, workers: int, results):
+    from kline_loaders.loader_registry import LOADERS, resolve
+    from kline_loaders.rate_limiter import WeightRateLimiter
+
+    quiet_logging()
+    class_ = resolve(LOADERS[exchange])
+    loader = class_(host, symbol, interval, rate_limiter=WeightRateLimiter(UNLIMITED_WEIGHT))
+
+    start = time.perf_counter()
+    df = loader.fetch_data(start_date, workers=workers)
+    seconds = time.perf_counter() - start
+    results.put({'rows': len(df), 'seconds': seconds, 'retries': loader.retries, 'peak_rss_mb': peak_rss_mb()})
+
+
+def run_history_updater(exchange: str, host: str, symbols: list, interval: str, start_date: str, concurrent: bool,
+                        results):
+    from pathlib import Path
+
+    import utils
+    from kline_loaders.history_updater import HistoryUpdater
+    from kline_loaders.kline_store import KlineStore
+
+    quiet_logging()
+    with tempfile.TemporaryDirectory() as data_dir:
+        utils.PYSCALPIE_PATH = Path(data_dir)
+        connection = {'name': exchange, 'details': {
+            'host': host, 'historySymbols': symbols, 'historyIntervals': [interval],
+            'requestWeightPerMinute': UNLIMITED_WEIGHT, 'maxConcurrentJobs': len(symbols)}}
+        with open(utils.PYSCALPIE_PATH / "connections.json", 'w') as file:
+            json.dump([connection], file)
+
+        os.makedirs(utils.PYSCALPIE_PATH / exchange)
+        for symbol in symbols:
+            with open(utils.PYSCALPIE_PATH / exchange / f"{symbol}-{interval}-latest-date", 'w') as file:
+                file.write(start_date)
+
+        updater = HistoryUpdater()
+        start = time.perf_counter()
+        if concurrent:
+            updater.main_async()
+        else:
+            updater.main()
+        seconds = time.perf_counter() - start
+
+        store = KlineStore(utils.PYSCALPIE_PATH / exchange)
+        rows = sum(len(store.read(symbol, interval)) for symbol in symbols)
+        # Every job's loader counts its retries into the run's metrics
+        retries = sum(series.get('retries', 0) for series in updater.metrics.summary()['series'])
+        results.put({'rows': rows, 'seconds': seconds, 'retries': retries, 'peak_rss_mb': peak_rss_mb()})
+
+
+def run_scenario(mock: MockExchange, name: str, target, *args) -> dict:
+    # Each scenario gets a fresh process, so peak RSS belongs to that scenario alone
+    context = multiprocessing.get_context('spawn')
+    results = context.Queue()
+    before = mock.stats()
+    process = context.Process(target=target, args=(*args, results))
+    process.start()
+    result = results.get()
+    process.join()
+    after = mock.stats()
+
+    requests = after['requests'] - before['requests']
+    result.update({
+        'scenario': name,
+        'requests': requests,
+        'rate_limited': after['rate_limited'] - before['rate_limited'],
+        'megabytes_received': (after['bytes_sent'] - before['bytes_sent']) / 1024 / 1024,
+        'rows_per_second': result['rows'] / result['seconds'],
+        'requests_per_second': requests / result['seconds'],
+    })
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Measure kline loader throughput against a local mock exchange")
+    parser.add_argument('--exchange', choices=['binance', 'bybit'], default='binance')
+    parser.add_argument('--interval', default='1m')
+    parser.add_argument('--days', type=float, default=7, help="history to download, ending now")
+    parser.add_argument('--workers', type=int, default=8, help="workers for the concurrent fetch_data scenario")
+    parser.add_argument('--symbols', type=int, default=4, help="symbols for the HistoryUpdater scenarios")
+    parser.add_argument('--latency', type=float, default=0.02, help="mock response latency in seconds")
+    parser.add_argument('--gap-rate', type=float, default=0.0005, help="fraction of candles the mock leaves out")
+    parser.add_argument('--rate-limit-every', type=int, default=100, help="answer every n-th request with 429")
+    parser.add_argument('--json', help="also write the results to this file")
+    args = parser.parse_args()
+
+    start_date = (datetime.now(timezone.utc) - timedelta(days=args.days)).strftime("%Y-%m-%d %H:%M")
+    symbols = [f"SYM{i}USDT" for i in range(args.symbols)]
+    mock = MockExchange(latency=args.latency, gap_rate=args.gap_rate, rate_limit_every=args.rate_limit_every).start()
+
+    scenarios = [
+        ("fetch_data sequential", run_fetch_data, args.exchange, mock.url, "BTCUSDT", args.interval, start_date, 1),
+        (f"fetch_data {args.workers} workers", run_fetch_data, args.exchange, mock.url, "BTCUSDT", args.interval,
+         start_date, args.workers),
+        (f"HistoryUpdater {args.symbols} symbols", run_history_updater, args.exchange, mock.url, symbols,
+         args.interval, start_date, False),
+        (f"HistoryUpdater {args.symbols} symbols concurrent", run_history_updater, args.exchange, mock.url, symbols,
+         args.interval, start_date, True),
+    ]
+
+    results = []
+    try:
+        for name, target, *scenario_args in scenarios:
+            logger.info(f"Running {name}")
+            results.append(run_scenario(mock, name, target, *scenario_args))
+    finally:
+        mock.stop()
+
+    print(f"{'scenario':<40}{'rows':>10}{'seconds':>10}{'rows/s':>12}{'req/s':>10}{'429s':>7}{'retries':>9}"
+          f"{'MB in':>9}{'peak MB':>10}")
+    for result in results:
+        print(f"{result['scenario']:<40}{result['rows']:>10}{result['seconds']:>10.2f}"
+              f"{result['rows_per_second']:>12.0f}{result['requests_per_second']:>10.1f}{result['rate_limited']:>7}"
+              f"{result['retries']:>9}{result['megabytes_received']:>9.1f}{result['peak_rss_mb']:>10.1f}")
+
+    if args.json:
+        with open(args.json, 'w') as file:
+            json.dump(results, file, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,41 @@
+import importlib
+import threading
+
+# Connection name -> 'module:Class' of its loader, imported the first time a connection needs it
+LOADERS = {
+    'binance': 'kline_loaders.binance_kline_history_loader:BinanceKlineHistoryLoader',
+    'bybit': 'kline_loaders.bybit_kline_history_loader:BybitKlineHistoryLoader',
+}
+
+
+def loader_spec(connection_name: str, connection_details: dict = None) -> str:
+    """'module:Class' of a connection's loader.
+
+    A connection's 'loader' detail wins, then LOADERS, then the {name}_kline_history_loader module naming
+    the loaders follow.
+    """
+    spec = (connection_details or {}).get('loader') or LOADERS.get(connection_name)
+    if spec is None:
+        spec = f"kline_loaders.{connection_name}_kline_history_loader:{connection_name.capitalize()}KlineHistoryLoader"
+    return spec
+
+
+def resolve(spec: str):
+    """The object a 'module:Class' string names, ImportError or AttributeError when there is none."""
+    module_name, _, attribute = spec.partition(':')
+    return getattr(importlib.import_module(module_name), attribute)
+
+
+class LoaderRegistry:
+    """Loader classes by connection name, resolved once and shared by every job of the connection."""
+
+    def __init__(self):
+        self.classes = {}
+        self.lock = threading.Lock()
+
+    def get(self, connection_name: str, connection_details: dict = None):
+        spec = loader_spec(connection_name, connection_details)
+        with self.lock:
+            if spec not in self.classes:
+                self.classes[spec] = resolve(spec)
+            return self.classes[spec]
@@ -0,0 +1,157 @@
+import json
+import math
+import threading
+import time
+import zlib
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+from loguru import logger
+
+from kline_loaders.intervals import interval_seconds
+
+
+class MockExchange:
+    """Local stand-in for the Binance /api/v3/klines and Bybit /public/linear/kline endpoints.
+
+    Candles are synthetic but deterministic, so repeated requests agree with each other. latency delays
+    every response, gap_rate drops that fraction of candles for good and every rate_limit_every-th
+    request is answered with HTTP 429.
+    """
+
+    def __init__(self, listing_time: int = 1502942400, latency: float = 0.0, gap_rate: float = 0.0,
+                 rate_limit_every: int = 0, retry_after: int = 0, port: int = 0):
+        self.listing_time = listing_time  # seconds
+        self.latency = latency
+        self.gap_rate = gap_rate
+        self.rate_limit_every = rate_limit_every
+        self.retry_after = retry_after
+        self.lock = threading.Lock()
+        self.requests = 0
+        self.weight_window = 0
+        self.used_weight = 0
+        self.rate_limited = 0
+        self.bytes_sent = 0
+        self.server = ThreadingHTTPServer(('127.0.0.1', port), self.handler_class())
+        self.server.daemon_threads = True
+        self.thread = None
+
+    @property
+    def url(self) -> str:
+        host, port = self.server.server_address
+        return f"http://{host}:{port}"
+
+    def start(self):
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self.thread.start()
+        logger.info(f"Mock exchange listening on {self.url}")
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def stats(self) -> dict:
+        with self.lock:
+            return {'requests': self.requests, 'rate_limited': self.rate_limited, 'bytes_sent': self.bytes_sent}
+
+    def is_gap(self, open_time: int) -> bool:
+        return self.gap_rate > 0 and zlib.crc32(open_time.to_bytes(8, 'little')) / 2 ** 32 < self.gap_rate
+
+    def candles(self, start: int, end: int, step: int, limit: int) -> list:
+        """(open_time, open, high, low, close, volume) in seconds, from the first candle >= start."""
+        now = int(time.time())
+        open_time = max(-(-start // step) * step, -(-self.listing_time // step) * step)
+        candles = []
+        while open_time <= end and open_time < now and len(candles) < limit:
+            if not self.is_gap(open_time):
+                price = 20000 + 5000 * math.sin(open_time / 86400) + 50 * math.sin(open_time / 600)
+                candles.append((open_time, price, price * 1.001, price * 0.999, price * 1.0005,
+                                1 + (open_time // step) % 97))
+            open_time += step
+        return candles
+
+    def binance_klines(self, query: dict) -> list:
+        step = interval_seconds(query['interval'])
+        start = int(query.get('startTime', 0)) // 1000
+        end = int(query.get('endTime', 2 ** 42)) // 1000
+        rows = []
+        for open_time, open_, high, low, close, volume in self.candles(start, end, step, int(query.get('limit', 500))):
+            rows.append([open_time * 1000, f"{open_:.2f}", f"{high:.2f}", f"{low:.2f}", f"{close:.2f}",
+                         f"{volume:.4f}", (open_time + step) * 1000 - 1, f"{volume * close:.4f}", int(volume) * 3,
+                         f"{volume / 2:.4f}", f"{volume * close / 2:.4f}", "0"])
+        return rows
+
+    def bybit_klines(self, query: dict) -> dict:
+        step = int(query['interval']) * 60
+        start = int(query['from'])
+        if start < self.listing_time:  # Bybit answers nothing for a start before the listing
+            return {'result': []}
+        result = []
+        for open_time, open_, high, low, close, volume in self.candles(start, 2 ** 42, step, int(query.get('limit', 200))):
+            result.append({'symbol': query.get('symbol'), 'interval': query['interval'], 'open_time': open_time,
+                           'open': open_, 'high': high, 'low': low, 'close': close, 'volume': volume,
+                           'turnover': volume * close})
+        return {'ret_code': 0, 'result': result}
+
+    def handler_class(self):
+        exchange = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'  # keep-alive, so pooled sessions are measured as such
+
+            def do_GET(self):
+                url = urlparse(self.path)
+                query = {key: values[0] for key, values in parse_qs(url.query).items()}
+                with exchange.lock:
+                    exchange.requests += 1
+                    request_number = exchange.requests
+                    window = int(time.time() // 60)
+                    if window != exchange.weight_window:
+                        exchange.weight_window = window
+                        exchange.used_weight = 0
+                    exchange.used_weight += 2
+                    used_weight = exchange.used_weight
+
+                if exchange.latency:
+                    time.sleep(exchange.latency)
+
+                if exchange.rate_limit_every and request_number % exchange.rate_limit_every == 0:
+                    with exchange.lock:
+                        exchange.rate_limited += 1
+                    self.respond(429, {'code': -1003, 'msg': 'Too many requests'},
+                                 {'Retry-After': str(exchange.retry_after)})
+                elif url.path == '/api/v3/klines':
+                    self.respond(200, exchange.binance_klines(query),
+                                 {'X-MBX-USED-WEIGHT-1M': str(used_weight)})
+                elif url.path == '/public/linear/kline':
+                    self.respond(200, exchange.bybit_klines(query))
+                else:
+                    self.respond(404, {'msg': f"Unknown path {url.path}"})
+
+            def respond(self, status: int, payload, headers: dict = None):
+                body = json.dumps(payload).encode()
+                self.send_response(status)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(body)))
+                for name, value in (headers or {}).items():
+                    self.send_header(name, value)
+                self.end_headers()
+                self.wfile.write(body)
+                with exchange.lock:
+                    exchange.bytes_sent += len(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        return Handler
+
+
+if __name__ == "__main__":
+    mock = MockExchange(latency=0.05, gap_rate=0.001, rate_limit_every=50).start()
+    try:
+        while True:
+            time.sleep(60)
+            logger.info(f"Mock exchange stats: {mock.stats()}")
+    except KeyboardInterrupt:
+        mock.stop()
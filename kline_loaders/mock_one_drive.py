@@ -0,0 +1,242 @@
+import hashlib
+import json
+import threading
+import time
+import uuid
+from datetime import datetime, timedelta, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, quote, unquote, urlparse
+
+from loguru import logger
+
+DRIVE_PREFIX = '/me/drive/root:/'
+
+
+class MockOneDrive:
+    """Local stand-in for the Graph drive endpoints OneDrive uses, files kept in memory.
+
+    Serves simple uploads, upload sessions (createUploadSession, Content-Range fragments, status and
+    cancel), content downloads through a redirect like Graph's, item metadata and paged folder listings.
+    Every fail_every-th fragment is answered with HTTP 503, expire_sessions() drops the open sessions.
+    """
+
+    def __init__(self, fail_every: int = 0, page_size: int = 200, port: int = 0):
+        self.fail_every = fail_every
+        self.page_size = page_size
+        self.lock = threading.Lock()
+        self.files = {}  # path: (content, cTag)
+        self.sessions = {}  # id: {'path', 'size', 'content'}
+        self.requests = 0
+        self.fragments = 0
+        self.failed_fragments = 0
+        self.bytes_received = 0
+        self.bytes_sent = 0
+        self.server = ThreadingHTTPServer(('127.0.0.1', port), self.handler_class())
+        self.server.daemon_threads = True
+        self.thread = None
+
+    @property
+    def url(self) -> str:
+        host, port = self.server.server_address
+        return f"http://{host}:{port}"
+
+    def start(self):
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self.thread.start()
+        logger.info(f"Mock OneDrive listening on {self.url}")
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def stats(self) -> dict:
+        with self.lock:
+            return {'requests': self.requests, 'fragments': self.fragments, 'failed_fragments': self.failed_fragments,
+                    'bytes_received': self.bytes_received, 'bytes_sent': self.bytes_sent}
+
+    def expire_sessions(self):
+        with self.lock:
+            self.sessions.clear()
+
+    def store(self, path: str, content: bytes) -> dict:
+        with self.lock:
+            self.files[path] = (content, f'"c:{{{hashlib.sha1(content).hexdigest()}}},{time.time_ns()}"')
+        return self.item(path)
+
+    def item(self, path: str) -> dict:
+        content, ctag = self.files[path]
+        return {'id': hashlib.sha1(path.encode()).hexdigest(), 'name': path.rsplit('/', 1)[-1], 'size': len(content),
+                'cTag': ctag, 'file': {'hashes': {'sha1Hash': hashlib.sha1(content).hexdigest().upper()}}}
+
+    def children(self, folder: str) -> list:
+        prefix = f"{folder}/" if folder else ''
+        names, folders = set(), set()
+        with self.lock:
+            paths = list(self.files)
+        for path in paths:
+            if path.startswith(prefix):
+                name, _, rest = path[len(prefix):].partition('/')
+                (folders if rest else names).add(name)
+        items = [{'name': name, 'folder': {}} for name in sorted(folders)]
+        return items + [self.item(prefix + name) for name in sorted(names)]
+
+    def handler_class(self):
+        drive = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def route(self):
+                url = urlparse(self.path)
+                with drive.lock:
+                    drive.requests += 1
+                return url, unquote(url.path), {key: values[0] for key, values in parse_qs(url.query).items()}
+
+            def body(self) -> bytes:
+                body = self.rfile.read(int(self.headers.get('Content-Length', 0)))
+                with drive.lock:
+                    drive.bytes_received += len(body)
+                return body
+
+            def do_GET(self):
+                url, path, query = self.route()
+                if path.startswith('/download/'):
+                    content = drive.files.get(path[len('/download/'):])
+                    if content is None:
+                        self.respond(404, {'error': {'code': 'itemNotFound'}})
+                    else:
+                        self.respond_bytes(content[0])
+                elif path.startswith('/upload/'):
+                    session = drive.sessions.get(path[len('/upload/'):])
+                    if session is None:
+                        self.respond(404, {'error': {'code': 'itemNotFound'}})
+                    else:
+                        self.respond(200, self.session_status(session))
+                elif path.startswith(DRIVE_PREFIX) and path.endswith(':/content'):
+                    file_path = path[len(DRIVE_PREFIX):-len(':/content')]
+                    if file_path not in drive.files:
+                        self.respond(404, {'error': {'code': 'itemNotFound'}})
+                    else:
+                        # Graph answers with a redirect to a pre-authenticated download URL
+                        self.respond(302, {}, {'Location': f"{drive.url}/download/{quote(file_path)}"})
+                elif path.startswith(DRIVE_PREFIX) and path.endswith(':/children'):
+                    folder = path[len(DRIVE_PREFIX):-len(':/children')]
+                    items = drive.children(folder)
+                    if not items:
+                        self.respond(404, {'error': {'code': 'itemNotFound'}})
+                        return
+                    skip = int(query.get('skip', 0))
+                    page = {'value': items[skip:skip + drive.page_size]}
+                    if skip + drive.page_size < len(items):
+                        page['@odata.nextLink'] = f"{drive.url}{url.path}?skip={skip + drive.page_size}"
+                    self.respond(200, page)
+                elif path.startswith(DRIVE_PREFIX):
+                    file_path = path[len(DRIVE_PREFIX):]
+                    if file_path in drive.files:
+                        self.respond(200, drive.item(file_path))
+                    else:
+                        self.respond(404, {'error': {'code': 'itemNotFound'}})
+                else:
+                    self.respond(404, {'error': {'code': 'invalidRequest', 'message': f"Unknown path {path}"}})
+
+            def do_PUT(self):
+                url, path, query = self.route()
+                body = self.body()
+                if path.startswith('/upload/'):
+                    self.put_fragment(path[len('/upload/'):], body)
+                elif path.startswith(DRIVE_PREFIX) and path.endswith(':/content'):
+                    self.respond(201, drive.store(path[len(DRIVE_PREFIX):-len(':/content')], body))
+                else:
+                    self.respond(404, {'error': {'code': 'invalidRequest', 'message': f"Unknown path {path}"}})
+
+            def do_POST(self):
+                url, path, query = self.route()
+                self.body()
+                if path.startswith(DRIVE_PREFIX) and path.endswith(':/createUploadSession'):
+                    session_id = uuid.uuid4().hex
+                    with drive.lock:
+                        drive.sessions[session_id] = {'path': path[len(DRIVE_PREFIX):-len(':/createUploadSession')],
+                                                      'size': None, 'content': bytearray()}
+                    self.respond(200, {'uploadUrl': f"{drive.url}/upload/{session_id}",
+                                       'expirationDateTime': self.expiration(), 'nextExpectedRanges': ['0-']})
+                else:
+                    self.respond(404, {'error': {'code': 'invalidRequest', 'message': f"Unknown path {path}"}})
+
+            def do_DELETE(self):
+                url, path, query = self.route()
+                with drive.lock:
+                    found = drive.sessions.pop(path[len('/upload/'):], None) is not None
+                if found:
+                    self.respond_bytes(b'', 204)
+                else:
+                    self.respond(404, {'error': {'code': 'itemNotFound'}})
+
+            def put_fragment(self, session_id: str, body: bytes):
+                if 'Authorization' in self.headers:
+                    self.respond(401, {'error': {'code': 'unauthenticated',
+                                                 'message': "Upload URLs don't take an Authorization header"}})
+                    return
+                with drive.lock:
+                    session = drive.sessions.get(session_id)
+                    drive.fragments += 1
+                    fail = drive.fail_every and drive.fragments % drive.fail_every == 0
+                    if fail:
+                        drive.failed_fragments += 1
+                if session is None:
+                    self.respond(404, {'error': {'code': 'itemNotFound'}})
+                    return
+                if fail:
+                    self.respond(503, {'error': {'code': 'serviceNotAvailable'}}, {'Retry-After': '0'})
+                    return
+
+                first_last, _, size = self.headers['Content-Range'].removeprefix('bytes ').partition('/')
+                first, last = (int(value) for value in first_last.split('-'))
+                if first != len(session['content']) or last - first + 1 != len(body):
+                    self.respond(416, {'error': {'code': 'invalidRange'}, **self.session_status(session)})
+                    return
+                session['size'] = int(size)
+                session['content'] += body
+                if len(session['content']) < session['size']:
+                    self.respond(202, self.session_status(session))
+                    return
+                with drive.lock:
+                    drive.sessions.pop(session_id, None)
+                self.respond(201, drive.store(session['path'], bytes(session['content'])))
+
+            def session_status(self, session: dict) -> dict:
+                return {'expirationDateTime': self.expiration(), 'nextExpectedRanges': [f"{len(session['content'])}-"]}
+
+            @staticmethod
+            def expiration() -> str:
+                return (datetime.now(timezone.utc) + timedelta(days=1)).strftime('%Y-%m-%dT%H:%M:%SZ')
+
+            def respond(self, status: int, payload, headers: dict = None):
+                self.respond_bytes(json.dumps(payload).encode(), status, headers, 'application/json')
+
+            def respond_bytes(self, body: bytes, status: int = 200, headers: dict = None,
+                              content_type: str = 'application/octet-stream'):
+                self.send_response(status)
+                self.send_header('Content-Type', content_type)
+                self.send_header('Content-Length', str(len(body)))
+                for name, value in (headers or {}).items():
+                    self.send_header(name, value)
+                self.end_headers()
+                self.wfile.write(body)
+                with drive.lock:
+                    drive.bytes_sent += len(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        return Handler
+
+
+if __name__ == "__main__":
+    mock = MockOneDrive(fail_every=20).start()
+    try:
+        while True:
+            time.sleep(60)
+            logger.info(f"Mock OneDrive stats: {mock.stats()}")
+    except KeyboardInterrupt:
+        mock.stop()
@@ -1,21 +1,50 @@
-import requests
+import io
 import json
+import os
+import time
+
+import requests
+
+import utils
+
+GRAPH_URL = "https://graph.microsoft.com/v1.0"
+SIMPLE_UPLOAD_LIMIT = 4 * 1024 * 1024  # larger bodies go through an upload session
+FRAGMENT_UNIT = 320 * 1024  # upload session fragments must be a multiple of this
+FRAGMENT_BYTES = 32 * FRAGMENT_UNIT  # 10 MiB
+MAX_FRAGMENT_RETRIES = 5
+
+
+class UploadSessionExpired(Exception):
+    """The upload session is gone (expired or cancelled), the upload has to start over."""
+
+
+def expected_offset(status: dict):
+    """Start of the first byte range an upload session still expects, None when it has them all."""
+    ranges = status.get('nextExpectedRanges') or []
+    return int(ranges[0].split('-')[0]) if ranges else None
 
 
 class OneDrive:
-    def __init__(self, client_id, client_secret, redirect_uri, refresh_token=None):
+    def __init__(self, client_id, client_secret, redirect_uri, refresh_token=None, graph_url=GRAPH_URL,
+                 access_token=None):
+        """graph_url points the client at another Graph endpoint, e.g. a MockOneDrive for tests."""
         self.client_id = client_id
         self.client_secret = client_secret
         self.redirect_uri = redirect_uri
         self.token_url = "https://login.microsoftonline.com/common/oauth2/v2.0/token"
-        self.api_base_url = "https://graph.microsoft.com/v1.0/me/drive/root:"
+        self.graph_url = graph_url.rstrip('/')
+        self.api_base_url = f"{self.graph_url}/me/drive/root:"
         self.session = requests.Session()
+        # Upload URLs are pre-authenticated, Graph rejects requests to them that carry the bearer token
+        self.upload_session = requests.Session()
 
         if refresh_token:
             self.refresh_token = refresh_token
             self.refresh_access_token()
         else:
-            self.access_token = None
+            self.access_token = access_token
+            if access_token:
+                self.session.headers.update({'Authorization': f'Bearer {access_token}'})
 
     def refresh_access_token(self):
         data = {
@@ -31,11 +60,139 @@ class OneDrive:
         self.session.headers.update({'Authorization': f'Bearer {self.access_token}'})
 
     def get_file(self, file_path):
+        """The whole file in memory, use download() for anything large."""
         response = self.session.get(f'{self.api_base_url}/{file_path}:/content')
         response.raise_for_status()  # Check if the request was successful
         return response.content  # Return file content
 
+    def download(self, file_path, target, chunk_size: int = utils.CHUNK_BYTES) -> int:
+        """Stream file_path into the local file target, replaced atomically once complete. Returns its size."""
+        with self.session.get(f'{self.api_base_url}/{file_path}:/content', stream=True) as response:
+            response.raise_for_status()
+            size = 0
+            with utils.atomic_open(target) as file:
+                for chunk in response.iter_content(chunk_size):
+                    file.write(chunk)
+                    size += len(chunk)
+        return size
+
     def save_file(self, file_path, content):
+        """Upload content (bytes or str), through an upload session when it is too large for a single PUT."""
+        if isinstance(content, str):
+            content = content.encode('utf-8')
+        if len(content) > SIMPLE_UPLOAD_LIMIT:
+            return self.upload_stream(file_path, io.BytesIO(content), len(content))
         response = self.session.put(f'{self.api_base_url}/{file_path}:/content', data=content)
         response.raise_for_status()  # Check if the request was successful
         return response.json()  # Return the JSON response
+
+    def upload(self, file_path, local_path, upload_url=None, on_session=None) -> dict:
+        """Upload the local file local_path to file_path, returns the drive item.
+
+        Files over SIMPLE_UPLOAD_LIMIT go through an upload session. on_session(upload_url) is called when
+        one is created, passing that upload_url back resumes the upload from what the session already has.
+        """
+        size = os.path.getsize(local_path)
+        with open(local_path, 'rb') as file:
+            if size <= SIMPLE_UPLOAD_LIMIT and upload_url is None:
+                response = self.session.put(f'{self.api_base_url}/{file_path}:/content', data=file)
+                response.raise_for_status()
+                return response.json()
+            return self.upload_stream(file_path, file, size, upload_url, on_session)
+
+    def create_upload_session(self, file_path) -> str:
+        body = {'item': {'@microsoft.graph.conflictBehavior': 'replace'}}
+        response = self.session.post(f'{self.api_base_url}/{file_path}:/createUploadSession', json=body)
+        response.raise_for_status()
+        return response.json()['uploadUrl']
+
+    def next_expected_offset(self, upload_url) -> int:
+        response = self.upload_session.get(upload_url)
+        if response.status_code == 404:
+            raise UploadSessionExpired(upload_url)
+        response.raise_for_status()
+        offset = expected_offset(response.json())
+        if offset is None:
+            # Every byte arrived but the item never came back, only a new session can produce it
+            raise UploadSessionExpired(upload_url)
+        return offset
+
+    def upload_stream(self, file_path, file, size: int, upload_url=None, on_session=None,
+                      fragment_bytes: int = FRAGMENT_BYTES) -> dict:
+        """Upload size bytes of the seekable file in fragments, resuming upload_url's session when given.
+
+        Graph takes a session's fragments in order only, so they are sent one after the other; failed
+        fragments are retried from the offset the session reports.
+        """
+        if upload_url is None:
+            upload_url = self.create_upload_session(file_path)
+            if on_session:
+                on_session(upload_url)
+            offset = 0
+        else:
+            offset = self.next_expected_offset(upload_url)
+
+        retries = 0
+        while True:
+            file.seek(offset)
+            fragment = file.read(min(fragment_bytes, size - offset))
+            headers = {'Content-Length': str(len(fragment)),
+                       'Content-Range': f"bytes {offset}-{offset + len(fragment) - 1}/{size}"}
+            try:
+                response = self.upload_session.put(upload_url, data=fragment, headers=headers)
+            except (requests.ConnectionError, requests.Timeout):
+                response = None
+
+            if response is not None and response.status_code in (200, 201):
+                return response.json()
+            if response is not None and response.status_code == 202:
+                offset = expected_offset(response.json())
+                if offset is None:
+                    raise UploadSessionExpired(upload_url)
+                retries = 0
+                continue
+            if response is not None and response.status_code == 404:
+                raise UploadSessionExpired(upload_url)
+            if response is not None and response.status_code < 500 and response.status_code not in (416, 429):
+                response.raise_for_status()
+
+            # Connection errors, 5xx, 429 and 416 (the fragment overlaps what the session has): ask where to go on
+            retries += 1
+            if retries > MAX_FRAGMENT_RETRIES:
+                if response is not None:
+                    response.raise_for_status()
+                raise requests.ConnectionError(f"Uploading {file_path} failed {retries} times at byte {offset}")
+            retry_after = response.headers.get('Retry-After') if response is not None else None
+            time.sleep(float(retry_after) if retry_after else 2 ** (retries - 1))
+            offset = self.next_expected_offset(upload_url)
+
+    def get_item(self, file_path):
+        """The drive item at file_path, None when there is none."""
+        response = self.session.get(f'{self.api_base_url}/{file_path}')
+        if response.status_code == 404:
+            return None
+        response.raise_for_status()
+        return response.json()
+
+    def list_files(self, folder_path) -> dict:
+        """Drive items of every file under folder_path by their path relative to it, subfolders included."""
+        files = {}
+        folders = ['']
+        while folders:
+            folder = folders.pop()
+            path = f"{folder_path}/{folder}".rstrip('/')
+            url = f'{self.api_base_url}/{path}:/children'
+            while url:
+                response = self.session.get(url)
+                if response.status_code == 404 and not folder:
+                    return files  # nothing uploaded yet
+                response.raise_for_status()
+                page = response.json()
+                for item in page['value']:
+                    relative = f"{folder}/{item['name']}".lstrip('/')
+                    if 'folder' in item:
+                        folders.append(relative)
+                    else:
+                        files[relative] = item
+                url = page.get('@odata.nextLink')
+        return files
@@ -0,0 +1,190 @@
+import argparse
+import hashlib
+import json
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+from loguru import logger
+
+import utils
+from kline_loaders.one_drive import GRAPH_URL, OneDrive, UploadSessionExpired
+
+MANIFEST_FILENAME = ".onedrive-manifest.json"
+PATTERNS = ['**/*.parquet']
+WORKERS = 4
+MANIFEST_FLUSH_FILES = 100  # files recorded between manifest writes
+
+
+def file_hash(path) -> str:
+    digest = hashlib.blake2b()
+    with open(path, 'rb') as file:
+        while chunk := file.read(utils.CHUNK_BYTES):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+class OneDriveSync:
+    """Keeps a local directory of kline partitions and a OneDrive folder in step, moving only changed files.
+
+    The manifest ({local_root}/.onedrive-manifest.json) records every synced file's size, mtime, content
+    hash and the cTag OneDrive gave it. push() uploads the files whose content hash changed since they were
+    last synced, hashing only files whose size or mtime moved. pull() downloads the files whose cTag
+    changed. Transfers run workers files at a time. Large uploads go through upload sessions whose URL is
+    kept in the manifest, an interrupted push resumes them where the session stopped.
+    """
+
+    def __init__(self, drive: OneDrive, local_root, remote_root: str, patterns: list = None, workers: int = WORKERS):
+        self.drive = drive
+        self.local_root = Path(local_root)
+        self.remote_root = remote_root.strip('/')
+        self.patterns = patterns or PATTERNS
+        self.workers = workers
+        self.manifest_path = self.local_root / MANIFEST_FILENAME
+        self.manifest = self.read_manifest()
+        self.lock = threading.Lock()
+        self.unwritten = 0
+
+    def read_manifest(self) -> dict:
+        try:
+            with open(self.manifest_path, 'r') as file:
+                manifest = json.load(file)
+        except FileNotFoundError:
+            manifest = {}
+        except json.JSONDecodeError:
+            logger.error(f"Error parsing JSON from {self.manifest_path}, every file is compared again")
+            manifest = {}
+        return {'files': manifest.get('files', {}), 'sessions': manifest.get('sessions', {})}
+
+    def record(self, relative: str, entry: dict = None, session=None):
+        """Update the manifest after one file. It is written every MANIFEST_FLUSH_FILES files, when an upload
+        session starts and when a transfer ends; a crash costs the files recorded since the last write a
+        rehash and transfer."""
+        with self.lock:
+            if entry is not None:
+                self.manifest['files'][relative] = entry
+            if session is None:
+                self.manifest['sessions'].pop(relative, None)
+            else:
+                self.manifest['sessions'][relative] = session
+            self.unwritten += 1
+            if self.unwritten >= MANIFEST_FLUSH_FILES or session is not None:
+                self.write_manifest()
+
+    def flush(self):
+        with self.lock:
+            if self.unwritten:
+                self.write_manifest()
+
+    def write_manifest(self):
+        # Called with the lock held
+        utils.atomic_write(self.manifest_path, json.dumps(self.manifest, indent=2, sort_keys=True))
+        self.unwritten = 0
+
+    def local_files(self) -> list:
+        paths = {path for pattern in self.patterns for path in self.local_root.glob(pattern) if path.is_file()}
+        return sorted(path.relative_to(self.local_root).as_posix() for path in paths)
+
+    def remote_path(self, relative: str) -> str:
+        return f"{self.remote_root}/{relative}"
+
+    def changed_hash(self, relative: str):
+        """The file's content hash when it differs from the manifest's, None when it is unchanged."""
+        path = self.local_root / relative
+        stat = path.stat()
+        entry = self.manifest['files'].get(relative)
+        if entry and entry['size'] == stat.st_size and entry['mtime_ns'] == stat.st_mtime_ns:
+            return None
+
+        content_hash = file_hash(path)
+        if entry and entry['hash'] == content_hash:
+            # Touched but not changed, only the stat moves
+            self.record(relative, {**entry, 'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns},
+                        self.manifest['sessions'].get(relative))
+            return None
+        return content_hash
+
+    def push_file(self, relative: str) -> int:
+        content_hash = self.changed_hash(relative)
+        if content_hash is None:
+            return 0
+
+        path = self.local_root / relative
+        stat = path.stat()
+        session = self.manifest['sessions'].get(relative)
+        upload_url = session['upload_url'] if session and session['hash'] == content_hash else None
+
+        def on_session(url):
+            self.record(relative, session={'upload_url': url, 'hash': content_hash})
+
+        try:
+            item = self.drive.upload(self.remote_path(relative), path, upload_url, on_session)
+        except UploadSessionExpired:
+            logger.info(f"Upload session of {relative} expired, uploading it again")
+            item = self.drive.upload(self.remote_path(relative), path, None, on_session)
+        self.record(relative, {'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns, 'hash': content_hash,
+                               'ctag': item.get('cTag')})
+        logger.info(f"Uploaded {relative} ({stat.st_size} bytes)")
+        return stat.st_size
+
+    def pull_file(self, relative: str, item: dict) -> int:
+        path = self.local_root / relative
+        entry = self.manifest['files'].get(relative)
+        if entry and entry.get('ctag') == item.get('cTag') and path.exists():
+            return 0
+
+        os.makedirs(path.parent, exist_ok=True)
+        size = self.drive.download(self.remote_path(relative), path)
+        stat = path.stat()
+        self.record(relative, {'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns, 'hash': file_hash(path),
+                               'ctag': item.get('cTag')}, self.manifest['sessions'].get(relative))
+        logger.info(f"Downloaded {relative} ({size} bytes)")
+        return size
+
+    def transfer(self, function, arguments: list) -> dict:
+        # Parallel across files, an upload session itself only takes its fragments in order
+        try:
+            with ThreadPoolExecutor(self.workers) as executor:
+                sizes = list(executor.map(lambda args: function(*args), arguments))
+        finally:
+            self.flush()
+        transferred = [size for size in sizes if size]
+        return {'files': len(sizes), 'transferred': len(transferred), 'bytes': sum(transferred)}
+
+    def push(self) -> dict:
+        """Upload the local files that changed since the last sync."""
+        summary = self.transfer(self.push_file, [(relative,) for relative in self.local_files()])
+        logger.info(f"Pushed {summary['transferred']} of {summary['files']} files, {summary['bytes']} bytes")
+        return summary
+
+    def pull(self) -> dict:
+        """Download the remote files that changed since the last sync."""
+        items = self.drive.list_files(self.remote_root)
+        summary = self.transfer(self.pull_file, sorted(items.items()))
+        logger.info(f"Pulled {summary['transferred']} of {summary['files']} files, {summary['bytes']} bytes")
+        return summary
+
+
+def load_drive(graph_url=None) -> OneDrive:
+    """A OneDrive client from {PYSCALPIE_PATH}/onedrive.json: clientId, clientSecret, redirectUri, refreshToken."""
+    with open(utils.PYSCALPIE_PATH / "onedrive.json", 'r') as file:
+        config = json.load(file)
+    return OneDrive(config['clientId'], config['clientSecret'], config['redirectUri'], config.get('refreshToken'),
+                    graph_url=graph_url or config.get('graphUrl', GRAPH_URL),
+                    access_token=config.get('accessToken'))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Sync a connection's kline partitions with OneDrive")
+    parser.add_argument('direction', choices=['push', 'pull'])
+    parser.add_argument('connection', help="the klines are in PYSCALPIE_DIR/{connection}")
+    parser.add_argument('--remote', help="OneDrive folder (default: PyScalpie/{connection})")
+    parser.add_argument('--pattern', action='append', help=f"files to sync, repeatable (default: {PATTERNS})")
+    parser.add_argument('--workers', type=int, default=WORKERS, help="files transferred at a time")
+    parser.add_argument('--graph-url', help="Graph endpoint, e.g. a local MockOneDrive")
+    args = parser.parse_args()
+
+    sync = OneDriveSync(load_drive(args.graph_url), utils.PYSCALPIE_PATH / args.connection,
+                        args.remote or f"PyScalpie/{args.connection}", args.pattern, args.workers)
+    print(json.dumps(sync.push() if args.direction == 'push' else sync.pull()))
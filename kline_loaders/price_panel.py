@@ -0,0 +1,221 @@
+import argparse
+import json
+import os
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+from loguru import logger
+
+import utils
+from kline_loaders.intervals import interval_seconds
+from kline_loaders.kline_store import KlineStore
+
+PANEL_VERSION = 1
+FIELDS = ['close', 'volume']
+CHUNK_ROWS = 100_000  # rows filled or scanned at a time, bounds the memory of growing and scanning a panel
+PRESENT = 'present'
+
+
+class PricePanel:
+    """Time × symbol matrices of kline fields of one interval, on a common open_time grid, memory mapped.
+
+    Layout: {root}/panels/{interval}/{field}.bin, one row-major (rows, symbols) array per field, and
+    present.bin, True where the symbol has a bar. Row i is the bar opening at start + i * interval, missing
+    bars are NaN. meta.json records the grid, the symbols and the last bar each symbol had when the panel
+    was updated. update() fills in only the bars stored since then, growing the files in place; a change of
+    symbols, fields or dtype, or history older than the grid start, rebuilds the panel.
+
+    Stored bars before a symbol's last panel bar are taken to be final, as HistoryUpdater only appends and
+    re-fetches the last candle.
+    """
+
+    def __init__(self, root, interval: str, symbols: list, fields: list = None, dtype=np.float64, directory=None):
+        self.store = KlineStore(root)
+        self.interval = interval
+        self.step = interval_seconds(interval) * 1_000_000_000
+        self.symbols = list(symbols)
+        self.fields = list(fields or FIELDS)
+        self.dtype = np.dtype(dtype)
+        self.directory = Path(directory or self.store.root / "panels" / interval)
+        self.meta_path = self.directory / "meta.json"
+        self.meta = self.read_meta()
+
+    def read_meta(self):
+        try:
+            with open(self.meta_path, 'r') as file:
+                return json.load(file)
+        except FileNotFoundError:
+            return None
+        except json.JSONDecodeError:
+            logger.error(f"Error parsing JSON from {self.meta_path}, building the panel again")
+            return None
+
+    def settings(self) -> dict:
+        return {'version': PANEL_VERSION, 'interval': self.interval, 'symbols': self.symbols, 'fields': self.fields,
+                'dtype': self.dtype.str}
+
+    def update(self) -> int:
+        """Bring the panel up to the store's latest bars, returns the number of bars written."""
+        first_times = {symbol: self.first_open_time(symbol) for symbol in self.symbols}
+        first_times = {symbol: time for symbol, time in first_times.items() if time is not None}
+        if not first_times:
+            logger.warning(f"No {self.interval} klines stored for {', '.join(self.symbols)}, no panel to build")
+            return 0
+        start = min(first_times.values())
+
+        meta = self.meta
+        if meta is None or {key: meta.get(key) for key in self.settings()} != self.settings() or meta['start'] > start:
+            if meta is not None:
+                logger.info(f"Symbols, fields or history of {self.directory} changed, building it again")
+            meta = {**self.settings(), 'start': start, 'step': self.step, 'rows': 0,
+                    'last_open_times': {symbol: None for symbol in self.symbols}}
+
+        last_times = {symbol: self.store.last_open_time(symbol, self.interval) for symbol in first_times}
+        end = max(time.value for time in last_times.values())
+        rows = max((end - meta['start']) // self.step + 1, meta['rows'])
+        os.makedirs(self.directory, exist_ok=True)
+        self.grow(meta['rows'], rows)
+
+        written = 0
+        arrays = {name: self.open(name, rows, 'r+') for name in self.fields + [PRESENT]}
+        for column, symbol in enumerate(self.symbols):
+            if symbol in first_times:
+                written += self.fill(arrays, column, symbol, meta['start'], meta['last_open_times'][symbol])
+                meta['last_open_times'][symbol] = last_times[symbol].value
+        for array in arrays.values():
+            array.flush()
+        del arrays
+
+        # The data is in place before meta.json says so, a crash leaves the previous panel readable
+        meta['rows'] = rows
+        utils.atomic_write(self.meta_path, json.dumps(meta, indent=2))
+        self.meta = meta
+        logger.info(f"Wrote {written} bars into the {rows} × {len(self.symbols)} panel {self.directory}")
+        return written
+
+    def first_open_time(self, symbol: str):
+        months = self.store.months(symbol, self.interval)
+        if not months:
+            return None
+        df = pd.read_parquet(self.store.partition_path(symbol, self.interval, months[0]), columns=['open_time'])
+        return int(df['open_time'].min().value)
+
+    def grow(self, stored_rows: int, rows: int):
+        """Cut every file back to stored_rows, dropping what a crashed update appended, and pad it to rows."""
+        for name in self.fields + [PRESENT]:
+            dtype = np.dtype(bool) if name == PRESENT else self.dtype
+            row_bytes = len(self.symbols) * dtype.itemsize
+            filler = np.zeros if name == PRESENT else lambda shape, dtype: np.full(shape, np.nan, dtype=dtype)
+            with open(self.directory / f"{name}.bin", 'ab') as file:
+                file.truncate(stored_rows * row_bytes)
+                for first in range(stored_rows, rows, CHUNK_ROWS):
+                    file.write(filler((min(CHUNK_ROWS, rows - first), len(self.symbols)), dtype=dtype).tobytes())
+
+    def fill(self, arrays: dict, column: int, symbol: str, start: int, from_time) -> int:
+        """Write symbol's bars from from_time on into its column, a month of klines at a time."""
+        from_month = pd.Timestamp(from_time).strftime('%Y-%m') if from_time is not None else None
+        written = 0
+        for month in self.store.months(symbol, self.interval):
+            if from_month is not None and month < from_month:
+                continue
+            df = pd.read_parquet(self.store.partition_path(symbol, self.interval, month),
+                                 columns=['open_time'] + self.fields)
+            times = df['open_time'].to_numpy(dtype='datetime64[ns]').view(np.int64)
+            keep = (times - start) % self.step == 0  # bars off the grid can't be placed
+            if from_time is not None:
+                keep &= times >= from_time
+            if not keep.all():
+                df, times = df[keep], times[keep]
+            rows = (times - start) // self.step
+            for field in self.fields:
+                arrays[field][rows, column] = df[field].to_numpy(dtype=self.dtype)
+            arrays[PRESENT][rows, column] = True
+            written += len(rows)
+        return written
+
+    def open(self, name: str, rows: int, mode: str = 'r') -> np.ndarray:
+        dtype = np.dtype(bool) if name == PRESENT else self.dtype
+        if rows == 0:
+            return np.empty((0, len(self.symbols)), dtype=dtype)
+        return np.memmap(self.directory / f"{name}.bin", dtype=dtype, mode=mode, shape=(rows, len(self.symbols)))
+
+    @property
+    def rows(self) -> int:
+        return self.meta['rows'] if self.meta else 0
+
+    def values(self, field: str) -> np.ndarray:
+        """Read-only (rows, symbols) matrix of field, NaN where a symbol has no bar. Pages in as it is read."""
+        if field not in self.fields:
+            raise ValueError(f"{field} is not in the panel, it has {', '.join(self.fields)}")
+        return self.open(field, self.rows).view(np.ndarray)
+
+    def present(self) -> np.ndarray:
+        return self.open(PRESENT, self.rows).view(np.ndarray)
+
+    def masked(self, field: str) -> np.ma.MaskedArray:
+        return np.ma.masked_array(self.values(field), mask=~self.present())
+
+    def open_times(self) -> np.ndarray:
+        if not self.meta:
+            return np.empty(0, dtype='datetime64[ns]')
+        return (self.meta['start'] + np.arange(self.rows, dtype=np.int64) * self.step).astype('datetime64[ns]')
+
+    def row_range(self, start=None, end=None) -> slice:
+        """Rows of the bars with start <= open_time < end."""
+        if not self.meta:
+            return slice(0, 0)
+        first = 0 if start is None else -(-(pd.Timestamp(start).value - self.meta['start']) // self.step)
+        last = self.rows if end is None else -(-(pd.Timestamp(end).value - self.meta['start']) // self.step)
+        return slice(min(max(first, 0), self.rows), min(max(last, 0), self.rows))
+
+    def return_correlation(self, field: str = 'close', start=None, end=None) -> pd.DataFrame:
+        """Pairwise correlation of the symbols' log returns from bar to bar, each pair over the bars both have.
+
+        Scans the panel CHUNK_ROWS rows at a time, memory stays at a few symbols × symbols matrices.
+        """
+        values = self.values(field)
+        rows = self.row_range(start, end)
+        symbols = len(self.symbols)
+        count, sums, squares, products = (np.zeros((symbols, symbols)) for _ in range(4))
+        for first in range(rows.start + 1, rows.stop, CHUNK_ROWS):
+            chunk = np.asarray(values[first - 1:min(first + CHUNK_ROWS, rows.stop)], dtype=np.float64)
+            with np.errstate(divide='ignore', invalid='ignore'):
+                returns = np.log(chunk[1:] / chunk[:-1])
+            valid = np.isfinite(returns)
+            returns = np.where(valid, returns, 0.0)
+            valid = valid.astype(np.float64)
+            # [i, j] sums over the bars where both i and j have a return
+            count += valid.T @ valid
+            sums += returns.T @ valid
+            squares += (returns ** 2).T @ valid
+            products += returns.T @ returns
+
+        with np.errstate(divide='ignore', invalid='ignore'):
+            covariance = count * products - sums * sums.T
+            variance = (count * squares - sums ** 2) * (count * squares - sums ** 2).T
+            correlation = covariance / np.sqrt(variance)
+        correlation[count < 2] = np.nan
+        return pd.DataFrame(correlation, index=self.symbols, columns=self.symbols)
+
+
+def update_panel(root, interval: str, symbols: list, fields: list = None, dtype=np.float64) -> PricePanel:
+    panel = PricePanel(root, interval, symbols, fields, dtype)
+    panel.update()
+    return panel
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Build or extend the aligned price panel of stored klines")
+    parser.add_argument('connection', help="connection name, the klines are in PYSCALPIE_DIR/{connection}")
+    parser.add_argument('interval')
+    parser.add_argument('symbols', nargs='+')
+    parser.add_argument('--fields', nargs='+', default=FIELDS)
+    parser.add_argument('--dtype', default='float64', help="float32 halves the panel's size")
+    parser.add_argument('--correlation', action='store_true', help="print the close return correlation matrix")
+    args = parser.parse_args()
+
+    panel = update_panel(utils.PYSCALPIE_PATH / args.connection, args.interval, args.symbols, args.fields, args.dtype)
+    print(f"{panel.rows} bars × {len(panel.symbols)} symbols, {panel.present().mean():.1%} present")
+    if args.correlation:
+        print(panel.return_correlation().round(3).to_string())
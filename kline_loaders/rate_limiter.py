@@ -0,0 +1,67 @@
+import threading
+import time
+
+from loguru import logger
+
+
+class WeightRateLimiter:
+    """Request weight budget shared by every thread talking to one exchange.
+
+    The budget follows the exchange's own accounting: each response carries the weight used in the
+    current window (e.g. Binance's X-MBX-USED-WEIGHT-1M header) and the limiter blocks new requests
+    once the next one would push the window over the limit.
+    """
+
+    def __init__(self, weight_limit=6000, window_seconds=60, used_weight_header='X-MBX-USED-WEIGHT-1M',
+                 safety_margin=0.9):
+        self.weight_limit = int(weight_limit * safety_margin)
+        self.window_seconds = window_seconds
+        self.used_weight_header = used_weight_header
+        self.lock = threading.Lock()
+        self.window = self._current_window()
+        self.used_weight = 0
+        self.blocked_until = 0.0
+
+    def _current_window(self):
+        return int(time.time() // self.window_seconds)
+
+    def acquire(self, weight=1) -> float:
+        """Reserve weight, waiting until the budget allows it. Returns the seconds waited."""
+        # Reserve the weight up front so concurrent callers can't all pass the check at once
+        waited = 0.0
+        while True:
+            with self.lock:
+                now = time.time()
+                window = self._current_window()
+                if window != self.window:
+                    self.window = window
+                    self.used_weight = 0
+
+                if now >= self.blocked_until and self.used_weight + weight <= self.weight_limit:
+                    self.used_weight += weight
+                    return waited
+
+                if now < self.blocked_until:
+                    wait = self.blocked_until - now
+                else:
+                    wait = (self.window + 1) * self.window_seconds - now
+
+            logger.debug(f"Request weight budget used up, waiting {wait:.2f} seconds")
+            time.sleep(wait)
+            waited += wait
+
+    def update(self, headers):
+        if self.used_weight_header is None:
+            return
+
+        used_weight = headers.get(self.used_weight_header)
+        if used_weight is None:
+            return
+
+        with self.lock:
+            # The exchange counts every request from this IP, ours may still be in flight
+            self.used_weight = max(self.used_weight, int(used_weight))
+
+    def back_off(self, seconds):
+        with self.lock:
+            self.blocked_until = max(self.blocked_until, time.time() + seconds)
@@ -0,0 +1,159 @@
+import bisect
+import json
+import threading
+import time
+from collections import defaultdict
+from contextlib import contextmanager
+
+import utils
+
+LATENCY_BUCKETS = [0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30]  # seconds, Prometheus 'le' bounds
+PROMETHEUS_PREFIX = 'pyscalpie_kline_'
+LABELS = ['exchange', 'symbol', 'interval']
+
+# name: (Prometheus type, help), counters ending in _seconds are timers
+METRICS = {
+    'requests': ('counter', "Kline requests answered by the exchange, retried ones included"),
+    'request_weight': ('counter', "API weight the requests were charged"),
+    'bytes_received': ('counter', "Response body bytes received"),
+    'rows': ('counter', "Klines handed out after gap filling"),
+    'retries': ('counter', "Requests retried after a connection error, 429/418 or 5xx"),
+    'rate_limited': ('counter', "Responses with HTTP 429 or 418"),
+    'gaps': ('counter', "Gaps the integrity check found in fetched batches"),
+    'missing_candles': ('counter', "Candles missing from fetched batches before re-fetching"),
+    'unfilled_gaps': ('counter', "Gaps still there after re-fetching, the exchange has no candles for them"),
+    'jobs': ('counter', "Symbol/interval update jobs run"),
+    'failed_jobs': ('counter', "Symbol/interval update jobs that raised"),
+    'rate_limit_wait_seconds': ('counter', "Time spent waiting for request weight budget"),
+    'retry_sleep_seconds': ('counter', "Time spent sleeping before retries"),
+    'decode_seconds': ('counter', "Time spent parsing JSON and decoding pages into columns"),
+    'validation_seconds': ('counter', "Time spent on integrity checks and merging re-fetched candles"),
+    'conversion_seconds': ('counter', "Time spent turning batches into DataFrames"),
+    'store_seconds': ('counter', "Time spent writing klines to the KlineStore"),
+    'derive_seconds': ('counter', "Time spent deriving coarser intervals"),
+    'indicator_seconds': ('counter', "Time spent extending indicator columns"),
+    'job_seconds': ('counter', "Wall time of update jobs"),
+    'used_weight_max': ('gauge', "Highest used weight the exchange reported in a window"),
+}
+
+
+class SeriesMetrics:
+    def __init__(self):
+        self.values = defaultdict(int)
+        self.latency_buckets = [0] * (len(LATENCY_BUCKETS) + 1)  # the last one is +Inf
+        self.latency_count = 0
+        self.latency_sum = 0.0
+
+    def summary(self, run_seconds: float) -> dict:
+        summary = dict(self.values)
+        # Rates over the jobs' wall time when an updater ran them, over the whole run otherwise
+        seconds = self.values.get('job_seconds') or run_seconds
+        summary['rows_per_second'] = self.values.get('rows', 0) / seconds if seconds else 0.0
+        summary['bytes_per_second'] = self.values.get('bytes_received', 0) / seconds if seconds else 0.0
+        summary['request_latency'] = {
+            'count': self.latency_count,
+            'sum_seconds': self.latency_sum,
+            'mean_seconds': self.latency_sum / self.latency_count if self.latency_count else None,
+            'buckets': {str(bound): count for bound, count in zip(LATENCY_BUCKETS + ['+Inf'],
+                                                                  self.cumulative_buckets())},
+        }
+        return summary
+
+    def cumulative_buckets(self) -> list:
+        counts, total = [], 0
+        for count in self.latency_buckets:
+            total += count
+            counts.append(total)
+        return counts
+
+
+class RunMetrics:
+    """Counters, timers and a request latency histogram per (exchange, symbol, interval), shared by threads.
+
+    Loaders and HistoryUpdater record into one instance during a run. write_json() and write_prometheus()
+    export it, the second as a node exporter textfile.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.series = defaultdict(SeriesMetrics)
+        self.start_time = time.time()
+
+    def add(self, labels: tuple, name: str, value: float = 1):
+        with self.lock:
+            self.series[labels].values[name] += value
+
+    def maximum(self, labels: tuple, name: str, value: float):
+        with self.lock:
+            values = self.series[labels].values
+            values[name] = max(values.get(name, value), value)
+
+    def observe_latency(self, labels: tuple, seconds: float):
+        with self.lock:
+            series = self.series[labels]
+            series.latency_buckets[bisect.bisect_left(LATENCY_BUCKETS, seconds)] += 1
+            series.latency_count += 1
+            series.latency_sum += seconds
+
+    @contextmanager
+    def timer(self, labels: tuple, name: str):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add(labels, name, time.perf_counter() - start)
+
+    def summary(self) -> dict:
+        with self.lock:
+            run_seconds = time.time() - self.start_time
+            return {
+                'started': self.start_time,
+                'run_seconds': run_seconds,
+                'series': [{**dict(zip(LABELS, labels)), **series.summary(run_seconds)}
+                           for labels, series in sorted(self.series.items())],
+            }
+
+    def write_json(self, path):
+        utils.atomic_write(path, json.dumps(self.summary(), indent=2))
+
+    def prometheus_text(self) -> str:
+        lines = []
+        with self.lock:
+            series = sorted(self.series.items())
+            for name, (type_, help_) in METRICS.items():
+                metric = PROMETHEUS_PREFIX + name + ('_total' if type_ == 'counter' else '')
+                samples = [(labels, values.values[name]) for labels, values in series if name in values.values]
+                if not samples:
+                    continue
+                lines += [f"# HELP {metric} {help_}", f"# TYPE {metric} {type_}"]
+                lines += [f"{metric}{{{label_text(labels)}}} {sample_text(value)}" for labels, value in samples]
+
+            metric = PROMETHEUS_PREFIX + 'request_duration_seconds'
+            lines += [f"# HELP {metric} Latency of kline requests", f"# TYPE {metric} histogram"]
+            for labels, values in series:
+                for bound, count in zip(LATENCY_BUCKETS + ['+Inf'], values.cumulative_buckets()):
+                    lines.append(f'{metric}_bucket{{{label_text(labels)},le="{bound}"}} {count}')
+                lines.append(f"{metric}_sum{{{label_text(labels)}}} {sample_text(values.latency_sum)}")
+                lines.append(f"{metric}_count{{{label_text(labels)}}} {values.latency_count}")
+
+            metric = PROMETHEUS_PREFIX + 'last_run_timestamp_seconds'
+            lines += [f"# HELP {metric} When the run the metrics belong to started", f"# TYPE {metric} gauge",
+                      f"{metric} {self.start_time:.0f}"]
+        return '\n'.join(lines) + '\n'
+
+    def write_prometheus(self, path):
+        # Written atomically, node exporter reads only *.prom files and never sees a half written one
+        utils.atomic_write(path, self.prometheus_text())
+
+
+def label_text(labels: tuple) -> str:
+    return ','.join(f'{name}="{escape_label(value)}"' for name, value in zip(LABELS, labels))
+
+
+def sample_text(value) -> str:
+    # Exact, a counter in the millions would lose digits to :g
+    return str(int(value)) if float(value).is_integer() else repr(float(value))
+
+
+def escape_label(value) -> str:
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
@@ -0,0 +1,76 @@
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+REPO_PATH = Path(__file__).resolve().parent.parent
+ANALYSERS_PATH = REPO_PATH / "trade-analysers"
+
+# name, working directory, arguments after the interpreter
+SCENARIOS = [
+    ("python", REPO_PATH, ['-c', 'pass']),
+    ("history_updater no jobs", REPO_PATH, ['-m', 'kline_loaders.history_updater']),
+    ("history_updater --help", REPO_PATH, ['-m', 'kline_loaders.history_updater', '--help']),
+    ("torobase_report --help", ANALYSERS_PATH, ['torobase_report.py', '--help']),
+    ("torobase_analyzer --help", ANALYSERS_PATH, ['torobase_analyzer.py', '--help']),
+    ("sltp_backtester --help", ANALYSERS_PATH, ['sltp_backtester.py', '--help']),
+]
+
+
+def run(directory: Path, arguments: list, env: dict, import_time: bool = False):
+    command = [sys.executable] + (['-X', 'importtime'] if import_time else []) + arguments
+    start = time.perf_counter()
+    completed = subprocess.run(command, cwd=directory, env=env, capture_output=True, text=True)
+    seconds = time.perf_counter() - start
+    if completed.returncode != 0:
+        raise RuntimeError(f"{' '.join(arguments)} failed: {completed.stderr[-2000:]}")
+    return seconds, completed.stderr
+
+
+def slowest_imports(import_log: str, count: int) -> list:
+    """Top level imports by cumulative microseconds, from the -X importtime log."""
+    imports = []
+    for line in import_log.splitlines():
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+        _, cumulative, name = line[len('import time:'):].split('|')
+        if not name.startswith('  '):  # one space of indent is a top level import
+            imports.append((name.strip(), int(cumulative)))
+    return sorted(imports, key=lambda item: -item[1])[:count]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Measure how long the entry points take to start")
+    parser.add_argument('--runs', type=int, default=5, help="runs per scenario, the median is reported")
+    parser.add_argument('--imports', type=int, default=3, help="slowest top level imports to list per scenario")
+    parser.add_argument('--json', help="also write the results to this file")
+    args = parser.parse_args()
+
+    results = []
+    with tempfile.TemporaryDirectory() as data_dir:
+        # An empty data directory, the updater finds no connections and has nothing to do
+        env = dict(os.environ, PYSCALPIE_DIR=data_dir,
+                   PYTHONPATH=os.pathsep.join(filter(None, [str(REPO_PATH), os.environ.get('PYTHONPATH')])))
+        for name, directory, arguments in SCENARIOS:
+            seconds = [run(directory, arguments, env)[0] for _ in range(args.runs)]
+            _, import_log = run(directory, arguments, env, import_time=True)
+            results.append({'scenario': name, 'median_seconds': statistics.median(seconds), 'min_seconds': min(seconds),
+                            'slowest_imports': slowest_imports(import_log, args.imports)})
+
+    print(f"{'scenario':<30}{'median s':>10}{'min s':>8}  slowest imports (ms)")
+    for result in results:
+        imports = ', '.join(f"{name} {microseconds / 1000:.0f}" for name, microseconds in result['slowest_imports'])
+        print(f"{result['scenario']:<30}{result['median_seconds']:>10.3f}{result['min_seconds']:>8.3f}  {imports}")
+
+    if args.json:
+        with open(args.json, 'w') as file:
+            json.dump(results, file, indent=2)
+
+
+if __name__ == "__main__":
+    main()
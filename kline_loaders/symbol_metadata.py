@@ -0,0 +1,40 @@
+import json
+import os
+import threading
+
+from loguru import logger
+
+import utils
+
+_lock = threading.Lock()
+
+
+class SymbolMetadataCache:
+    """Per exchange JSON file of facts about symbols that never change, e.g. their first candle.
+
+    Stored as {PYSCALPIE_PATH}/{exchange}/symbol-metadata.json, {symbol: {key: {interval: value}}}.
+    """
+
+    def __init__(self, exchange: str):
+        self.path = utils.PYSCALPIE_PATH / exchange / "symbol-metadata.json"
+
+    def load(self) -> dict:
+        if not self.path.exists():
+            return {}
+        try:
+            with open(self.path, 'r') as file:
+                return json.load(file)
+        except json.JSONDecodeError:
+            logger.error(f"Error parsing JSON from {self.path}, ignoring cached symbol metadata")
+            return {}
+
+    def get(self, symbol: str, key: str, interval: str):
+        return self.load().get(symbol, {}).get(key, {}).get(interval)
+
+    def set(self, symbol: str, key: str, interval: str, value):
+        with _lock:
+            metadata = self.load()
+            metadata.setdefault(symbol, {}).setdefault(key, {})[interval] = value
+
+            os.makedirs(self.path.parent, exist_ok=True)
+            utils.atomic_write(self.path, json.dumps(metadata, indent=2, sort_keys=True))
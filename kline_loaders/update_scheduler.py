@@ -0,0 +1,60 @@
+import asyncio
+import time
+
+from loguru import logger
+
+DEFAULT_MAX_CONCURRENT_JOBS = 4
+
+
+class UpdateScheduler:
+    """Runs HistoryUpdater jobs concurrently, each connection capped by its maxConcurrentJobs detail.
+
+    Jobs run on worker threads because the loaders are blocking; jobs of one connection share its
+    request budget through HistoryUpdater.get_rate_limiter.
+    """
+
+    def __init__(self, updater):
+        self.updater = updater
+        self.semaphores = {}
+        self.total = 0
+        self.completed = 0
+        self.failed = []
+        self.start_time = None
+
+    def get_semaphore(self, connection_name, connection_details):
+        if connection_name not in self.semaphores:
+            max_jobs = connection_details.get('maxConcurrentJobs', DEFAULT_MAX_CONCURRENT_JOBS)
+            self.semaphores[connection_name] = asyncio.Semaphore(max_jobs)
+        return self.semaphores[connection_name]
+
+    async def run(self):
+        jobs = list(self.updater.jobs())
+        self.total = len(jobs)
+        self.start_time = time.monotonic()
+        logger.info(f"Scheduling {self.total} update jobs")
+
+        await asyncio.gather(*(self.run_job(*job) for job in jobs))
+
+        elapsed = time.monotonic() - self.start_time
+        logger.info(f"Finished {self.completed} of {self.total} update jobs in {elapsed:.1f} seconds, "
+                    f"{len(self.failed)} failed")
+        for job_name in self.failed:
+            logger.error(f"Update job failed: {job_name}")
+
+    async def run_job(self, connection_name, connection_details, symbol, interval):
+        job_name = f"{connection_name} {symbol} {interval}"
+        async with self.get_semaphore(connection_name, connection_details):
+            try:
+                succeeded = await asyncio.to_thread(self.updater.update, connection_name, connection_details, symbol,
+                                                    interval)
+            except Exception:
+                # Keep the other jobs going, the failure is reported in the run summary
+                logger.exception(f"Update job {job_name} failed")
+                succeeded = False
+        if not succeeded:
+            self.failed.append(job_name)
+
+        self.completed += 1
+        elapsed = time.monotonic() - self.start_time
+        logger.info(f"Progress: {self.completed}/{self.total} jobs done, {len(self.failed)} failed "
+                    f"({job_name}{'' if succeeded else ' failed'}), {elapsed:.1f} seconds elapsed")
@@ -0,0 +1,139 @@
+import argparse
+import logging
+
+import numpy as np
+import pandas as pd
+
+import utils
+from kline_loaders.intervals import interval_seconds
+from kline_loaders.kline_store import KlineStore
+from sparse_table import SparseTable
+from torobase_trade_reader import TorobaseTradeReader
+from trade_table import NAT, TIMESTAMP_COLUMNS, TradeTable
+
+BAR_COLUMNS = ['open', 'high', 'low', 'close']
+
+
+def enclosing_bars(open_times: np.ndarray, step: int, times: np.ndarray) -> np.ndarray:
+    """Index of the bar each time falls in, -1 when there is no such bar (before the first, in a gap or NAT).
+
+    An as-of join on the sorted bar open times, done with searchsorted so the trades need no sorting.
+    """
+    index = np.searchsorted(open_times, times, side='right') - 1
+    found = (index >= 0) & (times != NAT)
+    found[found] = times[found] < open_times[index[found]] + step
+    return np.where(found, index, -1)
+
+
+def pair_context(table: TradeTable, klines: pd.DataFrame, interval: str, utc_offset: pd.Timedelta) -> pd.DataFrame:
+    """Entry and exit bars and excursions of trades that all trade the market klines describe."""
+    step = interval_seconds(interval) * 1_000_000_000
+    klines = klines.sort_values('open_time')
+    open_times = klines['open_time'].to_numpy(dtype='datetime64[ns]').view(np.int64)
+
+    offset = utc_offset.value
+    opened = table.df['event_timestamp'].to_numpy()
+    closed = table.df['updated'].to_numpy()
+    entry = enclosing_bars(open_times, step, np.where(opened != NAT, opened - offset, NAT))
+    exit_ = enclosing_bars(open_times, step, np.where(closed != NAT, closed - offset, NAT))
+
+    context = pd.DataFrame(index=table.df.index)
+    for prefix, index in (('entry', entry), ('exit', exit_)):
+        found = index >= 0
+        context[f'{prefix}_bar_open_time'] = pd.to_datetime(np.where(found, open_times[index], NAT))
+        for column in BAR_COLUMNS:
+            values = klines[column].to_numpy(dtype=np.float64)
+            context[f'{prefix}_{column}'] = np.where(found, values[index], np.nan)
+
+    # Highest high and lowest low of the bars from the entry bar to the exit bar, both included
+    spanned = (entry >= 0) & (exit_ >= entry)
+    bars = exit_[spanned] - entry[spanned] + 1
+    context['bars_held'] = np.where(spanned, exit_ - entry + 1, 0)
+    max_high = np.full(len(table), np.nan)
+    min_low = np.full(len(table), np.nan)
+    if spanned.any():
+        highs = SparseTable(klines['high'].to_numpy(dtype=np.float64), np.maximum, int(bars.max()))
+        lows = SparseTable(klines['low'].to_numpy(dtype=np.float64), np.minimum, int(bars.max()))
+        max_high[spanned] = highs.query(entry[spanned], exit_[spanned])
+        min_low[spanned] = lows.query(entry[spanned], exit_[spanned])
+    context['max_high'] = max_high
+    context['min_low'] = min_low
+    return context
+
+
+def excursions(table: TradeTable, context: pd.DataFrame) -> pd.DataFrame:
+    """Max adverse and max favorable excursion in price, measured from the open price on the trade's side."""
+    open_price = table.df['open_price'].to_numpy()
+    buy = (table.df['transaction_type'] == 'Buy').to_numpy()
+    up = context['max_high'].to_numpy() - open_price
+    down = open_price - context['min_low'].to_numpy()
+    return pd.DataFrame({'mae': np.where(buy, down, up), 'mfe': np.where(buy, up, down)}, index=table.df.index)
+
+
+def market_context(table: TradeTable, klines: dict, interval: str, utc_offset=pd.Timedelta(0)) -> pd.DataFrame:
+    """What the market did during every trade, one row per trade in table order.
+
+    klines maps currency pairs to their klines (open_time, open, high, low, close), trades of pairs without
+    klines get NaN. Trade times are naive Torobase times, utc_offset is what to take off them to get the
+    UTC the klines are in. The entry and exit bars contain price moves from before the entry and after the
+    exit, so MAE/MFE are as seen at the bar resolution.
+    """
+    utc_offset = pd.Timedelta(utc_offset)
+    parts = []
+    for pair, pair_klines in klines.items():
+        pair_table = table.for_pair(pair)
+        if len(pair_table) and not pair_klines.empty:
+            parts.append(pair_context(pair_table, pair_klines, interval, utc_offset))
+
+    columns = [f'{prefix}_{column}' for prefix in ('entry', 'exit') for column in ['bar_open_time'] + BAR_COLUMNS]
+    context = pd.concat(parts).reindex(table.df.index) if parts else \
+        pd.DataFrame(index=table.df.index, columns=columns + ['bars_held', 'max_high', 'min_low'], dtype=np.float64)
+    context['bars_held'] = context['bars_held'].fillna(0).astype(np.int64)
+    for prefix in ('entry', 'exit'):
+        context[f'{prefix}_bar_open_time'] = pd.to_datetime(context[f'{prefix}_bar_open_time'])
+    return context.join(excursions(table, context))
+
+
+def load_klines(exchange: str, symbols: dict, interval: str, table: TradeTable, utc_offset=pd.Timedelta(0),
+                bars_after: int = 1) -> dict:
+    """Klines per currency pair from the exchange's KlineStore, only the months the trades cover.
+
+    symbols maps currency pairs to the exchange's symbols, e.g. {'BTCUSD': 'BTCUSDT'}. bars_after more bars
+    than the last trade needs are read.
+    """
+    store = KlineStore(utils.PYSCALPIE_PATH / exchange)
+    utc_offset = pd.Timedelta(utc_offset)
+    klines = {}
+    for pair, symbol in symbols.items():
+        pair_table = table.for_pair(pair)
+        times = np.concatenate([pair_table.df['event_timestamp'].to_numpy(), pair_table.df['updated'].to_numpy()])
+        times = times[times != NAT]
+        if len(times) == 0:
+            continue
+        start = pd.Timestamp(times.min()) - utc_offset - pd.Timedelta(seconds=interval_seconds(interval))
+        end = pd.Timestamp(times.max()) - utc_offset + pd.Timedelta(seconds=interval_seconds(interval) * bars_after)
+        klines[pair] = store.read(symbol, interval, start, end)
+        logging.info(f"Loaded {len(klines[pair])} {symbol} {interval} klines for {pair}")
+    return klines
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Attach entry/exit klines and MAE/MFE to every Torobase trade")
+    parser.add_argument('exchange', help="exchange directory under PYSCALPIE_DIR the klines were stored in")
+    parser.add_argument('symbols', nargs='+', help="currency pair=exchange symbol, e.g. BTCUSD=BTCUSDT")
+    parser.add_argument('--interval', default='1m')
+    parser.add_argument('--utc-offset-hours', type=float, default=0, help="hours the Torobase times are ahead of UTC")
+    parser.add_argument('--output', default='market-context.csv')
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    trades = TorobaseTradeReader().read_table()
+    offset = pd.Timedelta(hours=args.utc_offset_hours)
+    pairs = dict(symbol.split('=', 1) for symbol in args.symbols)
+    context = market_context(trades, load_klines(args.exchange, pairs, args.interval, trades, offset), args.interval,
+                             offset)
+    df = trades.df.join(context)
+    for column in TIMESTAMP_COLUMNS:
+        df[column] = df[column].to_numpy().view('datetime64[ns]')  # NAT is NaT's int64 value
+    df.to_csv(args.output, index=False)
+    logging.info(f"Wrote {len(context)} trades to {args.output}")
@@ -0,0 +1,232 @@
+import argparse
+import itertools
+import logging
+
+import numpy as np
+import pandas as pd
+
+from kline_loaders.intervals import interval_seconds
+from market_context import enclosing_bars, load_klines
+from sparse_table import SparseTable
+from sweep_runner import SweepRunner
+from torobase_trade_reader import TorobaseTradeReader
+from trade_table import NAT, TradeTable
+
+MAX_BARS = 1440  # a day of 1m bars
+EXIT_REASONS = ['take_profit', 'stop_loss', 'timeout', 'no_data']
+
+
+class SLTPBacktester:
+    """Replays stop loss / take profit exits of a batch of trades over klines, every trade at once.
+
+    A trade enters at its open price in the bar enclosing its event_timestamp and is followed for up to
+    max_bars bars. The first bar whose high or low touches the take profit or the stop loss ends it, found
+    with SparseTable.first_reaching instead of walking the bars. A bar touching both counts as the stop
+    loss. A trade touching neither exits at the close of its last bar. Touches are seen at bar resolution,
+    the entry bar's prices from before the entry included.
+
+    The bars, sparse tables and entry bars are set up once, replay() can then be run for as many SL/TP
+    choices as wanted.
+    """
+
+    def __init__(self, table: TradeTable, klines: dict, interval: str, max_bars: int = MAX_BARS,
+                 utc_offset=pd.Timedelta(0)):
+        self.max_bars = max_bars
+        self.index = table.df.index.to_numpy()
+        self.direction = np.where((table.df['transaction_type'] == 'Buy').to_numpy(), 1.0, -1.0)
+        self.open_price = table.df['open_price'].to_numpy()
+        self.stop_loss = table.df['stop_loss'].to_numpy()
+        self.take_profit = table.df['take_profit'].to_numpy()
+        self.amount = table.df['amount'].to_numpy()
+        self.actual_profit_loss = table.df['profit_loss_curr_1_value'].to_numpy()
+        self.markets = []
+
+        step = interval_seconds(interval) * 1_000_000_000
+        offset = pd.Timedelta(utc_offset).value
+        opened = table.df['event_timestamp'].to_numpy()
+        for pair, pair_klines in klines.items():
+            rows = np.flatnonzero((table.df['currency_pair'] == pair).to_numpy())
+            if len(rows) == 0 or pair_klines.empty:
+                continue
+            pair_klines = pair_klines.sort_values('open_time')
+            open_times = pair_klines['open_time'].to_numpy(dtype='datetime64[ns]').view(np.int64)
+            times = np.where(opened[rows] != NAT, opened[rows] - offset, NAT)
+            entry = enclosing_bars(open_times, step, times)
+            self.markets.append({
+                'rows': rows[entry >= 0],
+                'entry': entry[entry >= 0],
+                'last': np.minimum(entry[entry >= 0] + max_bars - 1, len(open_times) - 1),
+                'open_times': open_times,
+                'close': pair_klines['close'].to_numpy(dtype=np.float64),
+                'highs': SparseTable(pair_klines['high'].to_numpy(dtype=np.float64), np.maximum, max_bars),
+                'lows': SparseTable(pair_klines['low'].to_numpy(dtype=np.float64), np.minimum, max_bars),
+            })
+
+    TRADE_ARRAYS = ['index', 'direction', 'open_price', 'stop_loss', 'take_profit', 'amount', 'actual_profit_loss']
+    MARKET_ARRAYS = ['rows', 'entry', 'last', 'open_times', 'close']
+
+    def arrays(self) -> dict:
+        """Everything replay() and compare() read as flat named arrays, see from_arrays()."""
+        arrays = {name: getattr(self, name) for name in self.TRADE_ARRAYS}
+        arrays['max_bars'] = np.array(self.max_bars)
+        for number, market in enumerate(self.markets):
+            arrays.update({f"market{number}.{name}": market[name] for name in self.MARKET_ARRAYS})
+            for extremes in ('highs', 'lows'):
+                arrays.update({f"market{number}.{extremes}.{level}": values
+                               for level, values in enumerate(market[extremes].levels)})
+        return arrays
+
+    @classmethod
+    def from_arrays(cls, arrays: dict):
+        """A backtester over arrays() of another one, e.g. memory mapped in a sweep worker, without copying them."""
+        backtester = cls.__new__(cls)
+        backtester.max_bars = int(arrays['max_bars'])
+        for name in cls.TRADE_ARRAYS:
+            setattr(backtester, name, arrays[name])
+        backtester.markets = []
+        while f"market{len(backtester.markets)}.rows" in arrays:
+            prefix = f"market{len(backtester.markets)}"
+            market = {name: arrays[f"{prefix}.{name}"] for name in cls.MARKET_ARRAYS}
+            for extremes, op in (('highs', np.maximum), ('lows', np.minimum)):
+                levels = []
+                while f"{prefix}.{extremes}.{len(levels)}" in arrays:
+                    levels.append(arrays[f"{prefix}.{extremes}.{len(levels)}"])
+                market[extremes] = SparseTable.from_levels(levels, op)
+            backtester.markets.append(market)
+        return backtester
+
+    def levels(self, stop_loss=None, take_profit=None):
+        """SL/TP prices: the trades' own when None, otherwise price distances from the open price.
+
+        A distance can be one number for every trade or an array with one per trade.
+        """
+        if stop_loss is None:
+            stop_loss_price = self.stop_loss
+        else:
+            stop_loss_price = self.open_price - self.direction * np.asarray(stop_loss, dtype=np.float64)
+        if take_profit is None:
+            take_profit_price = self.take_profit
+        else:
+            take_profit_price = self.open_price + self.direction * np.asarray(take_profit, dtype=np.float64)
+        return np.broadcast_to(stop_loss_price, self.open_price.shape), \
+            np.broadcast_to(take_profit_price, self.open_price.shape)
+
+    def replay(self, stop_loss=None, take_profit=None) -> pd.DataFrame:
+        """Simulated exit of every trade, one row per trade in table order."""
+        stop_loss_price, take_profit_price = self.levels(stop_loss, take_profit)
+        trades = len(self.open_price)
+        exit_bar = np.full(trades, NAT)
+        exit_price = np.full(trades, np.nan)
+        reason = np.full(trades, EXIT_REASONS.index('no_data'), dtype=np.int8)
+        bars_held = np.zeros(trades, dtype=np.int64)
+
+        for market in self.markets:
+            rows, entry, last = market['rows'], market['entry'], market['last']
+            buy = self.direction[rows] > 0
+            stop_loss_rows = stop_loss_price[rows]
+            take_profit_rows = take_profit_price[rows]
+
+            # Longs take profit on a high and stop out on a low, shorts the other way round. A missing level
+            # never triggers.
+            high_level = np.where(buy, take_profit_rows, stop_loss_rows)
+            low_level = np.where(buy, stop_loss_rows, take_profit_rows)
+            high_bar = np.full(len(rows), -1)
+            low_bar = np.full(len(rows), -1)
+            for extremes, level, bar in ((market['highs'], high_level, high_bar), (market['lows'], low_level, low_bar)):
+                selected = np.flatnonzero(~np.isnan(level))
+                bar[selected] = extremes.first_reaching(entry[selected], last[selected], level[selected])
+            take_profit_bar = np.where(buy, high_bar, low_bar)
+            stop_loss_bar = np.where(buy, low_bar, high_bar)
+
+            no_bar = np.iinfo(np.int64).max
+            take_profit_bar = np.where(take_profit_bar >= 0, take_profit_bar, no_bar)
+            stop_loss_bar = np.where(stop_loss_bar >= 0, stop_loss_bar, no_bar)
+            stopped = (stop_loss_bar <= take_profit_bar) & (stop_loss_bar != no_bar)
+            profited = (take_profit_bar < stop_loss_bar)
+            bar = np.where(stopped, stop_loss_bar, np.where(profited, take_profit_bar, last))
+
+            exit_bar[rows] = market['open_times'][bar]
+            exit_price[rows] = np.where(stopped, stop_loss_rows,
+                                        np.where(profited, take_profit_rows, market['close'][bar]))
+            reason[rows] = np.where(stopped, EXIT_REASONS.index('stop_loss'),
+                                    np.where(profited, EXIT_REASONS.index('take_profit'),
+                                             EXIT_REASONS.index('timeout')))
+            bars_held[rows] = bar - entry + 1
+
+        return pd.DataFrame({
+            'exit_reason': pd.Categorical.from_codes(reason, EXIT_REASONS),
+            'exit_bar_open_time': exit_bar.view('datetime64[ns]'),
+            'exit_price': exit_price,
+            'bars_held': bars_held,
+            'profit_loss': self.direction * (exit_price - self.open_price) * self.amount,
+        }, index=self.index)
+
+    def compare(self, result: pd.DataFrame) -> dict:
+        """Simulated against actual outcomes of the trades the replay had klines for.
+
+        P&L is in the pair's quote currency, comparable with profit_loss_curr_1_value when that is the
+        quote currency (USD for EURUSD).
+        """
+        replayed = (result['exit_reason'] != 'no_data').to_numpy()
+        actual = self.actual_profit_loss[replayed]
+        simulated = result['profit_loss'].to_numpy()[replayed]
+        counts = result['exit_reason'][replayed].value_counts()
+        return {
+            'trades': int(replayed.sum()),
+            'no_data': int((~replayed).sum()),
+            'actual_win_rate': float((actual > 0).mean()) if len(actual) else None,
+            'simulated_win_rate': float((simulated > 0).mean()) if len(simulated) else None,
+            'actual_profit_loss': float(actual.sum()),
+            'simulated_profit_loss': float(simulated.sum()),
+            'same_outcome': float(((actual > 0) == (simulated > 0)).mean()) if len(actual) else None,
+            **{f'{reason}_exits': int(counts.get(reason, 0)) for reason in EXIT_REASONS[:3]},
+        }
+
+    def grid(self, stop_losses: list, take_profits: list, workers: int = 1, checkpoint=None) -> pd.DataFrame:
+        """compare() of a replay for every SL/TP distance pair.
+
+        With more than one worker the pairs are spread over a SweepRunner, the bars and sparse tables are
+        shared with the workers instead of being copied into each.
+        """
+        grid = [{'stop_loss': stop_loss, 'take_profit': take_profit}
+                for stop_loss, take_profit in itertools.product(stop_losses, take_profits)]
+        return SweepRunner(from_arrays, evaluate, workers, checkpoint).run(self.arrays(), grid)
+
+
+def from_arrays(arrays: dict) -> SLTPBacktester:
+    return SLTPBacktester.from_arrays(arrays)
+
+
+def evaluate(backtester: SLTPBacktester, params: dict) -> dict:
+    return backtester.compare(backtester.replay(params['stop_loss'], params['take_profit']))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Replay the SL/TP exits of Torobase trades over stored klines")
+    parser.add_argument('exchange', help="exchange directory under PYSCALPIE_DIR the klines were stored in")
+    parser.add_argument('symbols', nargs='+', help="currency pair=exchange symbol, e.g. BTCUSD=BTCUSDT")
+    parser.add_argument('--interval', default='1m')
+    parser.add_argument('--max-bars', type=int, default=MAX_BARS)
+    parser.add_argument('--utc-offset-hours', type=float, default=0, help="hours the Torobase times are ahead of UTC")
+    parser.add_argument('--stop-losses', type=float, nargs='*', help="SL distances to try, in price")
+    parser.add_argument('--take-profits', type=float, nargs='*', help="TP distances to try, in price")
+    parser.add_argument('--workers', type=int, help="processes for the SL/TP grid (default: all cores)")
+    parser.add_argument('--checkpoint', help="JSON lines file finished grid points are kept in, to resume from")
+    parser.add_argument('--output', help="also write the grid results to this CSV")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    trades = TorobaseTradeReader().read_table()
+    offset = pd.Timedelta(hours=args.utc_offset_hours)
+    pairs = dict(symbol.split('=', 1) for symbol in args.symbols)
+    # A replayed trade can run past the actual close, up to max_bars after it opened
+    klines = load_klines(args.exchange, pairs, args.interval, trades, offset, args.max_bars)
+    backtester = SLTPBacktester(trades, klines, args.interval, args.max_bars, offset)
+
+    print(pd.Series(backtester.compare(backtester.replay())).to_string())
+    if args.stop_losses or args.take_profits:
+        results = backtester.grid(args.stop_losses or [None], args.take_profits or [None], args.workers,
+                                  args.checkpoint)
+        print(results.to_string(index=False))
+        if args.output:
+            results.to_csv(args.output, index=False)
@@ -0,0 +1,69 @@
+import numpy as np
+
+
+class SparseTable:
+    """Range maximum (or minimum) of a fixed array in O(1) per query after an O(n log n) build.
+
+    levels[k][i] holds op(values[i:i + 2 ** k]). Only the levels needed for ranges of up to max_length
+    values are built, so a table over years of 1m bars stays small when the ranges queried are short.
+    """
+
+    def __init__(self, values, op=np.maximum, max_length: int = None):
+        values = np.asarray(values)
+        self.op = op
+        self.levels = [values]
+        max_length = len(values) if max_length is None else min(max_length, len(values))
+        while 2 ** len(self.levels) <= max_length:
+            previous = self.levels[-1]
+            half = 2 ** (len(self.levels) - 1)
+            self.levels.append(op(previous[:-half], previous[half:]))
+
+    @classmethod
+    def from_levels(cls, levels: list, op=np.maximum):
+        """A table over levels built earlier, e.g. memory mapped from another process."""
+        table = cls.__new__(cls)
+        table.op = op
+        table.levels = list(levels)
+        return table
+
+    @property
+    def max_length(self) -> int:
+        return 2 ** len(self.levels) - 1
+
+    def query(self, left, right) -> np.ndarray:
+        """op over values[left[i]:right[i] + 1] for every i, ranges have to be non-empty and inside the array."""
+        left = np.asarray(left, dtype=np.int64)
+        right = np.asarray(right, dtype=np.int64)
+        lengths = right - left + 1
+        if len(lengths) and (lengths.min() < 1 or lengths.max() > self.max_length):
+            raise ValueError(f"Range lengths have to be between 1 and {self.max_length}")
+
+        # Two blocks of the largest power of two that fits cover the range, overlapping in the middle
+        k = np.floor(np.log2(np.maximum(lengths, 1))).astype(np.int64)
+        result = np.empty(len(left), dtype=self.levels[0].dtype)
+        for level in np.unique(k):
+            selected = k == level
+            values = self.levels[level]
+            result[selected] = self.op(values[left[selected]], values[right[selected] - 2 ** level + 1])
+        return result
+
+    def first_reaching(self, left, right, threshold) -> np.ndarray:
+        """First index j in [left[i], right[i]] whose value reaches threshold[i], -1 when none does.
+
+        A value reaches the threshold when op keeps it, i.e. >= for a max table and <= for a min table.
+        Binary lifting: from the largest block down, a block that doesn't reach the threshold is skipped
+        whole, so each query looks at one block per level.
+        """
+        position = np.asarray(left, dtype=np.int64).copy()
+        right = np.asarray(right, dtype=np.int64)
+        threshold = np.broadcast_to(np.asarray(threshold, dtype=self.levels[0].dtype), position.shape)
+        if len(position) and (right - position + 1).max() > self.max_length:
+            raise ValueError(f"Range lengths can be at most {self.max_length}")
+
+        for level in range(len(self.levels) - 1, -1, -1):
+            size = 2 ** level
+            fits = np.flatnonzero(position + size - 1 <= right)
+            block = self.levels[level][position[fits]]
+            skip = fits[self.op(block, threshold[fits]) != block]
+            position[skip] += size
+        return np.where(position <= right, position, -1)
@@ -0,0 +1,156 @@
+import json
+import logging
+import os
+import shutil
+import tempfile
+import time
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+PROGRESS_SECONDS = 10
+SHARED_MEMORY_DIR = '/dev/shm'  # RAM backed on Linux, a temporary directory is used where it doesn't exist
+
+_worker_state = None
+
+
+class SharedArrays:
+    """Numpy arrays published once as .npy files that every worker process memory maps.
+
+    The pages are shared through the OS page cache, so each worker reads the same physical memory
+    without anything being pickled or copied. Object arrays can't be mapped, strings have to be
+    fixed width.
+    """
+
+    def __init__(self, arrays: dict, directory=None):
+        if directory is None and os.path.isdir(SHARED_MEMORY_DIR):
+            directory = SHARED_MEMORY_DIR
+        self.directory = tempfile.mkdtemp(prefix='sweep-', dir=directory)
+        self.names = list(arrays)
+        for number, name in enumerate(self.names):
+            np.save(Path(self.directory) / f"{number}.npy", np.asarray(arrays[name]))
+
+    @staticmethod
+    def load(directory: str, names: list) -> dict:
+        return {name: np.load(Path(directory) / f"{number}.npy", mmap_mode='r') for number, name in enumerate(names)}
+
+    def close(self):
+        shutil.rmtree(self.directory, ignore_errors=True)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+def init_worker(directory: str, names: list, setup):
+    global _worker_state
+    _worker_state = setup(SharedArrays.load(directory, names))
+
+
+def evaluate_batch(evaluate, batch: list) -> list:
+    return [(params, evaluate(_worker_state, params)) for params in batch]
+
+
+def params_key(params: dict) -> str:
+    return json.dumps(params, sort_keys=True, default=float)
+
+
+class SweepRunner:
+    """Evaluates a grid of parameter combinations over shared arrays on all cores.
+
+    setup(arrays) runs once per worker on the memory mapped arrays and returns what evaluate(state, params)
+    gets for every combination, both have to be module level functions. evaluate returns a dict of
+    results. With a checkpoint file every finished combination is appended to it as a JSON line, and a
+    run with the same checkpoint only evaluates the combinations that aren't in it yet.
+    """
+
+    def __init__(self, setup, evaluate, workers: int = None, checkpoint=None, batch_size: int = None):
+        self.setup = setup
+        self.evaluate = evaluate
+        self.workers = workers or os.cpu_count()
+        self.checkpoint = Path(checkpoint) if checkpoint else None
+        self.batch_size = batch_size
+
+    def load_checkpoint(self) -> dict:
+        done = {}
+        if self.checkpoint is None or not self.checkpoint.exists():
+            return done
+        with open(self.checkpoint, 'r') as file:
+            for line in file:
+                try:
+                    record = json.loads(line)
+                except json.JSONDecodeError:
+                    continue  # the line a crashed run was writing
+                done[params_key(record['params'])] = record
+        logging.info(f"Resuming with {len(done)} combinations from {self.checkpoint}")
+        return done
+
+    def run(self, arrays: dict, grid: list) -> pd.DataFrame:
+        """One row per combination of the grid, its parameters followed by its results."""
+        done = self.load_checkpoint()
+        todo = [params for params in grid if params_key(params) not in done]
+        # Small batches keep every core busy to the end, large ones keep the per task overhead down
+        batch_size = self.batch_size or max(1, min(64, len(todo) // (self.workers * 8)))
+        batches = [todo[i:i + batch_size] for i in range(0, len(todo), batch_size)]
+
+        progress = Progress(len(grid), len(grid) - len(todo))
+        checkpoint = open(self.checkpoint, 'a') if self.checkpoint else None
+        try:
+            if self.workers == 1 or len(batches) <= 1:
+                state = self.setup(arrays)
+                for batch in batches:
+                    self.collect([(params, self.evaluate(state, params)) for params in batch], done, checkpoint,
+                                 progress)
+            else:
+                with SharedArrays(arrays) as shared, \
+                        ProcessPoolExecutor(max_workers=self.workers, initializer=init_worker,
+                                            initargs=(shared.directory, shared.names, self.setup)) as executor:
+                    pending = {executor.submit(evaluate_batch, self.evaluate, batch) for batch in batches}
+                    while pending:
+                        finished, pending = wait(pending, return_when=FIRST_COMPLETED)
+                        for future in finished:
+                            self.collect(future.result(), done, checkpoint, progress)
+        finally:
+            if checkpoint:
+                checkpoint.close()
+        progress.log(force=True)
+
+        records = [done[params_key(params)] for params in grid]
+        return pd.DataFrame([{**record['params'], **record['result']} for record in records])
+
+    @staticmethod
+    def collect(results: list, done: dict, checkpoint, progress):
+        for params, result in results:
+            record = {'params': params, 'result': result}
+            done[params_key(params)] = record
+            if checkpoint:
+                checkpoint.write(json.dumps(record, default=float) + '\n')
+        if checkpoint:
+            checkpoint.flush()
+        progress.advance(len(results))
+
+
+class Progress:
+    def __init__(self, total: int, done: int = 0):
+        self.total = total
+        self.done = done
+        self.resumed = done
+        self.start = time.monotonic()
+        self.logged = self.start
+
+    def advance(self, count: int):
+        self.done += count
+        self.log()
+
+    def log(self, force: bool = False):
+        now = time.monotonic()
+        if not force and now - self.logged < PROGRESS_SECONDS:
+            return
+        self.logged = now
+        rate = (self.done - self.resumed) / max(now - self.start, 1e-9)
+        remaining = (self.total - self.done) / rate if rate else float('inf')
+        logging.info(f"Sweep: {self.done}/{self.total} combinations, {rate:.1f}/s, {remaining:.0f}s left")
@@ -1,30 +1,51 @@
-import matplotlib.pyplot as plt
+import argparse
 import logging
 
-import utils
+import numpy as np
+
 from torobase_trade_reader import TorobaseTradeReader
-from trade import Trade
+from trade_analytics import DURATION_BINS, analyze
 
 
 class TorobaseAnalyzer:
+    def __init__(self, directory=None):
+        self.directory = directory
+
+    def analyze(self, output=None):
+        """Duration histogram of the winning trades, shown on screen or saved to output when given.
+
+        Returns every analytic trade_analytics.analyze computes, torobase_report.py writes full reports.
+        """
+        import matplotlib.pyplot as plt  # slow to import, only loaded once there is something to plot
 
-    def analyze(self):
-        trade_reader = TorobaseTradeReader()
-        trades = trade_reader.read_trades()
-        durations_in_seconds = [trade.trade_duration.total_seconds() for trade in trades if
-                                trade.profit_loss_curr_1_value > 0]
-        max_duration = 120
-        bins = [i for i in range(0, int(max_duration) + 1)]
-        plt.hist(durations_in_seconds, bins=bins, edgecolor="k", alpha=0.7)
+        table = TorobaseTradeReader(self.directory).read_table()
+        analytics = analyze(table)
+
+        durations_in_seconds = table.winners().duration_seconds()
+        durations_in_seconds = durations_in_seconds[np.isfinite(durations_in_seconds)]  # no opening event
+        plt.hist(durations_in_seconds, bins=DURATION_BINS, edgecolor="k", alpha=0.7)
         # Add titles and labels
         plt.title('Trade Duration Histogram')
         plt.xlabel('Duration (seconds)')
         plt.ylabel('Number of Trades')
 
-        # Display the plot
-        plt.show()
+        if output:
+            plt.savefig(output)
+            plt.close()
+            logging.info(f"Saved the histogram to {output}")
+        else:
+            # Display the plot
+            plt.show()
+        return analytics
 
 
 if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Histogram of how long winning Torobase trades lasted")
+    parser.add_argument('--output', help="save the histogram to this image instead of showing it")
+    args = parser.parse_args()
+
+    if args.output:
+        import matplotlib
+        matplotlib.use('Agg')
     analyzer = TorobaseAnalyzer()
-    analyzer.analyze()
+    analyzer.analyze(args.output)
@@ -0,0 +1,207 @@
+import argparse
+import json
+import logging
+import multiprocessing
+import queue
+import resource
+import shutil
+import sys
+import time
+from pathlib import Path
+
+from torobase_generator import generate
+
+SIZES = [10_000, 100_000, 1_000_000, 10_000_000]
+OBJECT_LIMIT = 1_000_000  # read_trades builds a Trade per trade, beyond this it only measures the allocator
+
+
+def peak_rss_mb() -> float:
+    # ru_maxrss is in kilobytes on Linux and bytes on macOS
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / 1024 / 1024 if sys.platform == 'darwin' else peak / 1024
+
+
+def remove_caches(directory: Path):
+    for name in ("trades.txt.cache", "events.txt.cache"):
+        shutil.rmtree(directory / name, ignore_errors=True)
+
+
+def run_parse(directory: Path, workers: int, results):
+    from torobase_fast_parser import parse_events, parse_trades
+
+    start = time.perf_counter()
+    trades = parse_trades(directory / "trades.txt", workers)
+    events = parse_events(directory / "events.txt", workers)
+    seconds = time.perf_counter() - start
+    results.put({'trades': len(trades['uid']), 'events': len(events['uid']), 'seconds': seconds,
+                 'peak_rss_mb': peak_rss_mb()})
+
+
+def run_read_table(directory: Path, workers: int, results):
+    from torobase_trade_reader import TorobaseTradeReader
+
+    start = time.perf_counter()
+    table = TorobaseTradeReader(directory).read_table(workers)
+    seconds = time.perf_counter() - start
+    results.put({'trades': len(table), 'seconds': seconds, 'peak_rss_mb': peak_rss_mb()})
+
+
+def run_read_events(directory: Path, workers: int, results):
+    from torobase_event_reader import TorobaseEventReader
+
+    start = time.perf_counter()
+    events = TorobaseEventReader(directory).read_events(workers)
+    seconds = time.perf_counter() - start
+    results.put({'events': len(events), 'seconds': seconds, 'peak_rss_mb': peak_rss_mb()})
+
+
+def run_read_trades(directory: Path, workers: int, results):
+    from torobase_trade_reader import TorobaseTradeReader
+
+    start = time.perf_counter()
+    trades = TorobaseTradeReader(directory).read_trades(workers)
+    seconds = time.perf_counter() - start
+    results.put({'trades': len(trades), 'seconds': seconds, 'peak_rss_mb': peak_rss_mb()})
+
+
+def run_analytics(directory: Path, workers: int, results):
+    from torobase_trade_reader import TorobaseTradeReader
+    from trade_analytics import analyze
+
+    table = TorobaseTradeReader(directory).read_table(workers)
+    start = time.perf_counter()
+    analyze(table)
+    seconds = time.perf_counter() - start
+    results.put({'trades': len(table), 'seconds': seconds, 'peak_rss_mb': peak_rss_mb()})
+
+
+def run_analyzer(directory: Path, workers: int, results):
+    import matplotlib
+    matplotlib.use('Agg')
+
+    from torobase_analyzer import TorobaseAnalyzer
+
+    start = time.perf_counter()
+    analytics = TorobaseAnalyzer(directory).analyze(directory / "histogram.png")
+    seconds = time.perf_counter() - start
+    results.put({'trades': analytics['overview']['trades'], 'seconds': seconds, 'peak_rss_mb': peak_rss_mb()})
+
+
+# name, target, whether the parse caches are removed first; the cached loads rely on the order
+SCENARIOS = [
+    ("parse, no cache", run_parse, False),
+    ("read_table, cold cache", run_read_table, True),
+    ("read_table, warm cache", run_read_table, False),
+    ("read_events, warm cache", run_read_events, False),
+    ("read_trades objects", run_read_trades, False),
+    ("analyze", run_analytics, False),
+    ("TorobaseAnalyzer png", run_analyzer, False),
+]
+
+
+def run_scenario(directory: Path, expected: dict, name: str, target, workers: int) -> dict:
+    # Each scenario gets a fresh process, so peak RSS belongs to that scenario alone
+    context = multiprocessing.get_context('spawn')
+    results = context.Queue()
+    process = context.Process(target=target, args=(directory, workers, results))
+    process.start()
+    result = None
+    while result is None:
+        try:
+            result = results.get(timeout=1)
+        except queue.Empty:
+            if not process.is_alive():
+                # A crashed scenario never puts its result, only its exit code tells
+                try:
+                    result = results.get(timeout=1)
+                except queue.Empty:
+                    break
+    process.join()
+    if result is None:
+        logging.error(f"{name} failed, its process exited with code {process.exitcode}")
+        return {'scenario': name, 'size': expected['trades'], 'failed': True, 'exitcode': process.exitcode}
+
+    megabytes = (expected['trades_bytes'] + expected['events_bytes']) / 1024 / 1024
+    result.update({
+        'scenario': name,
+        'size': expected['trades'],
+        'megabytes_per_second': megabytes / result['seconds'],
+        'trades_per_second': expected['readable_trades'] / result['seconds'],
+    })
+    return result
+
+
+def generated(directory: Path, trades: int, args) -> dict:
+    """The expected.json of directory, generating the files first unless they are there for these settings."""
+    settings = {'trades': trades, 'seed': args.seed, 'missing_event_rate': args.missing_event_rate,
+                'missing_level_rate': args.missing_level_rate, 'malformed_at': args.malformed_at,
+                'partial_tail': args.partial_tail}
+    try:
+        with open(directory / "expected.json", 'r') as file:
+            expected = json.load(file)
+        if expected.get('settings') == settings:
+            return expected
+    except FileNotFoundError:
+        pass
+
+    remove_caches(directory)
+    start = time.perf_counter()
+    expected = generate(directory, trades, args.seed, args.missing_event_rate, args.missing_level_rate,
+                        args.malformed_at, args.partial_tail)
+    logging.info(f"Generated {trades} trades in {time.perf_counter() - start:.1f} s")
+    expected['settings'] = settings
+    with open(directory / "expected.json", 'w') as file:
+        json.dump(expected, file, indent=2)
+    return expected
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Measure Torobase parsing and trade analytics on synthetic logs")
+    parser.add_argument('--sizes', type=int, nargs='+', default=SIZES, help="trades per generated log")
+    parser.add_argument('--directory', default="torobase-benchmark",
+                        help="where the generated logs are kept, they are reused by later runs")
+    parser.add_argument('--workers', type=int, help="parser processes, one per CPU when not given")
+    parser.add_argument('--object-limit', type=int, default=OBJECT_LIMIT,
+                        help="largest size read_trades is measured at")
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--missing-event-rate', type=float, default=0.0,
+                        help="trades without an opening event")
+    parser.add_argument('--missing-level-rate', type=float, default=0.0, help="events with an empty TP or SL")
+    parser.add_argument('--malformed-at', type=int,
+                        help="trade number written with an amount that doesn't parse, the readers stop there")
+    parser.add_argument('--partial-tail', action='store_true',
+                        help="end trades.txt with half a record, as while Torobase is writing one")
+    parser.add_argument('--json', help="also write the results to this file")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    results = []
+    for size in args.sizes:
+        directory = Path(args.directory).resolve() / str(size)
+        expected = generated(directory, size, args)
+        for name, target, cold in SCENARIOS:
+            if target is run_read_trades and size > args.object_limit:
+                continue
+            if cold:
+                remove_caches(directory)
+            logging.info(f"Running {name} on {size} trades")
+            results.append(run_scenario(directory, expected, name, target, args.workers))
+
+    print(f"{'size':>10}  {'scenario':<26}{'trades':>10}{'seconds':>10}{'MB/s':>9}{'trades/s':>12}{'peak MB':>10}")
+    for result in results:
+        if result.get('failed'):
+            print(f"{result['size']:>10}  {result['scenario']:<26}  failed, exit code {result['exitcode']}")
+            continue
+        trades = result.get('trades', result.get('events'))
+        print(f"{result['size']:>10}  {result['scenario']:<26}{trades:>10}{result['seconds']:>10.3f}"
+              f"{result['megabytes_per_second']:>9.1f}{result['trades_per_second']:>12.0f}{result['peak_rss_mb']:>10.1f}")
+
+    if args.json:
+        with open(args.json, 'w') as file:
+            json.dump(results, file, indent=2)
+    if any(result.get('failed') for result in results):
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,40 +1,29 @@
+from pathlib import Path
+
+import numpy as np
+
 import utils
+from torobase_fast_parser import parse_events
+from torobase_parse_cache import load_events
 
 
 class TorobaseEventReader:
-    def __init__(self):
-        self.filename = utils.PYSCALPIE_PATH / "torobase" / "events.txt"
+    def __init__(self, directory=None):
+        self.filename = Path(directory or utils.PYSCALPIE_PATH / "torobase") / "events.txt"
+
+    def read_events(self, workers=None, cache=True):
+        # Type: Buy ; Market: EURUSD ; Amount: 344873 ; Open: 1.04761 ; TP: 1.04849 ; SL: 1.04673
+        events = load_events(self.filename, workers) if cache else parse_events(self.filename, workers)
 
-    def read_events(self):
         result_dict = {}
-        with open(self.filename, 'r') as file:
-            lines = file.readlines()
-
-        for i in range(0, len(lines), 6):
-            event_type = lines[i].strip()
-            if event_type != "Trade Opened":
-                continue
-
-            description = lines[i + 1].strip()
-            uid = lines[i + 3].strip()
-            timestamp = lines[i + 4].strip()
-
-            # Parsing transfer details
-            description_details = description.split(";")
-
-            # Type: Buy ; Market: EURUSD ; Amount: 344873 ; Open: 1.04761 ; TP: 1.04849 ; SL: 1.04673
-            description_dict = {}
-            for detail in description_details:
-                key, value = [item.strip() for item in detail.split(":")]
-                description_dict[key] = value
-
-            event = {
-                "take_profit": float(description_dict.get("TP", 0)) if description_dict.get("TP") else None,
-                "stop_loss": float(description_dict.get("SL", 0)) if description_dict.get("SL") else None,
-                "timestamp": utils.get_datetime_iso(timestamp)
+        for uid, take_profit, stop_loss, timestamp in zip(np.asarray(events['uid']).tolist(), events['take_profit'].tolist(),
+                                                          events['stop_loss'].tolist(),
+                                                          events['timestamp'].astype('datetime64[us]').tolist()):
+            result_dict[uid] = {
+                "take_profit": None if take_profit != take_profit else take_profit,  # NaN when not given
+                "stop_loss": None if stop_loss != stop_loss else stop_loss,
+                "timestamp": timestamp
             }
-
-            result_dict[uid] = event
         return result_dict
 
 
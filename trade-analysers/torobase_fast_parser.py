@@ -0,0 +1,208 @@
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+
+import utils
+
+TRADE_LINES = 11
+EVENT_LINES = 6
+CHUNK_RECORDS = 100_000
+SCAN_BLOCK = 64 * 1024 * 1024
+TRADE_COLUMNS = ['transaction_type', 'currency_pair', 'amount', 'open_price', 'close_price', 'status',
+                 'profit_loss_pips', 'profit_loss_curr_1_value', 'profit_loss_curr_1', 'profit_loss_curr_2_value',
+                 'profit_loss_curr_2', 'settlement_id', 'updated', 'created', 'uid']
+EVENT_COLUMNS = ['uid', 'take_profit', 'stop_loss', 'timestamp']
+
+
+def record_chunks(filename, lines_per_record: int, records_per_chunk: int = CHUNK_RECORDS, start: int = 0,
+                  end: int = None) -> list:
+    """Byte ranges of the file from start to end, each holding whole records of lines_per_record lines.
+
+    start has to be the first byte of a record.
+    """
+    size = os.path.getsize(filename) if end is None else end
+    if size <= start:
+        return []
+
+    lines_per_chunk = lines_per_record * records_per_chunk
+    boundaries = [start]
+    line_count = 0
+    with utils.map_file(filename) as mm:
+        view = np.frombuffer(mm, dtype=np.uint8)
+        for block_start in range(start, size, SCAN_BLOCK):
+            newlines = np.flatnonzero(view[block_start:min(block_start + SCAN_BLOCK, size)] == 10)
+            # Line n of the scan ends a chunk when n + 1 is a multiple of lines_per_chunk
+            for i in range((-line_count - 1) % lines_per_chunk, len(newlines), lines_per_chunk):
+                boundaries.append(block_start + int(newlines[i]) + 1)
+            line_count += len(newlines)
+        del view  # the mmap can't close while a numpy view of it is alive
+
+    if boundaries[-1] < size:
+        boundaries.append(size)
+    return list(zip(boundaries[:-1], boundaries[1:]))
+
+
+def read_lines(filename, start: int, end: int) -> list:
+    with utils.map_file(filename) as mm:
+        lines = mm[start:end].decode('utf-8').split('\n')
+    if lines[-1] == '':
+        lines.pop()  # nothing follows the last newline, it isn't a line of its own
+    return lines
+
+
+def last_line_end(filename) -> int:
+    """Byte offset just after the last newline, 0 when there is none."""
+    with utils.map_file(filename) as mm:
+        return mm.rfind(b'\n') + 1
+
+
+def records_end(start: int, end: int, lines: list, line_count: int) -> int:
+    """Byte offset just after the first line_count lines of the chunk from start to end."""
+    if line_count == len(lines):
+        return end
+    return start + len('\n'.join(lines[:line_count]).encode('utf-8')) + 1 if line_count else start
+
+
+def parse_timestamps(values: list) -> np.ndarray:
+    return pd.to_datetime(pd.Series(values, dtype=object), format=utils.ISO_DATE_FORMAT).to_numpy(dtype='datetime64[ns]')
+
+
+def convert_trades(fields: list) -> dict:
+    (transaction_type, currency_pair, amount, open_price, close_price, status, profit_loss, settlement_id,
+     updated, created, uid) = fields
+
+    profit_loss = [value.split('\t') for value in profit_loss]
+    currency_1 = [value[1].split(' ') for value in profit_loss]
+    currency_2 = [value[2].split(' ') for value in profit_loss]
+    return {
+        'transaction_type': transaction_type,
+        'currency_pair': currency_pair,
+        'amount': np.array([value.split(' ')[0] for value in amount], dtype=np.float64),
+        'open_price': np.array(open_price, dtype=np.float64),
+        'close_price': np.array(close_price, dtype=np.float64),
+        'status': status,
+        'profit_loss_pips': np.array([value[0].split(' ')[0] for value in profit_loss], dtype=np.float64),
+        'profit_loss_curr_1_value': np.array([value[0] for value in currency_1], dtype=np.float64),
+        'profit_loss_curr_1': [value[1] for value in currency_1],
+        'profit_loss_curr_2_value': np.array([value[0] for value in currency_2], dtype=np.float64),
+        'profit_loss_curr_2': [value[1] for value in currency_2],
+        'settlement_id': settlement_id,
+        'updated': parse_timestamps(updated),
+        'created': parse_timestamps(created),
+        'uid': uid,
+    }
+
+
+def parse_trade_chunk(filename, start: int, end: int) -> dict:
+    """Parse the trades in a byte range, stopping like TorobaseTradeReader at a blank or broken record."""
+    lines = read_lines(filename, start, end)
+    count = len(lines) // TRADE_LINES
+    fields = [[line.strip() for line in lines[i:count * TRADE_LINES:TRADE_LINES]] for i in range(TRADE_LINES)]
+
+    stopped = False
+    if '' in fields[0]:
+        count = fields[0].index('')
+        stopped = True
+
+    try:
+        columns = convert_trades([values[:count] for values in fields])
+    except (ValueError, IndexError):
+        # Find the first record that doesn't parse, everything before it is kept
+        count = next((i for i in range(count) if not record_parses([values[i:i + 1] for values in fields])), count)
+        columns = convert_trades([values[:count] for values in fields])
+        stopped = True
+
+    columns['stopped'] = stopped
+    columns['end'] = records_end(start, end, lines, count * TRADE_LINES)
+    return columns
+
+
+def record_parses(fields: list) -> bool:
+    try:
+        convert_trades(fields)
+        return True
+    except (ValueError, IndexError):
+        return False
+
+
+def parse_event_chunk(filename, start: int, end: int) -> dict:
+    """Parse the "Trade Opened" events in a byte range."""
+    lines = read_lines(filename, start, end)
+    count = len(lines) // EVENT_LINES
+    event_type = pd.Series([line.strip() for line in lines[0:count * EVENT_LINES:EVENT_LINES]], dtype=object)
+    opened = (event_type == "Trade Opened").to_numpy()
+
+    # Type: Buy ; Market: EURUSD ; Amount: 344873 ; Open: 1.04761 ; TP: 1.04849 ; SL: 1.04673
+    description = pd.Series(lines[1:count * EVENT_LINES:EVENT_LINES], dtype=object)[opened]
+    uid = [line.strip() for line in lines[3:count * EVENT_LINES:EVENT_LINES]]
+    timestamp = [line.strip() for line in lines[4:count * EVENT_LINES:EVENT_LINES]]
+
+    return {
+        'uid': [value for value, keep in zip(uid, opened) if keep],
+        'take_profit': description_value(description, 'TP'),
+        'stop_loss': description_value(description, 'SL'),
+        'timestamp': parse_timestamps([value for value, keep in zip(timestamp, opened) if keep]),
+        'end': records_end(start, end, lines, count * EVENT_LINES),
+    }
+
+
+def description_value(description: pd.Series, key: str) -> np.ndarray:
+    values = description.str.extract(rf'(?:^|;)\s*{key}\s*:\s*([^;]*?)\s*(?:;|$)', expand=False)
+    return pd.to_numeric(values.replace('', np.nan), errors='raise').to_numpy(dtype=np.float64)
+
+
+def parse_chunks(filename, parse_chunk, lines_per_record: int, workers: int = None, start: int = 0,
+                 end: int = None) -> list:
+    chunks = record_chunks(filename, lines_per_record, start=start, end=end)
+    if workers == 1 or len(chunks) <= 1:
+        return [parse_chunk(filename, chunk_start, chunk_end) for chunk_start, chunk_end in chunks]
+
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        return list(executor.map(parse_chunk, [filename] * len(chunks), *zip(*chunks)))
+
+
+def concat_columns(parts: list, names: list) -> dict:
+    columns = {}
+    for name in names:
+        values = [part[name] for part in parts]
+        if values and isinstance(values[0], np.ndarray):
+            columns[name] = np.concatenate(values)
+        else:
+            columns[name] = [value for part in values for value in part]
+    return columns
+
+
+def parse_trades(filename, workers: int = None, start: int = 0, end: int = None) -> dict:
+    """Columns of every trade in a Torobase trades.txt, in file order.
+
+    Only the records from byte start up to byte end are parsed. 'end' in the result is the byte offset just
+    after the last trade parsed, where parsing can pick up again once more trades have been appended.
+    """
+    parts = []
+    for part in parse_chunks(filename, parse_trade_chunk, TRADE_LINES, workers, start, end):
+        parts.append(part)
+        if part['stopped']:
+            break
+    if not parts:
+        columns = convert_trades([[] for _ in range(TRADE_LINES)])
+        columns['end'] = start
+        return columns
+    columns = concat_columns(parts, TRADE_COLUMNS)
+    columns['end'] = parts[-1]['end']
+    return columns
+
+
+def parse_events(filename, workers: int = None, start: int = 0, end: int = None) -> dict:
+    """Columns of every "Trade Opened" event in a Torobase events.txt, in file order.
+
+    start, end and 'end' in the result work like they do for parse_trades.
+    """
+    parts = parse_chunks(filename, parse_event_chunk, EVENT_LINES, workers, start, end)
+    if not parts:
+        return {'uid': [], 'take_profit': np.array([]), 'stop_loss': np.array([]),
+                'timestamp': np.array([], dtype='datetime64[ns]'), 'end': start}
+    columns = concat_columns(parts, EVENT_COLUMNS)
+    columns['end'] = parts[-1]['end']
+    return columns
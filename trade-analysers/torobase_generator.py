@@ -0,0 +1,152 @@
+import argparse
+import json
+import logging
+import os
+from pathlib import Path
+
+import numpy as np
+
+GENERATE_CHUNK = 100_000
+START_TIME = np.datetime64('2023-01-02T00:00:00', 'us')
+ACCOUNT_CURRENCY = 'EUR'
+# pair: (price, pip size, quote currency, quote currency to account currency rate, typical amount)
+PAIRS = {
+    'EURUSD': (1.08, 0.0001, 'USD', 0.92, 100_000),
+    'GBPUSD': (1.26, 0.0001, 'USD', 0.92, 100_000),
+    'USDJPY': (148.0, 0.01, 'JPY', 0.0062, 100_000),
+    'AUDUSD': (0.66, 0.0001, 'USD', 0.92, 100_000),
+    'EURGBP': (0.86, 0.0001, 'GBP', 1.16, 100_000),
+    'BTCUSD': (42000.0, 1.0, 'USD', 0.92, 2),
+}
+
+
+def timestamps(values: np.ndarray) -> list:
+    # 2024-01-01 00:02:02.154569, utils.ISO_DATE_FORMAT
+    return [value.replace('T', ' ') for value in np.datetime_as_string(values, unit='us')]
+
+
+def prices(values: np.ndarray, decimals: np.ndarray) -> list:
+    return [f"{value:.{places}f}" for value, places in zip(values.tolist(), decimals.tolist())]
+
+
+def generate_chunk(random: np.random.Generator, first: int, count: int, opened_from: np.datetime64,
+                   missing_event_rate: float, missing_level_rate: float) -> tuple:
+    """(trades text, events text, next open time, events written, trades without an opening event)."""
+    number = np.arange(first, first + count)
+    names = np.array(list(PAIRS))
+    pair = random.integers(0, len(names), count)
+    base, pip, quote, rate, typical_amount = (np.array([PAIRS[name][i] for name in names]) for i in range(5))
+    decimals = np.where(pip[pair] >= 0.01, 3, 5) - np.where(pip[pair] >= 1, 2, 0)
+
+    buy = random.random(count) < 0.5
+    # A slow random walk per pair keeps prices realistic over millions of trades
+    open_price = base[pair] * (1 + 0.05 * np.sin(number / 500_000 + pair)) * (1 + random.normal(0, 0.001, count))
+    move = random.normal(0.0, 15.0, count) * pip[pair]
+    close_price = open_price + move
+    amount = np.maximum(np.round(typical_amount[pair] * random.lognormal(-0.5, 1, count)), 1).astype(np.int64)
+    direction = np.where(buy, 1.0, -1.0)
+    pips = np.round((close_price - open_price) / pip[pair] * direction, 1)
+    profit_loss_quote = np.round((close_price - open_price) * direction * amount, 2)
+    profit_loss_account = np.round(profit_loss_quote * rate[pair], 2)
+    take_profit = open_price + direction * random.uniform(5, 40, count) * pip[pair]
+    stop_loss = open_price - direction * random.uniform(5, 40, count) * pip[pair]
+
+    gaps = random.exponential(30_000_000, count).astype(np.int64) + 1  # about a trade every 30 s
+    opened = opened_from + np.cumsum(gaps).astype('timedelta64[us]')
+    closed = opened + (random.lognormal(5, 1.5, count) * 1_000_000).astype(np.int64).astype('timedelta64[us]')
+    updated = closed + random.integers(0, 5_000, count).astype('timedelta64[us]')
+
+    pair_text = names[pair].tolist()
+    side = np.where(buy, 'Buy', 'Sell').tolist()
+    open_text, close_text = prices(open_price, decimals), prices(close_price, decimals)
+    take_profit_text, stop_loss_text = prices(take_profit, decimals), prices(stop_loss, decimals)
+    opened_text, closed_text, updated_text = timestamps(opened), timestamps(closed), timestamps(updated)
+    currency = quote[pair].tolist()
+    base_currency = [name[:3] for name in pair_text]
+    uids = [f"{value:012x}-{value * 2654435761 % 2 ** 32:08x}" for value in number.tolist()]
+
+    trades = []
+    for i in range(count):
+        trades.append(f"{side[i]}\n{pair_text[i]}\n{amount[i]} {base_currency[i]}\n{open_text[i]}\n{close_text[i]}\n"
+                      f"Closed\n{pips[i]:.1f} pips\t{profit_loss_quote[i]:.2f} {currency[i]}\t"
+                      f"{profit_loss_account[i]:.2f} {ACCOUNT_CURRENCY}\n{number[i] + 1_000_000}\n{updated_text[i]}\n"
+                      f"{closed_text[i]}\n{uids[i]}\n")
+
+    # Opening and closing events of the chunk in time order
+    has_event = random.random(count) >= missing_event_rate
+    no_take_profit = random.random(count) < missing_level_rate
+    no_stop_loss = random.random(count) < missing_level_rate
+    events = []
+    for i in np.argsort(np.concatenate([opened, closed]), kind='stable').tolist():
+        if i < count:
+            if not has_event[i]:
+                continue
+            take_profit_value = '' if no_take_profit[i] else take_profit_text[i]
+            stop_loss_value = '' if no_stop_loss[i] else stop_loss_text[i]
+            events.append(f"Trade Opened\nType: {side[i]} ; Market: {pair_text[i]} ; Amount: {amount[i]} ; "
+                          f"Open: {open_text[i]} ; TP: {take_profit_value} ; SL: {stop_loss_value}\n"
+                          f"{number[i] * 2 + 5_000_000}\n{uids[i]}\n{opened_text[i]}\n{ACCOUNT_CURRENCY}\n")
+        else:
+            i -= count
+            events.append(f"Trade Closed\nType: {side[i]} ; Market: {pair_text[i]} ; Close: {close_text[i]} ; "
+                          f"P/L: {profit_loss_account[i]:.2f}\n{number[i] * 2 + 5_000_001}\n{uids[i]}\n"
+                          f"{closed_text[i]}\n{ACCOUNT_CURRENCY}\n")
+    return ''.join(trades), ''.join(events), opened[-1], len(events), int((~has_event).sum())
+
+
+def generate(directory, trades: int, seed: int = 0, missing_event_rate: float = 0.0,
+             missing_level_rate: float = 0.0, malformed_at: int = None, partial_tail: bool = False) -> dict:
+    """Write a trades.txt/events.txt pair of trades closed trades to directory, in Torobase's record formats.
+
+    missing_event_rate of the trades get no "Trade Opened" event and missing_level_rate of the events have
+    an empty TP or SL. malformed_at is the number of a trade written with an amount that doesn't parse, the
+    readers stop there. partial_tail leaves half a trade at the end, as while Torobase is writing one.
+    Returns what the readers should find, also written to directory/expected.json.
+    """
+    directory = Path(directory)
+    os.makedirs(directory, exist_ok=True)
+    random = np.random.default_rng(seed)
+    expected = {'trades': trades, 'readable_trades': trades if malformed_at is None else min(malformed_at, trades),
+                'events': 0, 'trades_without_event': 0}
+
+    opened_from = START_TIME
+    with open(directory / "trades.txt", 'w') as trades_file, open(directory / "events.txt", 'w') as events_file:
+        for first in range(0, trades, GENERATE_CHUNK):
+            count = min(GENERATE_CHUNK, trades - first)
+            trades_text, events_text, opened_from, events, without_event = generate_chunk(
+                random, first, count, opened_from, missing_event_rate, missing_level_rate)
+            if malformed_at is not None and first <= malformed_at < first + count:
+                records = trades_text.split('\n')
+                amount_line = (malformed_at - first) * 11 + 2
+                records[amount_line] = 'n/a ' + records[amount_line].split(' ')[1]
+                trades_text = '\n'.join(records)
+            trades_file.write(trades_text)
+            events_file.write(events_text)
+            expected['events'] += events
+            expected['trades_without_event'] += without_event
+            logging.info(f"Generated {first + count}/{trades} trades")
+
+        if partial_tail:
+            trades_file.write("Buy\nEURUSD\n1000 EUR\n1.08")
+
+    expected['trades_bytes'] = os.path.getsize(directory / "trades.txt")
+    expected['events_bytes'] = os.path.getsize(directory / "events.txt")
+    with open(directory / "expected.json", 'w') as file:
+        json.dump(expected, file, indent=2)
+    return expected
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Write synthetic Torobase trades.txt/events.txt files")
+    parser.add_argument('directory')
+    parser.add_argument('trades', type=int)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--missing-event-rate', type=float, default=0.0)
+    parser.add_argument('--missing-level-rate', type=float, default=0.0, help="events with an empty TP or SL")
+    parser.add_argument('--malformed-at', type=int, help="trade number written with an amount that doesn't parse")
+    parser.add_argument('--partial-tail', action='store_true', help="end trades.txt with half a record")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    print(json.dumps(generate(args.directory, args.trades, args.seed, args.missing_event_rate,
+                              args.missing_level_rate, args.malformed_at, args.partial_tail), indent=2))
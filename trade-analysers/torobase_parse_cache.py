@@ -0,0 +1,148 @@
+import hashlib
+import json
+import logging
+import os
+from pathlib import Path
+
+import numpy as np
+
+import utils
+from torobase_fast_parser import EVENT_COLUMNS, TRADE_COLUMNS, last_line_end, parse_events, parse_trades
+
+CACHE_VERSION = 1
+FINGERPRINT_BYTES = 4096
+
+
+class ParseCache:
+    """Parsed columns of an append-only Torobase file, kept in a sidecar directory next to it.
+
+    Every column is a raw array file in {file}.cache that only ever grows. {file}.cache/meta.json records
+    the file's identity, size and mtime, how many rows the column files hold, the byte offset parsing
+    stopped at and hashes of the bytes at the start of the file and just before that offset. A load
+    parses only the bytes after the offset, appends the new rows and memory maps the columns, so an
+    unchanged file costs a stat and a few mmaps. A file that was replaced, truncated or rewritten is parsed
+    again from the start.
+
+    Only newline terminated records are cached, a record that is still being written is picked up by a
+    later load. One process at a time may load a given file.
+    """
+
+    def __init__(self, filename, parse, columns: list):
+        self.filename = Path(filename)
+        self.directory = self.filename.with_name(f"{self.filename.name}.cache")
+        self.meta_path = self.directory / "meta.json"
+        self.parse = parse
+        self.columns = columns
+
+    def load(self, workers: int = None) -> dict:
+        stat = os.stat(self.filename)
+        meta = self.read_meta(stat)
+        if meta is not None and meta['size'] == stat.st_size and meta['mtime_ns'] == stat.st_mtime_ns:
+            return self.read_columns(meta)
+
+        if meta is None:
+            meta = {'version': CACHE_VERSION, 'device': stat.st_dev, 'inode': stat.st_ino, 'offset': 0, 'rows': 0,
+                    'files': {}}
+        offset = meta['offset']
+        tail = self.parse(self.filename, workers, start=offset, end=last_line_end(self.filename))
+        os.makedirs(self.directory, exist_ok=True)
+        if tail['end'] > offset or not meta['files']:  # an empty file still gets its (empty) columns
+            self.append_columns(meta, tail)
+            logging.info(f"Parsed {tail['end'] - offset} new bytes of {self.filename}")
+
+        meta.update({'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns, 'offset': tail['end'],
+                     **self.fingerprint(tail['end'])})
+        utils.atomic_write(self.meta_path, json.dumps(meta, indent=2))
+        self.remove_unused_files(meta['files'])
+        return self.read_columns(meta)
+
+    def read_meta(self, stat):
+        """The cache's meta data when it still describes the start of the file, None otherwise."""
+        try:
+            with open(self.meta_path, 'r') as file:
+                meta = json.load(file)
+        except FileNotFoundError:
+            return None
+        except json.JSONDecodeError:
+            logging.error(f"Error parsing JSON from {self.meta_path}, parsing {self.filename} again")
+            return None
+
+        if (meta.get('version') != CACHE_VERSION or meta['device'] != stat.st_dev or meta['inode'] != stat.st_ino
+                or meta['offset'] > stat.st_size or sorted(meta['files']) != sorted(self.columns)
+                or not all(self.column_complete(meta, column) for column in self.columns)
+                or self.fingerprint(meta['offset']) != {key: meta[key] for key in ('head_hash', 'tail_hash')}):
+            logging.info(f"{self.filename} has changed, parsing it again")
+            return None
+        return meta
+
+    def column_complete(self, meta: dict, column: str) -> bool:
+        path = self.directory / meta['files'][column]
+        return path.exists() and path.stat().st_size >= meta['rows'] * column_dtype(meta, column).itemsize
+
+    def fingerprint(self, offset: int) -> dict:
+        with open(self.filename, 'rb') as file:
+            head = file.read(min(offset, FINGERPRINT_BYTES))
+            file.seek(max(offset - FINGERPRINT_BYTES, 0))
+            tail = file.read(min(offset, FINGERPRINT_BYTES))
+        return {'head_hash': hashlib.blake2b(head).hexdigest(), 'tail_hash': hashlib.blake2b(tail).hexdigest()}
+
+    def append_columns(self, meta: dict, tail: dict):
+        """Append the tail's rows to the column files, meta['rows'] and meta['files'] follow."""
+        rows = meta['rows']
+        for column in self.columns:
+            # Strings are fixed width unicode arrays, a column is rewritten wider when a longer string turns up
+            values = tail[column] if isinstance(tail[column], np.ndarray) else np.array(tail[column], dtype=str)
+            if column not in meta['files']:
+                meta['files'][column] = column_file(column, values.dtype)
+            elif values.dtype.kind == 'U' and values.dtype.itemsize > column_dtype(meta, column).itemsize:
+                self.widen_column(meta, column, values.dtype)
+            dtype = column_dtype(meta, column)
+
+            with open(self.directory / meta['files'][column], 'ab') as file:
+                # Rows a crashed load appended past meta['rows'] are dropped first
+                file.truncate(rows * dtype.itemsize)
+                file.write(values.astype(dtype, copy=False).tobytes())
+                file.flush()
+                os.fsync(file.fileno())
+        meta['rows'] = rows + len(tail[self.columns[0]])
+
+    def widen_column(self, meta: dict, column: str, dtype: np.dtype):
+        # Written under a new name, meta.json keeps pointing at the old file until the load completes
+        values = self.read_column(meta, column).astype(dtype)
+        meta['files'][column] = column_file(column, dtype)
+        with open(self.directory / meta['files'][column], 'wb') as file:
+            file.write(values.tobytes())
+
+    def read_column(self, meta: dict, column: str) -> np.ndarray:
+        dtype = column_dtype(meta, column)
+        if meta['rows'] == 0:
+            return np.empty(0, dtype=dtype)
+        return np.memmap(self.directory / meta['files'][column], dtype=dtype, mode='r',
+                         shape=(meta['rows'],)).view(np.ndarray)
+
+    def read_columns(self, meta: dict) -> dict:
+        return {column: self.read_column(meta, column) for column in self.columns}
+
+    def remove_unused_files(self, files: dict):
+        for path in self.directory.glob("*.bin"):
+            if path.name not in files.values():
+                path.unlink(missing_ok=True)
+
+
+def column_file(column: str, dtype: np.dtype) -> str:
+    # e.g. uid.U10.bin, updated.M8[ns].bin
+    return f"{column}.{dtype.str.lstrip('<>|=')}.bin"
+
+
+def column_dtype(meta: dict, column: str) -> np.dtype:
+    return np.dtype(meta['files'][column].split('.')[1])
+
+
+def load_trades(filename, workers: int = None) -> dict:
+    """parse_trades of a whole trades.txt through its ParseCache, columns come back as read-only numpy arrays."""
+    return ParseCache(filename, parse_trades, TRADE_COLUMNS).load(workers)
+
+
+def load_events(filename, workers: int = None) -> dict:
+    """parse_events of a whole events.txt through its ParseCache, columns come back as read-only numpy arrays."""
+    return ParseCache(filename, parse_events, EVENT_COLUMNS).load(workers)
@@ -0,0 +1,138 @@
+import argparse
+import base64
+import html
+import io
+import json
+import logging
+import sys
+from pathlib import Path
+
+import utils
+from torobase_trade_reader import TorobaseTradeReader
+from trade_analytics import analyze, to_json_ready
+
+FORMATS = ['png', 'html', 'json']
+
+
+def pyplot():
+    # Imported on first use, matplotlib takes longer to import than a JSON only report takes to write
+    import matplotlib
+    matplotlib.use('Agg')  # reports are written on servers without a display
+    import matplotlib.pyplot as plt
+    return plt
+
+
+def plot(analytics: dict, title: str):
+    figure, axes = pyplot().subplots(2, 2, figsize=(14, 9))
+    figure.suptitle(title)
+
+    for name, label in (('winner_duration_histogram', 'Winners'), ('loser_duration_histogram', 'Losers')):
+        histogram = analytics[name]
+        axes[0][0].stairs(histogram['counts'], histogram['edges'], label=label, fill=True, alpha=0.5)
+    axes[0][0].set_title('Trade Duration Histogram')
+    axes[0][0].set_xlabel('Duration (seconds)')
+    axes[0][0].set_ylabel('Number of Trades')
+    axes[0][0].legend()
+
+    currency = f" ({analytics['overview']['currency']})" if analytics['overview']['currency'] else ''
+    for axis, name, label in ((axes[0][1], 'profit_loss_histogram', f'Profit/Loss{currency}'),
+                              (axes[1][0], 'pips_histogram', 'Pips')):
+        histogram = analytics[name]
+        axis.stairs(histogram['counts'], histogram['edges'], fill=True, edgecolor='k', alpha=0.7)
+        axis.set_title(f'{label} Distribution')
+        axis.set_xlabel(label)
+        axis.set_ylabel('Number of Trades')
+
+    by_hour = analytics['breakdowns']['hour']
+    axes[1][1].bar(by_hour.index, by_hour['profit_loss'], color=['g' if value > 0 else 'r' for value in
+                                                                 by_hour['profit_loss']])
+    axes[1][1].set_title(f'Profit/Loss{currency} by Hour Opened')
+    axes[1][1].set_xlabel('Hour')
+    axes[1][1].set_xticks(range(0, 24, 2))
+
+    figure.tight_layout()
+    return figure
+
+
+def png_bytes(analytics: dict, title: str) -> bytes:
+    figure = plot(analytics, title)
+    buffer = io.BytesIO()
+    figure.savefig(buffer, format='png', dpi=100)
+    pyplot().close(figure)
+    return buffer.getvalue()
+
+
+def render_html(analytics: dict, title: str, png: bytes) -> str:
+    overview = ''.join(f"<tr><th>{html.escape(name)}</th><td>{html.escape(format_value(value))}</td></tr>"
+                       for name, value in analytics['overview'].items())
+    breakdowns = ''.join(f"<h2>By {name}</h2>{breakdown.to_html(float_format=lambda value: f'{value:.4g}')}"
+                         for name, breakdown in analytics['breakdowns'].items())
+    image = base64.b64encode(png).decode('ascii')
+    return (f"<!DOCTYPE html><html><head><meta charset='utf-8'><title>{html.escape(title)}</title></head><body>"
+            f"<h1>{html.escape(title)}</h1><table>{overview}</table>"
+            f"<img src='data:image/png;base64,{image}' alt='charts'>{breakdowns}</body></html>")
+
+
+def format_value(value) -> str:
+    if isinstance(value, float):
+        return f"{value:.4g}"
+    if isinstance(value, list):
+        return ', '.join(value)
+    return str(value)
+
+
+def write_reports(analytics: dict, name: str, output: Path, formats: list):
+    """Write one account's reports, the charts are drawn once and shared by the PNG and the HTML."""
+    output.mkdir(parents=True, exist_ok=True)
+    title = f"Torobase trades: {name}"
+    png = png_bytes(analytics, title) if 'png' in formats or 'html' in formats else None
+    if 'png' in formats:
+        (output / f"{name}.png").write_bytes(png)
+    if 'html' in formats:
+        (output / f"{name}.html").write_text(render_html(analytics, title, png), encoding='utf-8')
+    if 'json' in formats:
+        with open(output / f"{name}.json", 'w') as file:
+            json.dump(to_json_ready(analytics), file, indent=2)
+    logging.info(f"Wrote {', '.join(formats)} reports for {name} to {output}")
+
+
+def account_name(directory: Path) -> str:
+    # accounts/1234/torobase is account "1234", the default ~/.pyScalpie/torobase stays "torobase"
+    parent = directory.parent.name
+    if directory.name == 'torobase' and parent and not parent.startswith('.'):
+        return parent
+    return directory.name
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Write trade reports for Torobase accounts without a display")
+    parser.add_argument('accounts', nargs='*', type=Path,
+                        help="directories holding trades.txt and events.txt, or trades.txt files "
+                             "(default: the torobase directory under PYSCALPIE_DIR)")
+    parser.add_argument('--output', type=Path, default=Path('reports'), help="directory the reports are written to")
+    parser.add_argument('--formats', nargs='+', choices=FORMATS, default=FORMATS)
+    parser.add_argument('--workers', type=int, help="processes used to parse each file")
+    parser.add_argument('--no-cache', action='store_true', help="parse the files again instead of using the cache")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    directories = [path.parent if path.is_file() else path for path in args.accounts] \
+        or [utils.PYSCALPIE_PATH / "torobase"]
+    failed = []
+    for directory in directories:
+        # One unreadable or mixed currency account doesn't cost the others their reports
+        try:
+            table = TorobaseTradeReader(directory).read_table(args.workers, cache=not args.no_cache)
+            write_reports(analyze(table), account_name(directory), args.output, args.formats)
+        except Exception:
+            logging.exception(f"Writing the reports of {directory} failed")
+            failed.append(directory)
+
+    if failed:
+        logging.error(f"No reports for {len(failed)} of {len(directories)} accounts: "
+                      f"{', '.join(str(directory) for directory in failed)}")
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
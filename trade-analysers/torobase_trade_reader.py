@@ -1,70 +1,71 @@
 import logging
+from pathlib import Path
+
+import numpy as np
 
 import utils
 from torobase_event_reader import TorobaseEventReader
+from torobase_fast_parser import parse_events, parse_trades
+from torobase_parse_cache import load_events, load_trades
 from trade import Trade
+from trade_table import TradeTable
 
 
 class TorobaseTradeReader:
-    def __init__(self):
-        self.filename = utils.PYSCALPIE_PATH / "torobase" / "trades.txt"
+    def __init__(self, directory=None):
+        self.directory = Path(directory or utils.PYSCALPIE_PATH / "torobase")
+        self.filename = self.directory / "trades.txt"
         self.trades = []
 
-    def read_trades(self):
-        event_reader = TorobaseEventReader()
-        events = event_reader.read_events()
-
-        with open(self.filename, 'r') as file:
-            while True:
-                try:
-                    transaction_type = file.readline().strip()
-                    if not transaction_type:
-                        break
-                    currency_pair = file.readline().strip()
-                    amount = float(file.readline().strip().split(' ')[0])
-                    open_price = float(file.readline().strip())
-                    close_price = float(file.readline().strip())
-                    status = file.readline().strip()
-
-                    profit_loss = file.readline().strip().split('\t')
-                    profit_loss_pips = float(profit_loss[0].split(' ')[0])
-                    currency_1 = profit_loss[1].split(' ')
-                    profit_loss_curr_1_value = float(currency_1[0])
-                    profit_loss_curr_1 = currency_1[1]
-                    currency_2 = profit_loss[2].split(' ')
-                    profit_loss_curr_2_value = float(currency_2[0])
-                    profit_loss_curr_2 = currency_2[1]
-
-                    settlement_id = file.readline().strip()
-                    updated = utils.get_datetime_iso(file.readline().strip())
-                    created = utils.get_datetime_iso(file.readline().strip())
-                    uid = file.readline().strip()
-
-                    # marry up event with UID.
-                    event_info = events.get(uid, None)
+    def read_trades(self, workers=None, cache=True):
+        """All trades as Trade objects, the same records as read_table: trades without an opening event are
+        included with None SL/TP and event timestamp."""
+        event_reader = TorobaseEventReader(self.directory)
+        events = event_reader.read_events(workers, cache)
 
-                    stop_loss = None
-                    take_profit = None
-                    event_timestamp = None
+        columns = load_trades(self.filename, workers) if cache else parse_trades(self.filename, workers)
+        for name in ('transaction_type', 'currency_pair', 'status', 'profit_loss_curr_1', 'profit_loss_curr_2',
+                     'settlement_id', 'uid'):
+            columns[name] = np.asarray(columns[name]).tolist()  # cached string columns are numpy arrays
+        updated = columns['updated'].astype('datetime64[us]').tolist()
+        created = columns['created'].astype('datetime64[us]').tolist()
+        without_event = 0
+        for i, uid in enumerate(columns['uid']):
+            try:
+                # marry up event with UID, like read_table a trade without its opening event has no SL/TP or time
+                event_info = events.get(uid)
+                if event_info is None:
+                    without_event += 1
+                    event_info = {"stop_loss": None, "take_profit": None, "timestamp": None}
 
-                    if event_info is None:
-                        logging.error(f"Missing event info for UID: {uid}")
-                    else:
-                        stop_loss = event_info["stop_loss"]
-                        take_profit = event_info["take_profit"]
-                        event_timestamp = event_info["timestamp"]
+                extracted_trade = Trade(columns['transaction_type'][i], columns['currency_pair'][i],
+                                        float(columns['amount'][i]), float(columns['open_price'][i]),
+                                        float(columns['close_price'][i]), columns['status'][i],
+                                        float(columns['profit_loss_pips'][i]),
+                                        float(columns['profit_loss_curr_1_value'][i]), columns['profit_loss_curr_1'][i],
+                                        float(columns['profit_loss_curr_2_value'][i]), columns['profit_loss_curr_2'][i],
+                                        event_info["stop_loss"], event_info["take_profit"], event_info["timestamp"],
+                                        columns['settlement_id'][i], updated[i], created[i], uid)
+                self.trades.append(extracted_trade)
+            except Exception:
+                logging.exception(f"Error reading the trade with UID {uid}, stopping there")
+                break
 
-                    extracted_trade = Trade(transaction_type, currency_pair, amount, open_price, close_price, status,
-                                            profit_loss_pips, profit_loss_curr_1_value, profit_loss_curr_1,
-                                            profit_loss_curr_2_value, profit_loss_curr_2, stop_loss, take_profit,
-                                            event_timestamp, settlement_id, updated, created, uid)
-                    self.trades.append(extracted_trade)
-                except Exception as e:
-                    print(f"Error occurred: {str(e)}")
-                    break
+        if without_event:
+            logging.warning(f"{without_event} trades have no opening event, their SL, TP and event time are None")
+        logging.info(f"Found {len(self.trades)} trades")
+        return self.trades
 
-            logging.info(f"Found {len(self.trades)} trades")
-            return self.trades
+    def read_table(self, workers=None, cache=True):
+        """All trades as a TradeTable, trades without an opening event included with NaN SL/TP and a NaT event
+        timestamp. read_trades returns the same records as Trade objects."""
+        events_filename = TorobaseEventReader(self.directory).filename
+        if cache:
+            table = TradeTable.from_columns(load_trades(self.filename, workers), load_events(events_filename, workers))
+        else:
+            table = TradeTable.from_columns(parse_trades(self.filename, workers), parse_events(events_filename, workers))
+        logging.info(f"Found {len(table)} trades")
+        return table
 
 
 if __name__ == '__main__':
@@ -73,4 +74,4 @@ if __name__ == '__main__':
 
     # Displaying the trades
     for trade in trade_reader.trades:
-        print(vars(trade))
+        print(trade.to_dict())
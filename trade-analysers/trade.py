@@ -1,4 +1,9 @@
 class Trade:
+    __slots__ = ('transaction_type', 'currency_pair', 'amount', 'open_price', 'close_price', 'status',
+                 'profit_loss_pips', 'profit_loss_curr_1_value', 'profit_loss_curr_1', 'profit_loss_curr_2_value',
+                 'profit_loss_curr_2', 'stop_loss', 'take_profit', 'event_timestamp', 'trade_duration',
+                 'settlement_id', 'updated', 'created', 'uid')
+
     def __init__(self, transaction_type, currency_pair, amount, open_price, close_price, status, profit_loss_pips,
                  profit_loss_curr_1_value, profit_loss_curr_1, profit_loss_curr_2_value, profit_loss_curr_2,
                  stop_loss, take_profit, event_timestamp, settlement_id, updated, created, uid):
@@ -16,8 +21,11 @@ class Trade:
         self.stop_loss = stop_loss
         self.take_profit = take_profit
         self.event_timestamp = event_timestamp
-        self.trade_duration = updated - event_timestamp
+        self.trade_duration = updated - event_timestamp if event_timestamp is not None else None
         self.settlement_id = settlement_id
         self.updated = updated
         self.created = created
-        self.uid = uid
\ No newline at end of file
+        self.uid = uid
+
+    def to_dict(self):
+        return {name: getattr(self, name) for name in self.__slots__}
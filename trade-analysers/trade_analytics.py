@@ -0,0 +1,83 @@
+import numpy as np
+
+from trade_table import ACCOUNT_PROFIT_LOSS, TradeTable
+
+DURATION_BINS = np.arange(0, 121)  # one second bins up to two minutes, as TorobaseAnalyzer always plotted
+DISTRIBUTION_BINS = 50
+
+
+def histogram(values: np.ndarray, bins) -> dict:
+    """np.histogram of the finite values, as lists so it serialises to JSON."""
+    values = np.asarray(values, dtype=np.float64)
+    counts, edges = np.histogram(values[np.isfinite(values)], bins=bins)
+    return {'counts': counts.tolist(), 'edges': edges.tolist()}
+
+
+def overview(table: TradeTable) -> dict:
+    """Totals, averages and drawdown of the P&L in the account currency."""
+    currencies = sorted(table.df['profit_loss_curr_2'].dropna().unique().tolist())
+    if len(currencies) > 1:
+        raise ValueError(f"Trades settled in {', '.join(currencies)}, analyze one account currency at a time")
+    profit_loss = table.df[ACCOUNT_PROFIT_LOSS].to_numpy()
+    pips = table.df['profit_loss_pips'].to_numpy()
+    wins = profit_loss[profit_loss > 0]
+    losses = profit_loss[profit_loss < 0]
+    durations = table.duration_seconds()
+    gross_loss = -losses.sum()
+
+    return {
+        'trades': len(table),
+        'wins': len(wins),
+        'losses': len(losses),
+        'win_rate': table.win_rate() if len(table) else None,
+        'profit_loss': float(profit_loss.sum()),
+        'average_win': float(wins.mean()) if len(wins) else None,
+        'average_loss': float(losses.mean()) if len(losses) else None,
+        'profit_factor': float(wins.sum() / gross_loss) if gross_loss > 0 else None,
+        'expectancy': float(profit_loss.mean()) if len(profit_loss) else None,
+        'pips': float(pips.sum()),
+        'max_drawdown': max_drawdown(profit_loss),
+        'median_duration_seconds': float(np.nanmedian(durations)) if np.isfinite(durations).any() else None,
+        'currency': currencies[0] if currencies else None,
+    }
+
+
+def max_drawdown(profit_loss: np.ndarray) -> float:
+    """Largest fall of the running P&L from its previous peak, trades taken in file order."""
+    if len(profit_loss) == 0:
+        return 0.0
+    equity = np.cumsum(profit_loss)
+    return float((np.maximum.accumulate(np.maximum(equity, 0)) - equity).max())
+
+
+def breakdowns(table: TradeTable) -> dict:
+    """TradeTable.summary per currency pair, per hour the trade was opened and per side."""
+    by_hour = table.summary(table.hours_opened())
+    by_hour.index = by_hour.index.astype(int).rename('hour')
+    return {
+        'pair': table.summary('currency_pair'),
+        'hour': by_hour,
+        'side': table.summary('transaction_type'),
+    }
+
+
+def analyze(table: TradeTable, duration_bins=DURATION_BINS, distribution_bins=DISTRIBUTION_BINS) -> dict:
+    """Everything the reports show, computed once per table. Breakdowns are DataFrames, the rest plain values."""
+    winners = table.winners()
+    losers = table.losers()
+    return {
+        'overview': overview(table),
+        'breakdowns': breakdowns(table),
+        'profit_loss_histogram': histogram(table.df[ACCOUNT_PROFIT_LOSS], distribution_bins),
+        'pips_histogram': histogram(table.df['profit_loss_pips'], distribution_bins),
+        'winner_duration_histogram': histogram(winners.duration_seconds(), duration_bins),
+        'loser_duration_histogram': histogram(losers.duration_seconds(), duration_bins),
+    }
+
+
+def to_json_ready(analytics: dict) -> dict:
+    """analyze()'s result with every DataFrame turned into a list of records."""
+    result = dict(analytics)
+    result['breakdowns'] = {name: breakdown.reset_index().replace({np.nan: None}).to_dict(orient='records')
+                            for name, breakdown in analytics['breakdowns'].items()}
+    return result
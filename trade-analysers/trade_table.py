@@ -0,0 +1,148 @@
+import numpy as np
+import pandas as pd
+
+from trade import Trade
+
+NAT = np.iinfo(np.int64).min  # int64 value of NaT, marks a missing timestamp
+# P&L in the account currency, profit_loss_curr_1_value is in each pair's own quote currency and can't be summed
+ACCOUNT_PROFIT_LOSS = 'profit_loss_curr_2_value'
+CATEGORY_COLUMNS = ['transaction_type', 'currency_pair', 'status', 'profit_loss_curr_1', 'profit_loss_curr_2']
+FLOAT_COLUMNS = ['amount', 'open_price', 'close_price', 'profit_loss_pips', 'profit_loss_curr_1_value',
+                 'profit_loss_curr_2_value', 'stop_loss', 'take_profit']
+TIMESTAMP_COLUMNS = ['event_timestamp', 'updated', 'created']
+COLUMNS = ['transaction_type', 'currency_pair', 'amount', 'open_price', 'close_price', 'status', 'profit_loss_pips',
+           'profit_loss_curr_1_value', 'profit_loss_curr_1', 'profit_loss_curr_2_value', 'profit_loss_curr_2',
+           'stop_loss', 'take_profit', 'event_timestamp', 'settlement_id', 'updated', 'created', 'uid']
+
+
+class TradeTable:
+    """Trades stored column by column instead of one Trade object each.
+
+    Pairs, transaction types, statuses and currencies are categoricals, prices and values float64 and
+    timestamps int64 nanoseconds since the epoch (NAT when missing). Filters return new tables,
+    indexing a single row returns a Trade view of it.
+    """
+
+    def __init__(self, df: pd.DataFrame):
+        self.df = df
+
+    @classmethod
+    def from_columns(cls, trades: dict, events: dict):
+        """Build from torobase_fast_parser.parse_trades/parse_events columns, joined on uid."""
+        df = pd.DataFrame({name: trades[name] for name in COLUMNS if name in trades})
+        for name in CATEGORY_COLUMNS:
+            df[name] = df[name].astype('category')
+        for name in ('updated', 'created'):
+            df[name] = np.asarray(trades[name], dtype='datetime64[ns]').view(np.int64)
+
+        # Same as the dict the event reader builds: the last event of a uid wins
+        event_index = pd.Index(events['uid'])
+        last_event = ~event_index.duplicated(keep='last')
+        positions = event_index[last_event].get_indexer(df['uid'])
+        found = positions >= 0
+        for name in ('take_profit', 'stop_loss'):
+            values = np.asarray(events[name], dtype=np.float64)[last_event]
+            df[name] = np.where(found, values[positions], np.nan)
+        timestamps = np.asarray(events['timestamp'], dtype='datetime64[ns]').view(np.int64)[last_event]
+        df['event_timestamp'] = np.where(found, timestamps[positions], NAT)
+
+        return cls(df[COLUMNS])
+
+    @classmethod
+    def from_trades(cls, trades: list):
+        columns = {name: [getattr(trade, name) for trade in trades] for name in COLUMNS}
+        df = pd.DataFrame(columns, columns=COLUMNS)
+        for name in CATEGORY_COLUMNS:
+            df[name] = df[name].astype('category')
+        for name in FLOAT_COLUMNS:
+            df[name] = df[name].astype(np.float64)
+        for name in TIMESTAMP_COLUMNS:
+            df[name] = pd.to_datetime(df[name]).to_numpy(dtype='datetime64[ns]').view(np.int64)
+        return cls(df)
+
+    def __len__(self):
+        return len(self.df)
+
+    def __getitem__(self, index):
+        if isinstance(index, (int, np.integer)):
+            return self.row(index)
+        return TradeTable(self.df[index] if isinstance(index, (np.ndarray, pd.Series)) else self.df.iloc[index])
+
+    def __iter__(self):
+        for index in range(len(self.df)):
+            yield self.row(index)
+
+    def row(self, index: int) -> Trade:
+        values = self.df.iloc[index]
+        timestamps = {name: None if values[name] == NAT else pd.Timestamp(values[name]).to_pydatetime()
+                      for name in TIMESTAMP_COLUMNS}
+        return Trade(values['transaction_type'], values['currency_pair'], values['amount'], values['open_price'],
+                     values['close_price'], values['status'], values['profit_loss_pips'],
+                     values['profit_loss_curr_1_value'], values['profit_loss_curr_1'],
+                     values['profit_loss_curr_2_value'], values['profit_loss_curr_2'],
+                     None if np.isnan(values['stop_loss']) else values['stop_loss'],
+                     None if np.isnan(values['take_profit']) else values['take_profit'],
+                     timestamps['event_timestamp'], values['settlement_id'], timestamps['updated'],
+                     timestamps['created'], values['uid'])
+
+    def to_trades(self) -> list:
+        return list(self)
+
+    def where(self, mask):
+        return TradeTable(self.df[np.asarray(mask)])
+
+    def for_pair(self, currency_pair: str):
+        return self.where(self.df['currency_pair'] == currency_pair)
+
+    def of_type(self, transaction_type: str):
+        return self.where(self.df['transaction_type'] == transaction_type)
+
+    def opened_between(self, start, end):
+        start = pd.Timestamp(start).value
+        end = pd.Timestamp(end).value
+        opened = self.df['event_timestamp'].to_numpy()
+        return self.where((opened != NAT) & (opened >= start) & (opened < end))
+
+    def with_event(self):
+        return self.where(self.df['event_timestamp'] != NAT)
+
+    def winners(self):
+        return self.where(self.df['profit_loss_curr_1_value'] > 0)
+
+    def losers(self):
+        return self.where(self.df['profit_loss_curr_1_value'] < 0)
+
+    def durations(self) -> np.ndarray:
+        """Trade durations in nanoseconds, NAT for trades without an opening event."""
+        opened = self.df['event_timestamp'].to_numpy()
+        return np.where(opened != NAT, self.df['updated'].to_numpy() - opened, NAT)
+
+    def duration_seconds(self) -> np.ndarray:
+        durations = self.durations()
+        return np.where(durations != NAT, durations / 1e9, np.nan)
+
+    def hours_opened(self) -> np.ndarray:
+        """Hour of day (0-23) each trade was opened, NaN for trades without an opening event."""
+        opened = self.df['event_timestamp'].to_numpy()
+        return np.where(opened != NAT, (opened // 3_600_000_000_000) % 24, np.nan)
+
+    def win_rate(self) -> float:
+        return float((self.df['profit_loss_curr_1_value'] > 0).mean()) if len(self.df) else float('nan')
+
+    def total(self, column: str = ACCOUNT_PROFIT_LOSS) -> float:
+        return float(self.df[column].sum())
+
+    def summary(self, by='currency_pair') -> pd.DataFrame:
+        """Trade count, win rate, P&L in the account currency, pips and mean duration per value of by (a column or
+        list of columns)."""
+        df = self.df.assign(win=self.df['profit_loss_curr_1_value'] > 0, duration_seconds=self.duration_seconds())
+        return df.groupby(by, observed=True).agg(
+            trades=('uid', 'size'),
+            win_rate=('win', 'mean'),
+            profit_loss=(ACCOUNT_PROFIT_LOSS, 'sum'),
+            pips=('profit_loss_pips', 'sum'),
+            mean_duration_seconds=('duration_seconds', 'mean'),
+        )
+
+    def memory_usage(self) -> int:
+        return int(self.df.memory_usage(deep=True).sum())
@@ -1,12 +1,22 @@
+import io
+import mmap
 import os
 import zipfile
-from datetime import datetime
+from contextlib import contextmanager
+from datetime import datetime, timezone
 from pathlib import Path
 
 from loguru import logger
 
-PYSCALPIE_PATH = os.getenv('PYSCALPIE_DIR', Path.home() / ".pyScalpie")
+try:
+    import zstandard
+except ImportError:
+    zstandard = None  # optional, only needed for .zst files
+
+PYSCALPIE_PATH = Path(os.getenv('PYSCALPIE_DIR', Path.home() / ".pyScalpie"))
 ISO_DATE_FORMAT = "%Y-%m-%d %H:%M:%S.%f"
+CHUNK_BYTES = 1024 * 1024
+ZSTD_LEVEL = 3
 
 
 def get_current_datetime():
@@ -15,16 +25,61 @@ def get_current_datetime():
     return formatted_now
 
 
+def compressed_path(filepath):
+    """The file holding filepath's content: {filepath}.zip when it is a valid zip, else {filepath}.zst, else
+    the plain file."""
+    zip_path = Path(f"{filepath}.zip")
+    if zipfile.is_zipfile(zip_path):
+        return zip_path
+    zstd_path = Path(f"{filepath}.zst")
+    return zstd_path if zstd_path.exists() else Path(filepath)
+
+
+@contextmanager
+def open_binary(filepath):
+    """Read-only binary stream of filepath's content, decompressed on the fly when it is zipped or zstd."""
+    path = compressed_path(filepath)
+    if path == Path(filepath):
+        with open(path, 'rb') as file:
+            yield file
+    elif path.suffix == '.zip':
+        with zipfile.ZipFile(path, 'r') as z, z.open(os.path.basename(filepath)) as file:
+            yield file
+    else:
+        with open(path, 'rb') as raw, zstd_module().ZstdDecompressor().stream_reader(raw) as file:
+            yield file
+
+
+def iter_bytes(filepath, chunk_size: int = CHUNK_BYTES):
+    """filepath's content in blocks of up to chunk_size bytes, only one block is held at a time."""
+    with open_binary(filepath) as file:
+        while chunk := file.read(chunk_size):
+            yield chunk
+
+
+def iter_lines(filepath, encoding='utf-8'):
+    """filepath's lines without their line endings, read one buffer at a time."""
+    with open_binary(filepath) as file:
+        for line in io.TextIOWrapper(file, encoding=encoding, newline=''):
+            yield line.rstrip('\r\n')
+
+
+@contextmanager
+def map_file(filepath):
+    """Read-only mmap of a plain file, the OS pages it in as it is read. An empty file maps to b''."""
+    with open(filepath, 'rb') as file:
+        if os.fstat(file.fileno()).st_size == 0:
+            yield b''
+            return
+        with mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            yield mm
+
+
 def load_file(filepath):
     content = None
     try:
-        if zipfile.is_zipfile(f"{filepath}.zip"):
-            with zipfile.ZipFile(f"{filepath}.zip", 'r') as z:
-                with z.open(os.path.basename(filepath)) as file:
-                    content = file.read().decode('utf-8')
-        else:
-            with open(filepath, 'r') as file:
-                content = file.read()
+        with open_binary(filepath) as file:
+            content = file.read().decode('utf-8')
     except FileNotFoundError:
         logger.error(f"{filepath} not found.")
     except zipfile.BadZipFile:
@@ -38,7 +93,8 @@ def load_file(filepath):
 
 
 def get_unix_time(date_str: str) -> int:
-    dt = datetime.strptime(date_str, "%Y-%m-%d %H:%M")
+    """Milliseconds since the epoch of a "%Y-%m-%d %H:%M" date in UTC, the format of the latest-date cursors."""
+    dt = datetime.strptime(date_str, "%Y-%m-%d %H:%M").replace(tzinfo=timezone.utc)
     return int(dt.timestamp() * 1000)
 
 
@@ -46,14 +102,27 @@ def get_datetime_iso(date_str: str) -> datetime:
     return datetime.strptime(date_str, ISO_DATE_FORMAT)
 
 
-def save_file(filepath, content, zip_mode=False):
+def save_file(filepath, content, zip_mode=False, codec=None):
+    """Write content (str, bytes or an iterable of them) to filepath, {filepath}.zip or {filepath}.zst.
+
+    codec is None, 'zip' or 'zstd', zip_mode=True is the same as codec='zip'. The file is replaced
+    atomically, a crash leaves the previous version in place.
+    """
+    codec = codec or ('zip' if zip_mode else None)
     try:
-        if zip_mode:
-            with zipfile.ZipFile(f"{filepath}.zip", 'w') as z:
-                z.writestr(os.path.basename(filepath), content)
+        if codec == 'zip':
+            with atomic_open(f"{filepath}.zip") as raw, zipfile.ZipFile(raw, 'w', zipfile.ZIP_DEFLATED) as z, \
+                    z.open(os.path.basename(filepath), 'w', force_zip64=True) as file:
+                write_chunks(file, content)
+        elif codec == 'zstd':
+            with atomic_open(f"{filepath}.zst") as raw, \
+                    zstd_module().ZstdCompressor(level=ZSTD_LEVEL).stream_writer(raw, closefd=False) as file:
+                write_chunks(file, content)
+        elif codec is None:
+            with atomic_open(filepath) as file:
+                write_chunks(file, content)
         else:
-            with open(filepath, 'w') as file:
-                file.write(content)
+            raise ValueError(f"Unknown codec {codec}")
 
         logger.info(f"File saved at {filepath}")
     except IOError:
@@ -62,10 +131,42 @@ def save_file(filepath, content, zip_mode=False):
         logger.exception("An unexpected error occurred")
 
 
+def write_chunks(file, content):
+    for chunk in [content] if isinstance(content, (str, bytes)) else content:
+        file.write(chunk.encode('utf-8') if isinstance(chunk, str) else chunk)
+
+
+@contextmanager
+def atomic_open(filepath):
+    """Binary file to write filepath's new content to, renamed over filepath once the block completes.
+
+    Readers see the old or the new content, never a mix, and nothing is replaced when the block fails.
+    """
+    temp_filepath = f"{filepath}.tmp"
+    try:
+        with open(temp_filepath, 'wb') as file:
+            yield file
+            file.flush()
+            os.fsync(file.fileno())
+        os.replace(temp_filepath, filepath)
+    finally:
+        if os.path.exists(temp_filepath):
+            os.remove(temp_filepath)
+
+
+def atomic_write(filepath, content):
+    with atomic_open(filepath) as file:
+        write_chunks(file, content)
+
+
 def file_exists(filepath):
-    file = Path(filepath)
-    zip_file = Path(f"{filepath}.zip")
-    return file.exists() or zip_file.exists()
+    return any(Path(path).exists() for path in (filepath, f"{filepath}.zip", f"{filepath}.zst"))
+
+
+def zstd_module():
+    if zstandard is None:
+        raise ImportError("zstd files need the zstandard package, pip install zstandard")
+    return zstandard
 
 
 def get_path(filename):